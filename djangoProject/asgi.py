@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoProject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# przy starcie serwera, nie przez każdą komendę: tryb dziennika SQLite (WAL) w pliku bazy i indeks podpowiedzi
+# (stats.search), żeby pierwsze żądanie nie czekało na jego zbudowanie
+from stats.database import set_journal_mode  # noqa: E402 - wymaga załadowanych aplikacji
+from stats.search import get_index  # noqa: E402
+
+set_journal_mode()
+get_index()
+
+# strumień zmian online (SSE) jest obsługiwany bezpośrednio przez ASGI, bez wątku na połączenie
+from stats.live import LiveFeedRouter  # noqa: E402 - wymaga załadowanych aplikacji
+
+application = LiveFeedRouter(django_application)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'stats.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,6 +79,27 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
+# Połączenie zapisu scrapera - ten sam plik, transakcje BEGIN IMMEDIATE (stats.backends.sqlite3, stats.database)
+DATABASES['writer'] = {
+    **DATABASES['default'],
+    'ENGINE': 'stats.backends.sqlite3',
+    'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['stats.database.WriterRouter']
+
+# Pragmy ustawiane na każdym połączeniu SQLite (stats.database): busy_timeout (ms) każe czekać na blokadę zamiast
+# od razu zgłaszać "database is locked"
+SQLITE_PRAGMAS = {
+    'busy_timeout': 20000,
+    'synchronous': 'NORMAL',
+    'cache_size': -32000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+# Tryb dziennika zapisywany w pliku bazy: WAL pozwala widokom czytać w trakcie zapisu minuty
+# Ustawiają go tylko serwer (djangoProject.asgi/wsgi) i scrap-stats, nie komendy takie jak check czy makemigrations
+SQLITE_JOURNAL_MODE = 'WAL'
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -112,6 +135,50 @@ USE_TZ = False
 
 STATIC_URL = 'static/'
 
+# Cache widoków statystyk (stats.caching); backend wybiera zmienna środowiskowa STATS_CACHE:
+# - file (domyślnie) - katalog wspólny dla serwera i scrapera, więc zapis minuty unieważnia wpisy serwera WWW
+# - locmem - w pamięci procesu; scraper działa w osobnym procesie i nie unieważnia wpisów serwera WWW, dlatego wpisy
+#   zmieniane przez zapis minuty (dzisiejszy dzień, listy dni, ranking) żyją wtedy tylko STATS_CACHE_HOT_TIMEOUT sekund
+# - redis - serwer Redis pod adresem STATS_CACHE_REDIS_URL (wymaga pakietu redis)
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'meno-stats',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('STATS_CACHE_DIR', BASE_DIR / 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('STATS_CACHE_REDIS_URL', 'redis://127.0.0.1:6379/0'),
+    },
+}
+CACHES = {
+    'default': CACHE_BACKENDS[os.environ.get('STATS_CACHE', 'file')],
+}
+STATS_CACHE_TIMEOUT = 24 * 60 * 60
+STATS_CACHE_HOT_TIMEOUT = 60
+
+# Archiwum aktywności zamkniętych dni (stats.archive); ostatnie ACTIVITY_HOT_DAYS dni zostają w bazie
+ACTIVITY_ARCHIVE_DIR = BASE_DIR / 'archive'
+ACTIVITY_HOT_DAYS = 2
+
+# Strumień zmian online (stats.live): scraper wysyła zmiany datagramami UDP na ten adres, a proces ASGI je odbiera
+LIVE_FEED_ADDRESS = (os.environ.get('LIVE_FEED_HOST', '127.0.0.1'), int(os.environ.get('LIVE_FEED_PORT', 8765)))
+# liczba workerów ASGI (np. `uvicorn --workers N`); scraper wysyła każdą zmianę na porty LIVE_FEED_PORT..+N-1,
+# a każdy worker nasłuchuje na pierwszym wolnym z nich - worker ponad tę liczbę odpowiada na strumień kodem 503
+LIVE_FEED_WORKERS = int(os.environ.get('LIVE_FEED_WORKERS', 1))
+
+# Metryki w formacie Prometheusa (stats.metrics); STATS_METRICS=0 wyłącza pomiary
+# Widoki stats:metrics i stats:cache_stats odpowiadają tylko na żądania z nagłówkiem
+# `Authorization: Bearer <STATS_METRICS_TOKEN>` (w Prometheusie: `authorization: {credentials: ...}`);
+# bez tokenu są wyłączone. Metryki scrapera (`scrap-stats --metrics-port`) są na osobnym porcie 127.0.0.1
+STATS_METRICS = os.environ.get('STATS_METRICS', '1') != '0'
+STATS_METRICS_TOKEN = os.environ.get('STATS_METRICS_TOKEN', '')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoProject.settings')
 
 application = get_wsgi_application()
+
+# przy starcie serwera, nie przez każdą komendę: tryb dziennika SQLite (WAL) w pliku bazy i indeks podpowiedzi
+# (stats.search), żeby pierwsze żądanie nie czekało na jego zbudowanie
+from stats.database import set_journal_mode  # noqa: E402 - wymaga załadowanych aplikacji
+from stats.search import get_index  # noqa: E402
+
+set_journal_mode()
+get_index()
@@ -0,0 +1,254 @@
+import base64
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from django.http import JsonResponse
+from django.views import View
+
+from .archive import iter_archived_rows, is_hot
+from .caching import dates_key, get_or_set, hot_timeout
+from .converters import DateConverter
+from .coverage import coverage_by_day, day_coverage, period_coverage
+from .leaderboards import Period, latest_leaderboard_date, leaderboard_page, parse_cursor, period_end, period_start
+from .models import Account, Activity, Character, Tick
+from .search import DEFAULT_LIMIT as SEARCH_LIMIT, MAX_LIMIT as SEARCH_MAX_LIMIT, get_index
+from .views import DetailView
+
+# API tylko do odczytu (JSON): stała liczba zapytań na wywołanie, paginacja kluczem (parametr `after`
+# z wartością `next` poprzedniej strony) zamiast OFFSET, zwarty JSON bez spacji
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+JSON_PARAMS = {'separators': (',', ':'), 'ensure_ascii': False}
+CLOSED_DAY_MAX_AGE = 24 * 60 * 60
+
+
+class ApiError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_response(data: dict, status: int = 200, max_age: Optional[int] = None) -> JsonResponse:
+    response = JsonResponse(data, status=status, json_dumps_params=JSON_PARAMS)
+    if max_age is not None:
+        response['Cache-Control'] = f'public, max-age={max_age}'
+    return response
+
+
+def parse_date(value: Optional[str], name: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return DateConverter().to_python(value)
+    except ValueError:
+        raise ApiError(f"Niepoprawna data w parametrze {name}: {value}")
+
+
+def parse_limit(value: Optional[str], default: int = DEFAULT_LIMIT, maximum: int = MAX_LIMIT) -> int:
+    try:
+        limit = int(value) if value else default
+    except ValueError:
+        raise ApiError(f"Niepoprawny parametr limit: {value}")
+    if not 1 <= limit <= maximum:
+        raise ApiError(f"Parametr limit musi być z zakresu 1-{maximum}")
+    return limit
+
+
+def get_account(aid: int) -> Account:
+    account = Account.objects.filter(pk=aid).first()
+    if account is None:
+        raise ApiError(f"Konta z ID {aid} nie ma w bazie", status=404)
+    return account
+
+
+def activity_dates(account: Account) -> List[date]:
+    return get_or_set(
+        'dates', dates_key(account.aid), lambda: DetailView.get_all_activity_dates(account), hot_timeout()
+    )
+
+
+class ApiView(View):
+    """
+    Bazowy widok API - zamienia błędy parametrów na odpowiedź JSON z kodem 400/404
+    """
+    http_method_names = ['get']
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as e:
+            return api_response({'error': str(e)}, status=e.status)
+
+
+class AccountSummaryApiView(ApiView):
+    """
+    Podsumowanie konta: ostatnio widziana minuta, czy jest online, postacie oraz zakres dni aktywności
+    """
+
+    def get(self, request, aid: int):
+        account = get_account(aid)
+        dates = activity_dates(account)
+        characters = Character.objects.filter(account=account).order_by('world', 'cid')
+        return api_response({
+            'aid': account.aid,
+            'last_seen': {'date': account.last_seen_date, 'minute': account.last_seen_minute}
+            if account.last_seen_date is not None else None,
+            'online': account.is_online(Tick.latest()),
+            'days': len(dates),
+            'first_day': dates[0] if dates else None,
+            'last_day': dates[-1] if dates else None,
+            'characters': [
+                {'cid': c.cid, 'world': c.world, 'nick': c.nick, 'lvl': c.lvl, 'prof': c.prof}
+                for c in characters
+            ],
+        })
+
+
+class AccountDaysApiView(ApiView):
+    """
+    Czas aktywności konta w kolejnych dniach zakresu (from, to), z podziałem na postacie
+    Strona obejmuje `limit` dni z aktywnością; `next` to ostatni dzień strony (parametr `after` następnej)
+    Dni strony są wybierane z listy dni konta (cache), a czasy - jednym zapytaniem i z indeksów archiwum
+    `coverage` dnia to liczba zapisanych i brakujących minut (null - dzień nieśledzony, stats.coverage)
+    """
+
+    def get(self, request, aid: int):
+        account = get_account(aid)
+        date_from = parse_date(request.GET.get('from'), 'from')
+        date_to = parse_date(request.GET.get('to'), 'to')
+        after = parse_date(request.GET.get('after'), 'after')
+        limit = parse_limit(request.GET.get('limit'))
+
+        dates = [
+            day for day in activity_dates(account)
+            if (date_from is None or day >= date_from) and (date_to is None or day <= date_to)
+            and (after is None or day > after)
+        ]
+        page, has_next = dates[:limit], len(dates) > limit
+        totals = self.get_totals(aid, page[0], page[-1]) if page else {}
+        coverage = coverage_by_day(page[0], page[-1]) if page else {}
+        return api_response({
+            'aid': aid,
+            'days': [
+                {
+                    'date': day,
+                    'minutes': sum(minutes for _, _, minutes in totals.get(day, [])),
+                    'characters': [[cid, world, minutes] for cid, world, minutes in totals.get(day, [])],
+                    'coverage': coverage[day].as_dict() if day in coverage else None,
+                }
+                for day in page
+            ],
+            'next': page[-1] if has_next else None,
+        })
+
+    @staticmethod
+    def get_totals(aid: int, first: date, last: date) -> Dict[date, List[Tuple[int, str, int]]]:
+        """
+        :return: słownik dzień -> lista (cid, świat, minuty) z bazy i archiwum
+        """
+        totals = defaultdict(list)
+        rows = (
+            Activity.objects.filter(character__account_id=aid, date__range=(first, last))
+            .order_by('date', 'character__world', 'character__cid')
+            .values_list('date', 'character__cid', 'character__world', 'total_minutes')
+        )
+        for day, cid, world, minutes in rows:
+            totals[day].append((cid, world, minutes))
+        for _, cid, world, day, minutes, _ in iter_archived_rows(aid, date_from=first, date_to=last):
+            if all((cid, world) != (c, w) for c, w, _ in totals[day]):
+                totals[day].append((cid, world, minutes))
+        return totals
+
+
+class AccountSessionsApiView(ApiView):
+    """
+    Sesje konta w danym dniu dla każdej postaci: przedziały minut [początek, koniec) (format=intervals, domyślnie)
+    albo bitmapa 180 bajtów w base64 (format=base64); `unknown` to w tym samym formacie minuty bez danych
+    Dane pochodzą z tego samego wpisu cache co strona szczegółów; zamknięte dni można cache'ować po stronie klienta
+    """
+    FORMATS = ('intervals', 'base64')
+
+    def get(self, request, aid: int, activity_date: date):
+        fmt = request.GET.get('format', 'intervals')
+        if fmt not in self.FORMATS:
+            raise ApiError(f"Parametr format musi być jednym z: {', '.join(self.FORMATS)}")
+        account = get_account(aid)
+        character_activity_list = DetailView.get_character_activity_list(account, activity_date)
+
+        characters = []
+        for character, activity in character_activity_list:
+            if activity is None:
+                continue
+            entry = {'cid': character.cid, 'world': character.world, 'minutes': activity.total_minutes}
+            if fmt == 'base64':
+                entry['activity'] = base64.b64encode(bytes(activity.activity)).decode()
+            else:
+                entry['intervals'] = [[int(start), int(end)] for start, end in activity.start_end_list]
+            characters.append(entry)
+        coverage = day_coverage(activity_date)
+        if coverage is None:
+            unknown = None
+        elif fmt == 'base64':
+            unknown = base64.b64encode(bytes(coverage.unknown)).decode()
+        else:
+            unknown = [[int(start), int(end)] for start, end in coverage.unknown_intervals]
+        return api_response(
+            {'aid': aid, 'date': activity_date, 'characters': characters, 'unknown': unknown},
+            max_age=None if is_hot(activity_date) else CLOSED_DAY_MAX_AGE
+        )
+
+
+class LeaderboardApiView(ApiView):
+    """
+    Ranking świata (lub wszystkich światów) z paginacją kluczem (minuty, id postaci) po indeksie rankingu
+    `next` ma postać "<minuty>.<id postaci>" i jest przekazywany w parametrze `after`
+    `coverage` - zapisane i brakujące minuty okresu; minuty postaci nie obejmują minut brakujących
+    """
+
+    def get(self, request):
+        period = request.GET.get('period', Period.DAY)
+        if period not in Period.values:
+            raise ApiError(f"Parametr period musi być jednym z: {', '.join(Period.values)}")
+        day = parse_date(request.GET.get('date'), 'date') or latest_leaderboard_date() or date.today()
+        world = request.GET.get('world')
+        limit = parse_limit(request.GET.get('limit'))
+        start = period_start(period, day)
+        after = request.GET.get('after')
+        try:
+            cursor = parse_cursor(after) if after else None
+        except ValueError:
+            raise ApiError(f"Niepoprawny parametr after: {after}")
+        page = leaderboard_page(period, day, world, after=cursor, per_page=limit)
+
+        return api_response({
+            'period': period,
+            'period_start': start,
+            'world': world or None,
+            'coverage': period_coverage(start, period_end(period, start)),
+            'results': [
+                {
+                    'aid': entry.character.account_id,
+                    'cid': entry.character.cid,
+                    'world': entry.world,
+                    'nick': entry.character.nick,
+                    'lvl': entry.character.lvl,
+                    'prof': entry.character.prof,
+                    'minutes': entry.minutes,
+                }
+                for entry in page.entries
+            ],
+            'next': page.next,
+        })
+
+
+class SearchApiView(ApiView):
+    """
+    Podpowiedzi do wyszukiwarki: postacie o nicku zaczynającym się od `q` oraz konta o ID zaczynającym się od `q`
+    Odpowiada z indeksu w pamięci procesu (stats.search), bez zapytań do bazy
+    """
+
+    def get(self, request):
+        query = request.GET.get('q', '')
+        limit = parse_limit(request.GET.get('limit'), SEARCH_LIMIT, SEARCH_MAX_LIMIT)
+        return api_response({'query': query, **get_index().search(query, limit)})
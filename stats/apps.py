@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class StatsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "stats"
+
+    def ready(self):
+        # rejestruje ustawianie pragm SQLite na nowych połączeniach
+        from . import database  # noqa: F401
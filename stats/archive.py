@@ -0,0 +1,341 @@
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .database import current_alias
+from .models import Activity, Character
+
+# Archiwum zamkniętych dni: aktywność wszystkich postaci świata z jednego dnia jako jedna macierz n x 180 (uint8)
+# <katalog>/<świat>/RRRRMMDD.activity.npy - macierz bitmap, wiersze w kolejności rosnących id postaci
+# <katalog>/<świat>/RRRRMMDD.index.npy - indeks wierszy (INDEX_DTYPE): id postaci, konta, cid i czas aktywności
+# <katalog>/<świat>/accounts.bin - dopisywany przy kompaktowaniu dziennik par (konto, dzień) w formacie ACCOUNT_DAY_DTYPE
+# Ostatnie HOT_DAYS dni zostają w tabeli *stats_activity*, bo są jeszcze aktualizowane przez scraper
+ARCHIVE_DIR = Path(getattr(settings, 'ACTIVITY_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive'))
+HOT_DAYS = getattr(settings, 'ACTIVITY_HOT_DAYS', 2)
+ARCHIVE_CACHE_SIZE = 256
+BATCH_SIZE = 500
+
+EPOCH = date(1970, 1, 1)
+DAY_FORMAT = '%Y%m%d'
+ACTIVITY_SUFFIX = '.activity.npy'
+INDEX_SUFFIX = '.index.npy'
+ACCOUNT_LOG = 'accounts.bin'
+
+INDEX_DTYPE = np.dtype([('character_id', '<i8'), ('aid', '<u4'), ('cid', '<u4'), ('total_minutes', '<u2')])
+ACCOUNT_DAY_DTYPE = np.dtype([('aid', '<u4'), ('day', '<u2')])  # dzień - liczba dni od 1970-01-01
+
+Row = Tuple[int, int, str, date, int, memoryview]
+
+
+@dataclass
+class ArchivedDay:
+    """
+    Aktywność jednego świata z jednego zamkniętego dnia
+    index - tablica INDEX_DTYPE posortowana po id postaci
+    activity - macierz bitmap zmapowana w pamięć (np.memmap); wiersz i odpowiada index[i]
+    """
+    world: str
+    date: date
+    index: np.ndarray
+    activity: np.ndarray
+
+    def __len__(self):
+        return len(self.index)
+
+    def positions(self, character_ids: Iterable[int]) -> Dict[int, int]:
+        """
+        :return: słownik id postaci -> numer wiersza dla postaci obecnych w archiwum
+        """
+        character_ids = np.fromiter(character_ids, dtype=np.int64)
+        if len(self.index) == 0:
+            return {}
+        found = np.minimum(np.searchsorted(self.index['character_id'], character_ids), len(self.index) - 1)
+        present = self.index['character_id'][found] == character_ids
+        return dict(zip(character_ids[present].tolist(), found[present].tolist()))
+
+    def row(self, i: int) -> memoryview:
+        """
+        :return: bitmapę wiersza bez kopiowania (widok na zmapowany plik)
+        """
+        return self.activity[i].data
+
+
+def world_dir(world: str) -> Path:
+    return ARCHIVE_DIR / world
+
+
+def day_paths(world: str, day: date) -> Tuple[Path, Path]:
+    name = day.strftime(DAY_FORMAT)
+    return world_dir(world) / f"{name}{ACTIVITY_SUFFIX}", world_dir(world) / f"{name}{INDEX_SUFFIX}"
+
+
+def open_day(world: str, day: date) -> Optional[ArchivedDay]:
+    """
+    Otwiera zarchiwizowany dzień świata; otwarte pliki są zapamiętywane (ponowne kompaktowanie dnia zmienia
+    czas modyfikacji indeksu, więc nieaktualny wpis nie zostanie użyty)
+    """
+    _, index_path = day_paths(world, day)
+    try:
+        mtime = index_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _open_day(world, day, mtime)
+
+
+@lru_cache(maxsize=ARCHIVE_CACHE_SIZE)
+def _open_day(world: str, day: date, mtime: int) -> ArchivedDay:
+    activity_path, index_path = day_paths(world, day)
+    return ArchivedDay(world, day, np.load(index_path), np.load(activity_path, mmap_mode='r'))
+
+
+def archived_worlds() -> List[str]:
+    if not ARCHIVE_DIR.exists():
+        return []
+    return sorted(path.name for path in ARCHIVE_DIR.iterdir() if path.is_dir())
+
+
+def archived_dates(world: str) -> List[date]:
+    return sorted(
+        datetime.strptime(path.name[:-len(INDEX_SUFFIX)], DAY_FORMAT).date()
+        for path in world_dir(world).glob(f"*{INDEX_SUFFIX}")
+    )
+
+
+def iter_archived_days(world: Optional[str] = None, date_from: Optional[date] = None,
+                       date_to: Optional[date] = None) -> Iterator[ArchivedDay]:
+    """
+    Zwraca zarchiwizowane dni świata (lub wszystkich światów) z zakresu dat, w kolejności (świat, dzień)
+    """
+    for w in ([world] if world is not None else archived_worlds()):
+        for day in archived_dates(w):
+            if (date_from is None or day >= date_from) and (date_to is None or day <= date_to):
+                archived = open_day(w, day)
+                if archived is not None:
+                    yield archived
+
+
+def account_dates(aid: int, worlds: Iterable[str]) -> List[date]:
+    """
+    :return: zarchiwizowane dni, w których konto było aktywne na podanych światach (z dzienników kont)
+    """
+    days = set()
+    for world in worlds:
+        path = world_dir(world) / ACCOUNT_LOG
+        if not path.exists() or path.stat().st_size == 0:
+            continue
+        log = np.memmap(path, dtype=ACCOUNT_DAY_DTYPE, mode='r')
+        days.update(log['day'][log['aid'] == aid].tolist())
+    return sorted(EPOCH + timedelta(days=day) for day in days)
+
+
+def archive_version() -> int:
+    """
+    :return: łączny rozmiar dzienników kont wszystkich światów - rośnie przy każdym kompaktowaniu (także ponownym,
+             które łączy dograne wiersze z archiwum), więc zmienia się razem z zawartością archiwum
+    """
+    return sum(
+        path.stat().st_size for path in (world_dir(world) / ACCOUNT_LOG for world in archived_worlds())
+        if path.exists()
+    )
+
+
+def archived_activity(characters: Iterable[Character], day: date) -> Dict[int, Activity]:
+    """
+    :return: słownik id postaci -> niezapisany obiekt Activity z archiwum danego dnia (bitmapa bez kopiowania,
+        bez obiektu postaci, żeby wpis cache nie zawierał jej nicku i poziomu)
+    """
+    by_world: Dict[str, List[Character]] = {}
+    for character in characters:
+        by_world.setdefault(character.world, []).append(character)
+
+    activities = {}
+    for world, world_characters in by_world.items():
+        archived = open_day(world, day)
+        if archived is None:
+            continue
+        positions = archived.positions(character.pk for character in world_characters)
+        for character in world_characters:
+            i = positions.get(character.pk)
+            if i is not None:
+                activities[character.pk] = Activity(
+                    character_id=character.pk, date=day, activity=archived.row(i),
+                    total_minutes=int(archived.index['total_minutes'][i])
+                )
+    return activities
+
+
+def iter_archived_rows(aid: Optional[int] = None, world: Optional[str] = None, date_from: Optional[date] = None,
+                       date_to: Optional[date] = None) -> Iterator[Row]:
+    """
+    Zwraca zarchiwizowane aktywności jako krotki (aid, cid, world, date, total_minutes, activity)
+    Dla konta - posortowane po (cid, world, date), tak jak zapytanie eksportu; bez konta - w kolejności plików
+    (świat, dzień), czytając każdy plik sekwencyjnie
+    """
+    if aid is None:
+        for archived in iter_archived_days(world, date_from, date_to):
+            index = archived.index
+            for i, (aid_, cid, total_minutes) in enumerate(zip(
+                    index['aid'].tolist(), index['cid'].tolist(), index['total_minutes'].tolist())):
+                yield aid_, cid, archived.world, archived.date, total_minutes, archived.row(i)
+        return
+
+    worlds = [world] if world is not None else list(
+        Character.objects.filter(account_id=aid).values_list('world', flat=True).distinct()
+    )
+    found = []
+    for w in worlds:
+        for day in account_dates(aid, [w]):
+            if (date_from is not None and day < date_from) or (date_to is not None and day > date_to):
+                continue
+            archived = open_day(w, day)
+            if archived is None:
+                continue
+            for i in np.flatnonzero(archived.index['aid'] == aid).tolist():
+                found.append((int(archived.index['cid'][i]), w, day, archived, i))
+    found.sort(key=lambda f: f[:3])
+    for cid, w, day, archived, i in found:
+        yield aid, cid, w, day, int(archived.index['total_minutes'][i]), archived.row(i)
+
+
+def count_archived_rows(aid: Optional[int] = None, world: Optional[str] = None, date_from: Optional[date] = None,
+                        date_to: Optional[date] = None) -> int:
+    if aid is not None:
+        return sum(1 for _ in iter_archived_rows(aid, world, date_from, date_to))
+    return sum(len(archived) for archived in iter_archived_days(world, date_from, date_to))
+
+
+def archived_totals(date_from: date, date_to: date) -> Dict[int, Tuple[str, int]]:
+    """
+    Sumuje czas aktywności postaci z zarchiwizowanych dni zakresu (tylko z indeksów, bez czytania bitmap)
+    :return: słownik id postaci -> (świat, łączna liczba minut)
+    """
+    totals = {}
+    for world in archived_worlds():
+        indexes = [archived.index for archived in iter_archived_days(world, date_from, date_to)]
+        if not indexes:
+            continue
+        index = np.concatenate(indexes)
+        character_ids, inverse = np.unique(index['character_id'], return_inverse=True)
+        minutes = np.bincount(inverse, weights=index['total_minutes']).astype(np.int64)
+        totals.update((cid, (world, m)) for cid, m in zip(character_ids.tolist(), minutes.tolist()))
+    return totals
+
+
+def is_hot(day: date, today: Optional[date] = None) -> bool:
+    """
+    :return: czy dzień może być jeszcze aktualizowany przez scraper (jego aktywność zostaje w bazie)
+    """
+    return day > (today or date.today()) - timedelta(days=HOT_DAYS)
+
+
+def closed_days(today: Optional[date] = None) -> List[Tuple[date, str]]:
+    """
+    :return: pary (dzień, świat) z aktywnością w bazie, które można już przenieść do archiwum
+    """
+    last_closed = (today or date.today()) - timedelta(days=HOT_DAYS)
+    return list(
+        Activity.objects.filter(date__lte=last_closed)
+        .values_list('date', 'character__world')
+        .distinct()
+        .order_by('date', 'character__world')
+    )
+
+
+def compact_day(day: date, world: Optional[str] = None) -> Dict[str, int]:
+    """
+    Przenosi aktywność zamkniętego dnia z tabeli *stats_activity* do archiwum (dla jednego lub wszystkich światów)
+    :return: słownik świat -> liczba przeniesionych wierszy
+    """
+    if is_hot(day):
+        raise ValueError(f"Dzień {day} nie jest jeszcze zamknięty")
+    if world is not None:
+        worlds = [world]
+    else:
+        worlds = list(
+            Activity.objects.filter(date=day).values_list('character__world', flat=True).distinct().order_by()
+        )
+    return {w: compact_world_day(w, day) for w in worlds}
+
+
+def compact_world_day(world: str, day: date) -> int:
+    """
+    Zapisuje bitmapy świata z danego dnia jako macierz z indeksem, dopisuje dziennik kont i usuwa wiersze z bazy
+    Jeśli dzień był już zarchiwizowany (np. dane dograne po kompaktowaniu), bitmapy są łączone przez OR
+    Pliki są zapisywane i utrwalane (fsync) przed usunięciem wierszy, więc przerwane kompaktowanie można bezpiecznie
+    powtórzyć
+    """
+    rows = list(
+        Activity.objects.filter(date=day, character__world=world)
+        .order_by('character_id')
+        .values_list('id', 'character_id', 'character__account_id', 'character__cid', 'activity')
+    )
+    if not rows:
+        return 0
+
+    index = np.zeros(len(rows), dtype=INDEX_DTYPE)
+    index['character_id'] = [row[1] for row in rows]
+    index['aid'] = [row[2] for row in rows]
+    index['cid'] = [row[3] for row in rows]
+    activity = np.frombuffer(b''.join(bytes(row[4]) for row in rows), dtype=np.uint8).reshape(-1, 180)
+
+    existing = open_day(world, day)
+    if existing is not None:
+        combined = np.concatenate([existing.index, index])
+        _, first, inverse = np.unique(combined['character_id'], return_index=True, return_inverse=True)
+        index = combined[first]
+        merged = np.zeros((len(index), 180), dtype=np.uint8)
+        np.bitwise_or.at(merged, inverse, np.concatenate([existing.activity, activity]))
+        activity = merged
+    index['total_minutes'] = np.unpackbits(activity, axis=1).sum(axis=1)
+
+    world_dir(world).mkdir(parents=True, exist_ok=True)
+    activity_path, index_path = day_paths(world, day)
+    _save_array(activity_path, activity)
+    _save_array(index_path, index)
+    aids = np.unique(index['aid'])
+    account_days = np.zeros(len(aids), dtype=ACCOUNT_DAY_DTYPE)
+    account_days['aid'] = aids
+    account_days['day'] = (day - EPOCH).days
+    with open(world_dir(world) / ACCOUNT_LOG, 'ab') as f:
+        f.write(account_days.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    _fsync_dir(world_dir(world))
+
+    ids = [row[0] for row in rows]
+    with transaction.atomic(using=current_alias()):
+        for i in range(0, len(ids), BATCH_SIZE):
+            Activity.objects.filter(pk__in=ids[i:i + BATCH_SIZE]).delete()
+    return len(rows)
+
+
+def _save_array(path: Path, array: np.ndarray):
+    """
+    Zapisuje tablicę do pliku tymczasowego i podmienia plik; treść i podmiana są utrwalane na dysku (fsync pliku
+    i katalogu), zanim kompaktowanie usunie wiersze z bazy
+    """
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path.parent)
+
+
+def _fsync_dir(path: Path):
+    # poza systemami POSIX (np. Windows) katalogu nie da się otworzyć do fsync - utrwalana jest wtedy tylko treść plików
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
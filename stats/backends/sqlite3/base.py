@@ -0,0 +1,26 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Backend SQLite z opcją OPTIONS['transaction_mode'] (DEFERRED, IMMEDIATE, EXCLUSIVE), jak w Django 5.1
+    Połączenie zapisu (settings.DATABASES['writer']) zaczyna transakcje od BEGIN IMMEDIATE: blokadę zapisu bierze
+    od razu i czeka na nią w busy_timeout, zamiast dostać "database is locked" przy próbie zmiany odczytu w zapis
+    """
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        mode = kwargs.pop('transaction_mode', None)
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode musi być jednym z: {', '.join(TRANSACTION_MODES)}")
+        self.transaction_mode = mode.upper() if mode else None
+        return kwargs
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f"BEGIN {self.transaction_mode}")
@@ -0,0 +1,274 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .archive import day_paths, is_hot, iter_archived_days
+from .models import Activity
+
+BYTES_PER_DAY = 180
+MINUTES_PER_DAY = 1440
+# ile macierzy kont zamkniętych dni (razem z krawędziami sesji) zapamiętuje proces - strona kont powiązanych
+# jest zwykle oglądana dla wielu kont tego samego świata i dnia
+MATRIX_CACHE_SIZE = 4
+
+# liczba jedynek w każdym możliwym bajcie
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+def popcount(packed: np.ndarray) -> np.ndarray:
+    """
+    :return: liczbę ustawionych bitów w każdym wierszu spakowanej macierzy (po ostatniej osi)
+    """
+    return POPCOUNT[packed].sum(axis=-1, dtype=np.int64)
+
+
+@dataclass
+class BitmapMatrix:
+    """
+    Bitmapy aktywności wielu postaci (lub kont) z jednego świata ułożone w jedną ciągłą macierz uint8
+    keys - id postaci (lub kont) odpowiadające wierszom
+    account_ids - id kont odpowiadające wierszom
+    packed - macierz n x (180 * liczba dni); dni z zakresu są sklejone, więc minuta m dnia d to kolumna bitowa d*1440+m
+    """
+    world: str
+    date_from: date
+    date_to: date
+    keys: np.ndarray
+    account_ids: np.ndarray
+    packed: np.ndarray
+
+    def __len__(self):
+        return len(self.keys)
+
+    def index(self, key: int) -> Optional[int]:
+        found = np.flatnonzero(self.keys == key)
+        return int(found[0]) if len(found) else None
+
+    def unpacked(self) -> np.ndarray:
+        return np.unpackbits(self.packed, axis=1).astype(bool)
+
+
+def load_character_matrix(world: str, date_from: date, date_to: Optional[date] = None) -> BitmapMatrix:
+    """
+    Wczytuje bitmapy wszystkich postaci świata z dnia (lub zakresu dni) do jednej macierzy
+    Zamknięte dni są kopiowane blokami z macierzy archiwum (stats.archive), pozostałe - jednym zapytaniem do bazy
+    """
+    date_to = date_to or date_from
+    days = (date_to - date_from).days + 1
+    # kawałki: (id postaci, id kont, numery dni w zakresie, bitmapy n x 180)
+    pieces = [
+        (archived.index['character_id'], archived.index['aid'],
+         np.full(len(archived), (archived.date - date_from).days), archived.activity)
+        for archived in iter_archived_days(world, date_from, date_to)
+    ]
+    rows = list(
+        Activity.objects.filter(character__world=world, date__range=(date_from, date_to))
+        .values_list('character_id', 'character__account_id', 'date', 'activity')
+    )
+    if rows:
+        pieces.append((
+            np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([row[1] for row in rows], dtype=np.int64),
+            np.array([(row[2] - date_from).days for row in rows]),
+            np.frombuffer(b''.join(bytes(row[3]) for row in rows), dtype=np.uint8).reshape(-1, BYTES_PER_DAY),
+        ))
+
+    keys = np.unique(np.concatenate([piece[0] for piece in pieces])) if pieces else np.zeros(0, dtype=np.int64)
+    account_ids = np.zeros(len(keys), dtype=np.int64)
+    packed = np.zeros((len(keys), days * BYTES_PER_DAY), dtype=np.uint8)
+    for character_ids, aids, day_numbers, activity in pieces:
+        i = np.searchsorted(keys, character_ids)
+        account_ids[i] = aids
+        for day in np.unique(day_numbers):
+            on_day = day_numbers == day
+            offset = day * BYTES_PER_DAY
+            packed[i[on_day], offset:offset + BYTES_PER_DAY] |= activity[on_day]
+    return BitmapMatrix(world, date_from, date_to, keys, account_ids, packed)
+
+
+def load_account_matrix(world: str, date_from: date, date_to: Optional[date] = None) -> BitmapMatrix:
+    """
+    Jak `load_character_matrix`, ale jeden wiersz to konto: bitmapy postaci konta na świecie są łączone przez OR
+    """
+    characters = load_character_matrix(world, date_from, date_to)
+    if len(characters) == 0:
+        return characters
+    order = np.argsort(characters.account_ids, kind='stable')
+    account_ids = characters.account_ids[order]
+    keys, starts = np.unique(account_ids, return_index=True)
+    packed = np.bitwise_or.reduceat(characters.packed[order], starts, axis=0)
+    return BitmapMatrix(world, characters.date_from, characters.date_to, keys, keys.copy(), packed)
+
+
+def day_account_matrix(world: str, day: date) -> Tuple[BitmapMatrix, Optional[Tuple[np.ndarray, np.ndarray]]]:
+    """
+    :return: macierz kont świata z dnia i spakowane krawędzie sesji (session_edges, gap=1); dla zamkniętego dnia
+             obie są zapamiętywane w procesie pod kluczem (świat, dzień, czas modyfikacji indeksu archiwum), więc
+             ponowne kompaktowanie dnia unieważnia wpis; dla dnia aktualizowanego przez scraper krawędzie to None
+    """
+    if is_hot(day):
+        return load_account_matrix(world, day), None
+    _, index_path = day_paths(world, day)
+    try:
+        mtime = index_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    return _closed_account_matrix(world, day, mtime)
+
+
+@lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def _closed_account_matrix(world: str, day: date, mtime: Optional[int]
+                           ) -> Tuple[BitmapMatrix, Tuple[np.ndarray, np.ndarray]]:
+    matrix = load_account_matrix(world, day)
+    return matrix, session_edges(matrix)
+
+
+def co_online(matrix: BitmapMatrix, key: int, limit: int = 10) -> List[Tuple[int, int]]:
+    """
+    :return: listę (klucz, liczba wspólnych minut) dla wierszy najczęściej aktywnych razem z wierszem `key`
+    Jedno wektorowe AND całej macierzy z jednym wierszem i popcount - O(n)
+    """
+    i = matrix.index(key)
+    if i is None:
+        return []
+    overlap = popcount(matrix.packed & matrix.packed[i])
+    overlap[i] = 0
+    top = np.argsort(-overlap, kind='stable')[:limit]
+    return [(int(matrix.keys[j]), int(overlap[j])) for j in top if overlap[j] > 0]
+
+
+def dilate(bits: np.ndarray, gap: int) -> np.ndarray:
+    """
+    Rozciąga każdą jedynkę w wierszu na `gap` kolejnych minut
+    """
+    dilated = bits.copy()
+    for shift in range(1, gap + 1):
+        dilated[:, shift:] |= bits[:, :-shift]
+    return dilated
+
+
+def session_edges(matrix: BitmapMatrix, gap: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: spakowane maski początków sesji (pierwsza minuta online) oraz końców sesji (pierwsza minuta offline),
+    przy czym końce są rozciągnięte o `gap` minut w przód, żeby tolerować opóźnienie przy przelogowaniu
+    """
+    bits = matrix.unpacked()
+    padded = np.zeros((bits.shape[0], bits.shape[1] + 1), dtype=bool)
+    padded[:, 1:] = bits
+    previous, current = padded[:, :-1], padded[:, 1:]
+    starts = current & ~previous
+    ends = ~current & previous
+    return np.packbits(starts, axis=1), np.packbits(dilate(ends, gap), axis=1)
+
+
+def handoffs(matrix: BitmapMatrix, key: int, gap: int = 1,
+             edges: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Dla wiersza `key` i wszystkich pozostałych wierszy liczy:
+    - przekazania: ile razy jeden kończy sesję, a drugi zaczyna w ciągu `gap` minut (w obie strony)
+    - nakładanie: liczbę wspólnych minut online
+    :return: (przekazania, nakładanie) - tablice długości len(matrix)
+    """
+    i = matrix.index(key)
+    starts, ends = edges if edges is not None else session_edges(matrix, gap)
+    handed = popcount(ends[i] & starts) + popcount(ends & starts[i])
+    overlap = popcount(matrix.packed & matrix.packed[i])
+    handed[i] = overlap[i] = 0
+    return handed, overlap
+
+
+def likely_alts(matrix: BitmapMatrix, key: int, min_handoffs: int = 2, max_overlap: int = 0,
+                gap: int = 1, limit: int = 10, edges: Optional[Tuple[np.ndarray, np.ndarray]] = None
+                ) -> List[Tuple[int, int, int]]:
+    """
+    :return: listę (klucz, przekazania, wspólne minuty) dla wierszy, które prawie nie są online razem z `key`,
+    ale często przejmują od niego aktywność z minuty na minutę (lub odwrotnie) - prawdopodobne multikonta
+    `edges` - krawędzie sesji wyliczone wcześniej dla tego samego `gap` (np. przez day_account_matrix)
+    """
+    if matrix.index(key) is None:
+        return []
+    handed, overlap = handoffs(matrix, key, gap, edges)
+    candidates = np.flatnonzero((handed >= min_handoffs) & (overlap <= max_overlap))
+    candidates = candidates[np.argsort(-handed[candidates], kind='stable')][:limit]
+    return [(int(matrix.keys[j]), int(handed[j]), int(overlap[j])) for j in candidates]
+
+
+def minhash_signatures(bits: np.ndarray, num_hashes: int = 32, seed: int = 0) -> np.ndarray:
+    """
+    Sygnatury MinHash zbiorów ustawionych bitów każdego wiersza: dla każdej losowej permutacji kolumn
+    indeks pierwszej jedynki; wiersze bez jedynek dostają -1
+    """
+    rng = np.random.default_rng(seed)
+    signatures = np.empty((bits.shape[0], num_hashes), dtype=np.int32)
+    empty = ~bits.any(axis=1)
+    for h in range(num_hashes):
+        permutation = rng.permutation(bits.shape[1])
+        signatures[:, h] = bits[:, permutation].argmax(axis=1)
+    signatures[empty] = -1
+    return signatures
+
+
+def lsh_candidate_pairs(signatures: np.ndarray, query: Optional[np.ndarray] = None, bands: int = 16,
+                        max_bucket: int = 50) -> np.ndarray:
+    """
+    Dzieli sygnatury na `bands` pasm; wiersze z identycznym pasmem trafiają do jednego kubełka i stają się kandydatami
+    Gdy podano `query`, kandydatami są pary (i, j), w których pasmo query[i] jest równe pasmu signatures[j]
+    (np. końce sesji jednego konta z początkami sesji drugiego)
+    Koszt jest liniowy w liczbie wierszy (plus pary w kubełkach), zamiast kwadratowego porównania wszystkich par
+    Zbyt duże kubełki (np. wiersze prawie bez aktywności) są pomijane
+    :return: tablicę par indeksów (i < j) o kształcie k x 2
+    """
+    query = signatures if query is None else query
+    rows_per_band = signatures.shape[1] // bands
+    pairs = set()
+    for band in range(bands):
+        columns = slice(band * rows_per_band, (band + 1) * rows_per_band)
+        buckets = defaultdict(lambda: ([], []))
+        for side, sigs in enumerate((query, signatures)):
+            for i in np.flatnonzero(sigs[:, 0] >= 0):
+                buckets[sigs[i, columns].tobytes()][side].append(i)
+        for left, right in buckets.values():
+            if len(left) + len(right) > max_bucket:
+                continue
+            for i in left:
+                for j in right:
+                    if i != j:
+                        pairs.add((min(i, j), max(i, j)))
+    return np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+
+
+def find_alt_pairs(matrix: BitmapMatrix, min_handoffs: int = 2, max_overlap: int = 0, gap: int = 1,
+                   num_hashes: int = 32, bands: int = 16, exact: bool = False,
+                   chunk_size: int = 10000) -> List[Tuple[int, int, int, int]]:
+    """
+    Szuka par wierszy (zwykle kont), które prawie nigdy nie są online razem, ale przekazują sobie aktywność
+    U multikont końce sesji jednego konta pokrywają się z początkami sesji drugiego, więc kandydaci są wybierani
+    przez MinHash/LSH: sygnatury końców sesji są dopasowywane do sygnatur początków sesji (dla `exact=True` -
+    wszystkie pary), a następnie sprawdzani wektorowo (AND + popcount)
+    :return: listę (klucz a, klucz b, przekazania, wspólne minuty) posortowaną malejąco po przekazaniach
+    """
+    starts, ends = session_edges(matrix, gap)
+    if exact:
+        pairs = np.stack(np.triu_indices(len(matrix), k=1), axis=1)
+    else:
+        # początki też rozciągamy, żeby przekazanie z opóźnieniem 0..gap minut dawało podobne zbiory
+        start_bits = dilate(np.unpackbits(starts, axis=1).astype(bool), gap)
+        end_bits = np.unpackbits(ends, axis=1).astype(bool)
+        pairs = lsh_candidate_pairs(
+            minhash_signatures(start_bits, num_hashes), minhash_signatures(end_bits, num_hashes), bands
+        )
+
+    results = []
+    for offset in range(0, len(pairs), chunk_size):
+        a, b = pairs[offset:offset + chunk_size].T
+        handed = popcount(ends[a] & starts[b]) + popcount(ends[b] & starts[a])
+        overlap = popcount(matrix.packed[a] & matrix.packed[b])
+        for k in np.flatnonzero((handed >= min_handoffs) & (overlap <= max_overlap)):
+            results.append((int(matrix.keys[a[k]]), int(matrix.keys[b[k]]), int(handed[k]), int(overlap[k])))
+    results.sort(key=lambda r: (-r[2], r[3]))
+    return results
+
@@ -0,0 +1,125 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Callable, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+# Cache widoków statystyk; backend (locmem, plikowy lub Redis) wybiera się w settings.CACHES
+# Dni, które minęły, się nie zmieniają, więc ich wpisy żyją do wygaśnięcia; wpisy dzisiejszego dnia są unieważniane
+# przy zapisie każdej minuty (tylko dla kont, które były wtedy online)
+# Unieważnianie działa tylko ze wspólnym backendem (plikowy, Redis) - przy locmem scraper nie widzi cache serwera WWW,
+# więc wpisy, które zmienia zapis minuty, żyją wtedy tylko HOT_TIMEOUT sekund
+# Wpisy nie zawierają obiektów Character: nick, poziom i profesja zmieniają się przy odświeżaniu profili
+CACHE_ALIAS = getattr(settings, 'STATS_CACHE_ALIAS', 'default')
+CACHE_TIMEOUT = getattr(settings, 'STATS_CACHE_TIMEOUT', 24 * 60 * 60)
+HOT_TIMEOUT = getattr(settings, 'STATS_CACHE_HOT_TIMEOUT', 60)
+KEY_PREFIX = 'stats'
+
+MISSING = object()
+
+
+@dataclass
+class CacheCounters:
+    """
+    Liczniki trafień i chybień cache w tym procesie, osobno dla każdego rodzaju wpisu (np. 'detail', 'dates')
+    """
+    hits: Counter = field(default_factory=Counter)
+    misses: Counter = field(default_factory=Counter)
+
+    def snapshot(self) -> dict:
+        kinds = sorted(set(self.hits) | set(self.misses))
+        return {
+            kind: {
+                'hits': self.hits[kind],
+                'misses': self.misses[kind],
+                'hit_ratio': round(self.hits[kind] / max(self.hits[kind] + self.misses[kind], 1), 3),
+            }
+            for kind in kinds
+        }
+
+    def reset(self):
+        self.hits.clear()
+        self.misses.clear()
+
+
+counters = CacheCounters()
+
+
+def stats_cache() -> BaseCache:
+    return caches[CACHE_ALIAS]
+
+
+def is_shared() -> bool:
+    """
+    Czy cache jest wspólny dla procesów (unieważnienia ze scrapera docierają do serwera WWW)
+    """
+    return not isinstance(stats_cache(), LocMemCache)
+
+
+def hot_timeout() -> int:
+    """
+    Czas życia wpisów zmienianych przez zapis minuty (listy dni aktywności, ranking)
+    """
+    return CACHE_TIMEOUT if is_shared() else HOT_TIMEOUT
+
+
+def day_timeout(day: Optional[date]) -> int:
+    """
+    Czas życia wpisu dnia `day` - dzień, do którego scraper może jeszcze dopisać minuty (dzisiejszy, a tuż po północy
+    także wczorajszy), jest traktowany jak wpis zmieniany przez zapis minuty
+    """
+    if day is None or day >= date.today() - timedelta(days=1):
+        return hot_timeout()
+    return CACHE_TIMEOUT
+
+
+def detail_key(aid: int, day: Optional[date]) -> str:
+    return f"{KEY_PREFIX}:detail:{aid}:{day:%Y%m%d}" if day is not None else f"{KEY_PREFIX}:detail:{aid}:none"
+
+
+def dates_key(aid: int) -> str:
+    return f"{KEY_PREFIX}:dates:{aid}"
+
+
+def related_key(aid: int, day: date) -> str:
+    return f"{KEY_PREFIX}:related:{aid}:{day:%Y%m%d}"
+
+
+def ranking_key() -> str:
+    return f"{KEY_PREFIX}:ranking"
+
+
+def get_or_set(kind: str, key: str, compute: Callable[[], Any], timeout: Optional[int] = CACHE_TIMEOUT) -> Any:
+    """
+    Zwraca wartość z cache albo ją wylicza i zapisuje; liczy trafienia i chybienia dla rodzaju `kind`
+    """
+    cache = stats_cache()
+    value = cache.get(key, MISSING)
+    if value is not MISSING:
+        counters.hits[kind] += 1
+        return value
+    counters.misses[kind] += 1
+    value = compute()
+    cache.set(key, value, timeout)
+    return value
+
+
+def invalidate(aid: int, day: date):
+    """
+    Usuwa wpisy konta z danego dnia (kontekst strony szczegółów i listę dni aktywności)
+    """
+    stats_cache().delete_many([detail_key(aid, day), dates_key(aid)])
+
+
+def invalidate_minute(day: date, aids: Iterable[int], new_day_aids: Iterable[int]):
+    """
+    Unieważnia po zapisie minuty tylko wpisy dnia `day`: strony szczegółów kont, które były online, listy dni
+    kont, które pierwszy raz pojawiły się tego dnia na jakiejś postaci, oraz ranking na stronie głównej
+    """
+    keys = [detail_key(aid, day) for aid in aids]
+    keys += [dates_key(aid) for aid in new_day_aids]
+    keys.append(ranking_key())
+    stats_cache().delete_many(keys)
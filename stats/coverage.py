@@ -0,0 +1,97 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+from django.db.models import Sum
+
+from .models import Coverage, Tick
+
+# Pokrycie dni przez scraper (Coverage): każda zapisana minuta ustawia bit w masce `known`, a minuty między nią
+# a poprzednią zapisaną minutą (dziennik Tick) trafiają do maski `unknown` - luka jest wykrywana przy pierwszym
+# udanym zapisie po niej, więc także po restarcie scrapera albo po ticku dłuższym niż minuta
+# Dni w całości objęte luką (scraper wyłączony na dłużej) nie dostają wiersza - bez wiersza dzień jest nieśledzony
+# Dograna później minuta (np. z nagrania) przechodzi z `unknown` do `known`
+MINUTES = 1440
+
+
+def previous_tick(day: date, minute: int) -> Optional[Tuple[date, int]]:
+    """
+    :return: (dzień, minuta) ostatniej zapisanej minuty przed podaną - dwa zapytania po indeksie (date, minute)
+    """
+    row = Tick.objects.filter(date=day, minute__lt=minute).order_by('-minute').values_list('date', 'minute').first()
+    if row is None:
+        row = Tick.objects.filter(date__lt=day).order_by('-date', '-minute').values_list('date', 'minute').first()
+    return row
+
+
+def split_days(start: datetime, end: datetime) -> Iterator[Tuple[date, int, int]]:
+    """
+    Dzieli przedział minut [start, end) na kawałki w obrębie dni
+    :return: krotki (dzień, pierwsza minuta, minuta za ostatnią)
+    """
+    while start < end:
+        next_day = datetime.combine(start.date() + timedelta(days=1), datetime.min.time())
+        stop = min(end, next_day)
+        last = MINUTES if stop == next_day else stop.hour * 60 + stop.minute
+        yield start.date(), start.hour * 60 + start.minute, last
+        start = stop
+
+
+def unpack(mask: bytes) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(bytes(mask), dtype=np.uint8)).astype(bool)
+
+
+def mark(day: date, known: Optional[int] = None, unknown: Tuple[int, int] = (0, 0)):
+    """
+    Ustawia w pokryciu dnia minutę `known` jako zapisaną, a przedział minut `unknown` [od, do) jako brakujący
+    (z pominięciem minut już zapisanych)
+    """
+    coverage = Coverage.objects.filter(date=day).first() or Coverage(date=day)
+    known_bits, unknown_bits = unpack(coverage.known), unpack(coverage.unknown)
+    first, last = unknown
+    unknown_bits[first:last] |= ~known_bits[first:last]
+    if known is not None:
+        known_bits[known], unknown_bits[known] = True, False
+    known_mask, unknown_mask = np.packbits(known_bits).tobytes(), np.packbits(unknown_bits).tobytes()
+    if coverage.pk is not None and (known_mask, unknown_mask) == (bytes(coverage.known), bytes(coverage.unknown)):
+        return
+    coverage.known, coverage.unknown = known_mask, unknown_mask
+    coverage.known_minutes, coverage.unknown_minutes = int(known_bits.sum()), int(unknown_bits.sum())
+    coverage.save()
+
+
+def record_tick(now: datetime):
+    """
+    Wywoływane przy zapisie minuty (w tej samej transakcji): oznacza minutę jako zapisaną, a lukę od poprzedniej
+    zapisanej minuty jako brakującą; gdy poprzednia minuta jest tuż przed tą, wystarczają trzy zapytania
+    """
+    day, minute = now.date(), now.hour * 60 + now.minute
+    previous = previous_tick(day, minute)
+    gap_start = now
+    if previous is not None:
+        gap_start = datetime.combine(previous[0], datetime.min.time()) + timedelta(minutes=previous[1] + 1)
+    today_gap = (0, 0)
+    for gap_day, first, last in split_days(gap_start, now):
+        if gap_day == day:
+            today_gap = (first, last)
+        elif (first, last) != (0, MINUTES):
+            mark(gap_day, unknown=(first, last))
+    mark(day, known=minute, unknown=today_gap)
+
+
+def day_coverage(day: Optional[date]) -> Optional[Coverage]:
+    return Coverage.objects.filter(date=day).first() if day is not None else None
+
+
+def coverage_by_day(first: date, last: date) -> Dict[date, Coverage]:
+    return {coverage.date: coverage for coverage in Coverage.objects.filter(date__range=(first, last))}
+
+
+def period_coverage(first: date, last: date) -> Dict[str, int]:
+    """
+    :return: łączna liczba zapisanych i brakujących minut w dniach [first, last]
+    """
+    totals = Coverage.objects.filter(date__range=(first, last)).aggregate(
+        known=Sum('known_minutes'), unknown=Sum('unknown_minutes')
+    )
+    return {'known_minutes': totals['known'] or 0, 'unknown_minutes': totals['unknown'] or 0}
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Profil SQLite: pragmy ustawiane na każdym nowym połączeniu (settings.SQLITE_PRAGMAS) oraz osobne połączenie zapisu
+# Połączenie zapisu ('writer') wskazuje na ten sam plik, ale zaczyna transakcje od BEGIN IMMEDIATE
+# (stats.backends.sqlite3); scraper wykonuje w nim całą pracę na bazie, widoki czytają przez 'default'
+WRITER_ALIAS = 'writer' if 'writer' in settings.DATABASES else DEFAULT_DB_ALIAS
+PRAGMAS = getattr(settings, 'SQLITE_PRAGMAS', {})
+# Tryb dziennika jest zapisywany w pliku bazy, więc nie jest ustawiany na każdym połączeniu: ustawiają go tylko
+# punkty wejścia serwera i scrapera (djangoProject.asgi/wsgi, scrap-stats), a `manage.py check`, migracje itp.
+# nie zmieniają pliku bazy
+JOURNAL_MODE = getattr(settings, 'SQLITE_JOURNAL_MODE', None)
+
+_writer = ContextVar('stats_writer', default=False)
+pragmas_enabled = True
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or not pragmas_enabled:
+        return
+    with connection.cursor() as cursor:
+        for name, value in PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def set_journal_mode(connection=None) -> Optional[str]:
+    """
+    Ustawia tryb dziennika settings.SQLITE_JOURNAL_MODE w pliku bazy (domyślnie połączenia 'default')
+    :return: tryb dziennika po zmianie albo None, gdy baza nie jest SQLite lub tryb nie jest ustawiony
+    """
+    connection = connection or connections[DEFAULT_DB_ALIAS]
+    if connection.vendor != 'sqlite' or not JOURNAL_MODE:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+        return cursor.fetchone()[0]
+
+
+@contextmanager
+def use_writer():
+    """
+    Kieruje zapytania modeli w bloku (w bieżącym wątku / zadaniu) do połączenia zapisu
+    """
+    token = _writer.set(True)
+    try:
+        yield
+    finally:
+        _writer.reset(token)
+
+
+def current_alias() -> str:
+    """
+    :return: alias połączenia, przez które idą zapytania w bieżącym bloku - dla transaction.atomic(using=...)
+    """
+    return WRITER_ALIAS if _writer.get() else DEFAULT_DB_ALIAS
+
+
+class WriterRouter:
+    """
+    Router bazy: w bloku use_writer() odczyty i zapisy idą przez połączenie zapisu, poza nim - domyślnie
+    Oba aliasy to ten sam plik, więc relacje są dozwolone, a migracje wykonuje tylko 'default'
+    """
+
+    def db_for_read(self, model, **hints):
+        return WRITER_ALIAS if _writer.get() else None
+
+    def db_for_write(self, model, **hints):
+        return WRITER_ALIAS if _writer.get() else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,412 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.db import close_old_connections
+
+from . import metrics
+from .archive import closed_days, compact_world_day
+from .caching import invalidate
+from .database import use_writer
+from .ingest import IngestResult, Profile, ingest_minute
+from .leaderboards import finalize_day
+from .live import FeedPublisher
+from .models import Character
+from .parsing import BASE_URL, STATS_PATH, PROFILE_PATH, parse_profile
+from .polling import PollResult, StatsPoller
+from .refresh import DEFAULT_BUDGET, PLAN_INTERVAL, PRIORITY_NAMES, Budget, RefreshQueue, plan
+from .replay import Recorder
+from .search import mark_enriched
+from .sharding import LEASE_TTL, Shard, acquire_lease, owner_id, release_lease
+
+# priorytety zadań w kolejce zapisu - zapis minuty zawsze wyprzedza dane z profili
+TICK_PRIORITY = 0
+ENRICH_PRIORITY = 1
+
+
+@dataclass
+class EngineStats:
+    """
+    Liczniki silnika, pozwalające dobrać współbieżność i rozmiary kolejek
+    """
+    in_flight: int = 0
+    enriched: int = 0
+    failed: int = 0
+    missed_ticks: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def enriched_per_minute(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.enriched * 60 / elapsed if elapsed > 0 else 0.0
+
+
+class ScraperEngine:
+    """
+    Silnik asyncio dla komendy *scrap-stats*
+    - co minutę pobiera stronę /stats z twardym limitem czasu; w trakcie pobierania wstrzymuje nowe zapytania o profile
+    - niezmienionej strony nie pobiera ani nie parsuje ponownie (stats.polling), a konta i postacie sprawdza w bazie
+      tylko dla graczy, których nie było online minutę wcześniej
+    - w tle uzupełnia dane nowych postaci i odświeża stare profile (stats.refresh) pulą `concurrency` pracowników
+      korzystających ze wspólnej sesji HTTP, najwyżej `budget` zapytań o profile na minutę
+    - wszystkie zapisy do bazy przechodzą przez jedną kolejkę i jeden wątek (połączenie zapisu, stats.database)
+    - po zmianie daty zamyka rankingi dnia i w tle przenosi zamknięte dni do archiwum (stats.archive)
+    - minuty pominięte (limit czasu, tick dłuższy niż minuta, restart) są oznaczane jako brakujące (stats.coverage)
+    - po zapisie minuty wysyła zmiany listy graczy online do strumienia na żywo (stats.live), jeśli podano `publisher`
+    - czasy etapów minuty, zadań zapisu i stan kolejek trafiają do metryk procesu (stats.metrics)
+    - z `poll=False` / `enrich=False` działa tylko jedna z części (koordynator i procesy uzupełniające, stats.sharding);
+      z `shard` uzupełnia tylko konta swojego klucza i tylko wtedy, gdy ma jego dzierżawę
+    Blokujące wywołania (requests, ORM) są wykonywane w osobnych pulach wątków
+    """
+
+    def __init__(self, concurrency: int = 8, deadline: float = 50.0, queue_size: int = 100,
+                 base_url: str = BASE_URL, recorder: Optional[Recorder] = None,
+                 publisher: Optional[FeedPublisher] = None, poll: bool = True, enrich: bool = True,
+                 shard: Optional[Shard] = None, budget: int = DEFAULT_BUDGET, log: Callable[[str], None] = print):
+        self.base_url = base_url
+        self.poll = poll
+        self.enrich = enrich
+        self.shard = shard
+        self.owner = owner_id()
+        self.recorder = recorder
+        self.publisher = publisher
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.log = log
+        self.stats = EngineStats()
+        self.budget = Budget(budget)
+        self.refresh_queue = RefreshQueue()
+        self.session = self.create_session(concurrency + 1)
+        self.poller = StatsPoller(self.session, base_url + STATS_PATH)
+        # id postaci graczy zapisanych w ostatniej minucie (różnicowanie listy online, stats.ingest)
+        self.online_ids: Dict[Profile, int] = {}
+        self.online_minute: Optional[datetime] = None
+
+        self.poll_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='poll')
+        self.enrich_executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='enrich')
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+        self.enrich_queue: Optional[asyncio.Queue] = None
+        self.write_queue: Optional[asyncio.PriorityQueue] = None
+        self.poll_idle: Optional[asyncio.Event] = None
+        self.lease_held: Optional[asyncio.Event] = None
+        self.queue_size = queue_size
+        self._write_counter = itertools.count()
+        self.last_date = None
+        self.compaction: Optional[asyncio.Task] = None
+        metrics.registry.add_collector('engine', self.collect_metrics)
+
+    @staticmethod
+    def create_session(pool_size: int) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def snapshot(self) -> dict:
+        return {
+            'enrich_queue': self.enrich_queue.qsize() if self.enrich_queue else 0,
+            'write_queue': self.write_queue.qsize() if self.write_queue else 0,
+            'in_flight': self.stats.in_flight,
+            'enriched': self.stats.enriched,
+            'failed': self.stats.failed,
+            'missed_ticks': self.stats.missed_ticks,
+            'enriched_per_minute': round(self.stats.enriched_per_minute, 1),
+        }
+
+    def collect_metrics(self):
+        snapshot = self.snapshot()
+        metrics.enrich_queue.set(snapshot['enrich_queue'])
+        metrics.write_queue.set(snapshot['write_queue'])
+        metrics.enrich_in_flight.set(snapshot['in_flight'])
+
+    async def run(self, ticks: Optional[int] = None):
+        """
+        Uruchamia silnik; `ticks` ogranicza liczbę minut (None - działa bez końca)
+        """
+        self.enrich_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.write_queue = asyncio.PriorityQueue()
+        self.poll_idle = asyncio.Event()
+        self.poll_idle.set()
+        self.lease_held = asyncio.Event()
+        if self.shard is None:
+            self.lease_held.set()
+
+        writer = asyncio.create_task(self.writer())
+        background = []
+        if self.enrich:
+            background += [asyncio.create_task(self.enrich_producer())]
+            background += [asyncio.create_task(self.enrich_worker()) for _ in range(self.concurrency)]
+            if self.shard is not None:
+                background.append(asyncio.create_task(self.lease_keeper()))
+        try:
+            if self.poll:
+                await self.poll_loop(ticks)
+            else:
+                # bez pobierania /stats cała praca odbywa się w zadaniach w tle
+                await (asyncio.sleep(ticks * 60) if ticks is not None else asyncio.get_running_loop().create_future())
+        finally:
+            if self.compaction is not None:
+                background.append(self.compaction)
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            if self.shard is not None and self.lease_held.is_set():
+                await self.write(TICK_PRIORITY, release_lease, self.shard.lease_name, self.owner)
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+            self.poll_executor.shutdown(wait=False)
+            self.enrich_executor.shutdown(wait=False)
+            self.db_executor.shutdown(wait=True)
+            self.session.close()
+            if self.publisher is not None:
+                self.publisher.close()
+
+    async def write(self, priority: int, func: Callable, *args):
+        """
+        Zleca zapis do bazy pojedynczemu wątkowi i czeka na jego wynik
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.write_queue.put((priority, next(self._write_counter), func, args, future))
+        return await future
+
+    async def writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, func, args, future = await self.write_queue.get()
+            try:
+                result = await loop.run_in_executor(self.db_executor, self._run_db, func, args)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self.write_queue.task_done()
+
+    @staticmethod
+    def _run_db(func: Callable, args: tuple):
+        close_old_connections()
+        with use_writer():
+            if not metrics.enabled:
+                return func(*args)
+            start = time.perf_counter()
+            with metrics.QueryMeter() as meter:
+                result = func(*args)
+            metrics.db_task_seconds.observe(time.perf_counter() - start, task=func.__name__)
+            metrics.db_task_queries.observe(meter.count, task=func.__name__)
+            return result
+
+    # --- minuta ---
+
+    async def poll_loop(self, ticks: Optional[int]):
+        previous = None
+        for i in (range(ticks) if ticks is not None else itertools.count()):
+            if i > 0:
+                await asyncio.sleep(60 - time.time() % 60)
+            now = datetime.now().replace(second=0, microsecond=0)
+            if previous is not None:
+                self.check_overrun(previous, now)
+            previous = now
+            await self.tick(now)
+
+    def check_overrun(self, previous: datetime, now: datetime):
+        """
+        Zlicza minuty, których pętla nie odwiedziła, bo poprzedni tick trwał dłużej niż minutę; strony /stats nie da
+        się pobrać za minutę wstecz, więc te minuty trafią do maski brakujących przy zapisie bieżącej (stats.coverage)
+        """
+        skipped = int((now - previous).total_seconds() // 60) - 1
+        if skipped > 0:
+            self.stats.missed_ticks += skipped
+            metrics.missed_ticks.inc(skipped, reason='overrun')
+            self.log(f"Pominięte minuty: {skipped} - poprzedni tick trwał ponad minutę")
+
+    async def tick(self, now: datetime) -> Optional[IngestResult]:
+        minute = now.hour * 60 + now.minute
+        tick_start = time.perf_counter()
+        self.poll_idle.clear()
+        try:
+            loop = asyncio.get_running_loop()
+            poll = await asyncio.wait_for(
+                loop.run_in_executor(self.poll_executor, self.fetch_stats, now), timeout=self.deadline
+            )
+        except (asyncio.TimeoutError, requests.RequestException) as e:
+            self.stats.missed_ticks += 1
+            metrics.missed_ticks.inc(reason=type(e).__name__)
+            self.log(f"Minuta {minute} - pominięta ({type(e).__name__})")
+            return None
+        finally:
+            self.poll_idle.set()
+
+        fetched = time.perf_counter()
+        profiles, parse_time = poll.profiles, poll.parse_time
+        # przy ciągłej pracy konta i postacie sprawdzane są tylko dla graczy, których nie było minutę wcześniej
+        known = self.online_ids if self.online_minute == now - timedelta(minutes=1) else None
+        result = await self.write(TICK_PRIORITY, ingest_minute, profiles, now, known)
+        self.online_ids, self.online_minute = result.character_ids, now
+        written = time.perf_counter()
+        if self.publisher is not None:
+            self.publisher.publish_minute(profiles, now)
+        if self.last_date is not None and self.last_date != now.date():
+            await self.write(TICK_PRIORITY, finalize_day, self.last_date)
+            if self.compaction is None or self.compaction.done():
+                self.compaction = asyncio.create_task(self.compact(now.date()))
+        self.last_date = now.date()
+        tick = time.perf_counter() - tick_start
+        # pobranie strony = czas w puli pobierania bez parsowania; zapis razem z oczekiwaniem w kolejce zapisu
+        metrics.tick_phase_seconds.observe(fetched - tick_start - parse_time, phase='fetch')
+        metrics.tick_phase_seconds.observe(parse_time, phase='parse')
+        metrics.tick_phase_seconds.observe(written - fetched, phase='write')
+        metrics.tick_seconds.observe(tick)
+        metrics.tick_players.set(result.players)
+        metrics.poll_results.inc(result=poll.status)
+        metrics.poll_bytes.inc(poll.transferred)
+        self.log(f"Minuta {minute} - {result.players} aktywnych graczy, nowych {result.new_players} "
+                 f"(strona {poll.status}, {poll.transferred / 1024:.0f} KiB, tick {tick:.2f} s, "
+                 f"parsowanie {parse_time * 1000:.1f} ms, zapis {result.duration:.2f} s) {self.snapshot()}")
+        return result
+
+    async def compact(self, today: date):
+        """
+        Przenosi zamknięte dni do archiwum - każdy świat to osobne zadanie w kolejce zapisu o niskim priorytecie,
+        więc zapis kolejnych minut nie czeka na całe kompaktowanie
+        """
+        try:
+            for day, world in await self.write(ENRICH_PRIORITY, closed_days, today):
+                moved = await self.write(ENRICH_PRIORITY, compact_world_day, world, day)
+                self.log(f"Archiwum {world} {day} - {moved} wierszy aktywności")
+        except Exception as e:
+            self.log(f"Archiwum - błąd kompaktowania ({type(e).__name__}: {e})")
+
+    def fetch_stats(self, now: datetime) -> PollResult:
+        """
+        Pobiera stronę /stats zapytaniem warunkowym; niezmienionej strony ani sekcji z graczami nie parsuje ponownie
+        """
+        result = self.poller.fetch(self.deadline)
+        if self.recorder is not None:
+            self.recorder.save_stats(now, result.content)
+        return result
+
+    # --- uzupełnianie profili ---
+
+    async def lease_keeper(self):
+        """
+        Bierze i odnawia dzierżawę klucza `shard`; po jej utracie wstrzymuje uzupełnianie i opróżnia kolejkę,
+        żeby nie pobierać profili, które obsługuje już inny proces
+        """
+        name = self.shard.lease_name
+        waiting = False
+        while True:
+            try:
+                held = await self.write(TICK_PRIORITY, acquire_lease, name, self.owner)
+            except Exception as e:
+                self.log(f"Dzierżawa {name} - błąd odnowienia ({type(e).__name__})")
+                held = False
+            if held and not self.lease_held.is_set():
+                self.log(f"Dzierżawa {name} - przejęta")
+                self.lease_held.set()
+            elif not held and self.lease_held.is_set():
+                self.log(f"Dzierżawa {name} - utracona, wstrzymuję uzupełnianie")
+                self.lease_held.clear()
+                self.refresh_queue.clear()
+                while not self.enrich_queue.empty():
+                    _, char = self.enrich_queue.get_nowait()
+                    self.refresh_queue.done(char[0])
+                    self.enrich_queue.task_done()
+            elif not held and not waiting:
+                self.log(f"Dzierżawa {name} - należy do innego procesu, czekam")
+            waiting = not held
+            await asyncio.sleep(LEASE_TTL / 3)
+
+    async def enrich_producer(self):
+        """
+        Co PLAN_INTERVAL wybiera postacie do pobrania profilu (stats.refresh.plan) do kolejki priorytetowej,
+        a z niej w tempie budżetu zapytań przekazuje je do ograniczonej kolejki pracowników
+        Gdy kolejka się opróżni, a któryś priorytet miał więcej kandydatów niż limit, planuje od razu
+        Z kluczem `shard` - tylko postacie swoich kont i tylko dopóki proces ma dzierżawę klucza
+        """
+        next_plan, more = 0.0, False
+        while True:
+            await self.lease_held.wait()
+            if time.monotonic() >= next_plan or (more and not self.refresh_queue):
+                candidates = await self.write(ENRICH_PRIORITY, plan, datetime.now(), self.queue_size, self.shard)
+                self.refresh_queue.clear()
+                for priority, char in candidates:
+                    self.refresh_queue.push(priority, char)
+                more = any(n >= self.queue_size for n in Counter(p for p, _ in candidates).values())
+                next_plan = time.monotonic() + PLAN_INTERVAL
+                if metrics.enabled:
+                    metrics.enrich_pending.set(await self.write(ENRICH_PRIORITY, self._pending_count, self.shard))
+                    for name, n in self.refresh_queue.counts().items():
+                        metrics.refresh_planned.set(n, priority=name)
+            item = self.refresh_queue.pop()
+            if item is None:
+                if more:
+                    # planowanie przed zapisem pobieranych profili zwróciłoby te same postacie
+                    await self.enrich_queue.join()
+                else:
+                    await asyncio.sleep(max(next_plan - time.monotonic(), 0))
+                continue
+            await asyncio.sleep(self.budget.reserve())
+            await self.enrich_queue.put(item)
+
+    @staticmethod
+    def _pending_count(shard: Optional[Shard] = None) -> int:
+        query_set = Character.objects.filter(lvl=None)
+        return (shard.filter(query_set) if shard is not None else query_set).count()
+
+    async def enrich_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, char = await self.enrich_queue.get()
+            data, result = None, 'error'
+            try:
+                await self.poll_idle.wait()
+                self.stats.in_flight += 1
+                try:
+                    data = await loop.run_in_executor(self.enrich_executor, self.fetch_profile, *char[1:])
+                finally:
+                    self.stats.in_flight -= 1
+                result = 'missing' if data is None else 'ok'
+            except Exception as e:
+                self.log(f"Profil {char[1:]} - błąd ({type(e).__name__})")
+            try:
+                # nieudana próba też przesuwa czas odświeżenia - postać wróci do kolejki po czasie swojego priorytetu
+                await self.write(ENRICH_PRIORITY, self._save_profile, char[0], char[1], data, datetime.now())
+            except Exception as e:
+                result = 'error'
+                self.log(f"Profil {char[1:]} - błąd zapisu ({type(e).__name__})")
+            finally:
+                self.refresh_queue.done(char[0])
+                self.enrich_queue.task_done()
+            if result == 'ok':
+                self.stats.enriched += 1
+            else:
+                self.stats.failed += 1
+            metrics.enriched.inc(result=result, priority=PRIORITY_NAMES[priority])
+
+    def fetch_profile(self, aid: int, cid: int, world: str) -> Optional[dict]:
+        r = self.session.get(self.base_url + PROFILE_PATH.format(aid=aid, cid=cid, world=world), timeout=30)
+        r.raise_for_status()
+        if self.recorder is not None:
+            self.recorder.save_profile(aid, r.content)
+        return parse_profile(r.text, cid)
+
+    @staticmethod
+    def _save_profile(character_id: int, aid: int, data: Optional[dict], refreshed_at: datetime):
+        """
+        Zapisuje dane z profilu i czas odświeżenia; bez danych (profil niedostępny) tylko czas próby
+        """
+        Character.objects.filter(pk=character_id).update(**(data or {}), refreshed_at=refreshed_at)
+        if data is not None:
+            mark_enriched()
+            invalidate(aid, refreshed_at.date())
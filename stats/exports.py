@@ -0,0 +1,256 @@
+import base64
+import csv
+import heapq
+import itertools
+import os
+import tempfile
+import zipfile
+from datetime import date
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, TextIO, Tuple, Union
+
+import numpy as np
+from django.db.models import QuerySet
+
+from .archive import EPOCH, archived_dates, archived_worlds, count_archived_rows, iter_archived_rows
+from .models import Activity, count_minutes
+
+# Format binarny (.msta): nagłówek BINARY_HEADER_DTYPE, a po nim rekordy RECORD_DTYPE o stałej długości
+# Liczbę rekordów wyznacza rozmiar pliku, więc plik można zapisywać strumieniowo i czytać przez np.memmap
+MAGIC = b'MSTA'
+VERSION = 1
+
+BINARY_HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u1'), ('reserved', '<u1'), ('record_size', '<u2')])
+RECORD_DTYPE = np.dtype([
+    ('aid', '<u4'),
+    ('cid', '<u4'),
+    ('day', '<u2'),  # liczba dni od 1970-01-01
+    ('world', 'S10'),
+    ('activity', 'u1', (180,)),
+])
+
+CSV_HEADER = ['aid', 'cid', 'world', 'date', 'total_minutes', 'activity']
+CHUNK_SIZE = 5000
+
+Row = Tuple[int, int, str, date, int, bytes]
+ROW_ORDER = ('character__account_id', 'character__cid', 'character__world', 'date')
+
+
+def activity_query_set(aid: Optional[int] = None, world: Optional[str] = None,
+                       date_from: Optional[date] = None, date_to: Optional[date] = None) -> QuerySet:
+    """
+    Zwraca aktywności konta, świata i/lub zakresu dat z bazy (bez archiwum), uporządkowane tak jak w eksporcie XML
+    """
+    query_set = Activity.objects.all()
+    if aid is not None:
+        query_set = query_set.filter(character__account_id=aid)
+    if world is not None:
+        query_set = query_set.filter(character__world=world)
+    if date_from is not None:
+        query_set = query_set.filter(date__gte=date_from)
+    if date_to is not None:
+        query_set = query_set.filter(date__lte=date_to)
+    return query_set.order_by(*ROW_ORDER)
+
+
+def iter_rows(query_set: QuerySet) -> Iterator[Row]:
+    return query_set.values_list(
+        'character__account_id', 'character__cid', 'character__world', 'date', 'total_minutes', 'activity'
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def iter_activity_rows(aid: Optional[int] = None, world: Optional[str] = None,
+                       date_from: Optional[date] = None, date_to: Optional[date] = None) -> Iterator[Row]:
+    """
+    Zwraca aktywności z archiwum zamkniętych dni (stats.archive) oraz z bazy
+    Dla konta wiersze obu źródeł są scalane w kolejności (cid, world, date); bez konta najpierw są zwracane
+    wiersze z archiwum (plik po pliku), a potem z bazy
+    Dzień dograny do bazy po kompaktowaniu jest w obu źródłach - taki wiersz jest zwracany raz, z bitmapami
+    połączonymi przez OR, tak jak połączy je następne kompaktowanie
+    """
+    archived = iter_archived_rows(aid, world, date_from, date_to)
+    rows = iter_rows(activity_query_set(aid, world, date_from, date_to))
+    if aid is not None:
+        return merge_duplicates(heapq.merge(archived, rows, key=row_key))
+    return _iter_all_rows(archived, rows, late_rows(world, date_from, date_to))
+
+
+def row_key(row: Row) -> Tuple[int, int, str, date]:
+    return row[:4]
+
+
+def merge_rows(a: Row, b: Row) -> Row:
+    activity = np.bitwise_or(np.frombuffer(a[5], dtype=np.uint8), np.frombuffer(b[5], dtype=np.uint8)).tobytes()
+    return a[:4] + (count_minutes(activity), activity)
+
+
+def merge_duplicates(rows: Iterator[Row]) -> Iterator[Row]:
+    """
+    Łączy sąsiednie wiersze o tym samym kluczu (aid, cid, world, date) w uporządkowanym strumieniu
+    """
+    for _, group in itertools.groupby(rows, key=row_key):
+        row = next(group)
+        for duplicate in group:
+            row = merge_rows(row, duplicate)
+        yield row
+
+
+def late_rows(world: Optional[str] = None, date_from: Optional[date] = None,
+              date_to: Optional[date] = None) -> Dict[Tuple[int, int, str, date], Row]:
+    """
+    :return: wiersze bazy z dni nie późniejszych niż ostatni zarchiwizowany dzień świata - dograne po kompaktowaniu
+             (zwykle nieliczne, bo kompaktowanie usuwa wiersze z bazy)
+    """
+    late = {}
+    for w in ([world] if world is not None else archived_worlds()):
+        days = archived_dates(w)
+        if not days:
+            continue
+        last = days[-1] if date_to is None else min(days[-1], date_to)
+        for row in iter_rows(activity_query_set(None, w, date_from, last)):
+            late[row_key(row)] = row
+    return late
+
+
+def _iter_all_rows(archived: Iterator[Row], rows: Iterator[Row], late: Dict[Tuple[int, int, str, date], Row]
+                   ) -> Iterator[Row]:
+    merged = set()
+    for row in archived:
+        key = row_key(row)
+        if key in late:
+            merged.add(key)
+            row = merge_rows(row, late[key])
+        yield row
+    for row in rows:
+        if row_key(row) not in merged:
+            yield row
+
+
+def count_activity_rows(aid: Optional[int] = None, world: Optional[str] = None,
+                        date_from: Optional[date] = None, date_to: Optional[date] = None) -> int:
+    """
+    :return: górne oszacowanie liczby wierszy `iter_activity_rows` - dzień dograny po kompaktowaniu jest liczony
+             dwa razy, choć eksport zwraca go raz
+    """
+    return activity_query_set(aid, world, date_from, date_to).count() + count_archived_rows(
+        aid, world, date_from, date_to
+    )
+
+
+def iter_chunks(rows: Iterator[Row], size: int = CHUNK_SIZE) -> Iterator[List[Row]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def to_records(chunk: List[Row]) -> np.ndarray:
+    records = np.zeros(len(chunk), dtype=RECORD_DTYPE)
+    records['aid'] = [row[0] for row in chunk]
+    records['cid'] = [row[1] for row in chunk]
+    records['world'] = [row[2].encode() for row in chunk]
+    records['day'] = [(row[3] - EPOCH).days for row in chunk]
+    records['activity'] = np.frombuffer(b''.join(bytes(row[5]) for row in chunk), dtype=np.uint8).reshape(-1, 180)
+    return records
+
+
+def write_binary(rows: Iterator[Row], f: BinaryIO) -> int:
+    """
+    Zapisuje aktywności w formacie binarnym: spakowane bitmapy (180 bajtów) z 20-bajtowym nagłówkiem rekordu
+    :return: liczbę zapisanych rekordów
+    """
+    header = np.array([(MAGIC, VERSION, 0, RECORD_DTYPE.itemsize)], dtype=BINARY_HEADER_DTYPE)
+    f.write(header.tobytes())
+    count = 0
+    for chunk in iter_chunks(rows):
+        f.write(to_records(chunk).tobytes())
+        count += len(chunk)
+    return count
+
+
+def read_binary(path: Union[str, Path]) -> np.ndarray:
+    """
+    Otwiera plik binarny jako tablicę rekordów RECORD_DTYPE bez wczytywania go do pamięci (np.memmap)
+    Daty: `EPOCH + timedelta(days=int(r['day']))` lub `np.datetime64('1970-01-01') + r['day']`
+    """
+    header = np.fromfile(path, dtype=BINARY_HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]['magic'] != MAGIC:
+        raise ValueError(f"{path} nie jest plikiem eksportu aktywności")
+    if header[0]['version'] != VERSION or header[0]['record_size'] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path}: nieobsługiwana wersja formatu {header[0]['version']}")
+    if os.path.getsize(path) == BINARY_HEADER_DTYPE.itemsize:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=BINARY_HEADER_DTYPE.itemsize)
+
+
+def write_csv(rows: Iterator[Row], f: TextIO) -> int:
+    """
+    Zapisuje aktywności jako CSV; bitmapa jest zakodowana w base64 (240 znaków zamiast 1440)
+    """
+    writer = csv.writer(f)
+    writer.writerow(CSV_HEADER)
+    count = 0
+    for aid, cid, world, activity_date, total_minutes, activity in rows:
+        writer.writerow([
+            aid, cid, world, activity_date.isoformat(), total_minutes, base64.b64encode(bytes(activity)).decode()
+        ])
+        count += 1
+    return count
+
+
+def write_npz(rows: Iterator[Row], count: int, path: Union[str, Path]) -> int:
+    """
+    Zapisuje aktywności jako archiwum NPZ z kolumnami aid, cid, world, date (datetime64[D]), total_minutes
+    oraz macierzą activity (n x 180, uint8)
+    Kolumny są wypełniane strumieniowo w plikach .npy mapowanych w pamięć, a potem pakowane do archiwum,
+    więc zużycie pamięci nie zależy od liczby rekordów; `count` to górne oszacowanie liczby rekordów policzone przed
+    eksportem (count_activity_rows) - kolumny są przycinane do liczby rekordów faktycznie zapisanych
+    :return: liczbę zapisanych rekordów (długość kolumn w archiwum)
+    """
+    columns = {
+        'aid': ('<u4', ()),
+        'cid': ('<u4', ()),
+        'world': ('U10', ()),
+        'date': ('<M8[D]', ()),
+        'total_minutes': ('<u2', ()),
+        'activity': ('u1', (180,)),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        arrays = {
+            name: np.lib.format.open_memmap(
+                os.path.join(tmp, f'{name}.npy'), mode='w+', dtype=dtype, shape=(count,) + shape
+            )
+            for name, (dtype, shape) in columns.items()
+        }
+        written = 0
+        for chunk in iter_chunks(rows):
+            chunk = chunk[:count - written]  # rekordy dodane po policzeniu pomijamy
+            records = to_records(chunk)
+            end = written + len(chunk)
+            arrays['aid'][written:end] = records['aid']
+            arrays['cid'][written:end] = records['cid']
+            arrays['world'][written:end] = [row[2] for row in chunk]
+            arrays['date'][written:end] = records['day'].astype('<M8[D]')
+            arrays['total_minutes'][written:end] = [row[4] for row in chunk]
+            arrays['activity'][written:end] = records['activity']
+            written = end
+            if written >= count:
+                break
+        for array in arrays.values():
+            array.flush()
+        del arrays
+
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name in columns:
+                column_path = os.path.join(tmp, f'{name}.npy')
+                if written < count:
+                    # np.save kopiuje wycinek z pliku mapowanego w pamięć, bez wczytywania całej kolumny
+                    truncated_path = os.path.join(tmp, f'{name}.truncated.npy')
+                    np.save(truncated_path, np.load(column_path, mmap_mode='r')[:written])
+                    column_path = truncated_path
+                archive.write(column_path, f'{name}.npy')
+    return written
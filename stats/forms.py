@@ -1,9 +1,12 @@
+from datetime import date, timedelta
+
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm, UsernameField, UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 
-from stats.models import Account
+from stats.models import Account, Character, LeaderboardEntry
+from stats.search import get_index
 
 
 class DateInput(forms.DateField):
@@ -11,10 +14,13 @@ class DateInput(forms.DateField):
 
 
 def validate_account_id(value: int):
-    """Funkcja sprawdza, czy konto o danym ID znajduje się w bazie"""
-    try:
-        Account.objects.get(pk=value)
-    except Account.DoesNotExist:
+    """
+    Funkcja sprawdza, czy konto o danym ID znajduje się w bazie
+    Znane konta są sprawdzane w indeksie podpowiedzi (stats.search), do bazy trafiają tylko nieznane ID
+    """
+    if get_index().has_account(value):
+        return
+    if not Account.objects.filter(pk=value).exists():
         raise ValidationError(f'Konta z ID {value} nie ma w bazie!')
 
 
@@ -62,6 +68,77 @@ class FollowAccountForm(forms.Form):
     account_id = AccountIdField()
 
 
+class LeaderboardForm(forms.Form):
+    """Formularz do wyboru rankingu aktywności"""
+    period = forms.ChoiceField(
+        label='Okres',
+        choices=(
+            (LeaderboardEntry.Period.DAY, 'dzień'),
+            (LeaderboardEntry.Period.WEEK, 'tydzień'),
+            (LeaderboardEntry.Period.MONTH, 'miesiąc')
+        ),
+        required=False
+    )
+    date = forms.DateField(
+        label='Dzień',
+        widget=forms.DateInput(attrs={'type': 'date'}),
+        required=False
+    )
+    world = forms.CharField(
+        label='Świat',
+        max_length=10,
+        required=False
+    )
+    prof = forms.ChoiceField(
+        label='Profesja',
+        choices=(('', 'wszystkie'),) + tuple(Character.Profession.choices),
+        required=False
+    )
+
+
+class HeatmapForm(forms.Form):
+    """
+    Formularz do wyboru zakresu heatmapy aktywności (konto i/lub świat, zakres dat)
+    Brakujący koniec zakresu to dzisiaj, brakujący początek - DEFAULT_DAYS dni przed końcem
+    """
+    DEFAULT_DAYS = 7
+    MAX_DAYS = 366
+
+    aid = forms.IntegerField(
+        label='ID konta',
+        min_value=0,
+        required=False
+    )
+    world = forms.CharField(
+        label='Świat',
+        max_length=10,
+        required=False
+    )
+    date_from = forms.DateField(
+        label='Od',
+        widget=forms.DateInput(attrs={'type': 'date'}),
+        required=False
+    )
+    date_to = forms.DateField(
+        label='Do',
+        widget=forms.DateInput(attrs={'type': 'date'}),
+        required=False
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if 'date_from' not in cleaned_data or 'date_to' not in cleaned_data:
+            return cleaned_data
+        date_to = cleaned_data['date_to'] or date.today()
+        date_from = cleaned_data['date_from'] or date_to - timedelta(days=self.DEFAULT_DAYS - 1)
+        if date_from > date_to:
+            raise ValidationError('Początek zakresu musi być przed jego końcem!')
+        if (date_to - date_from).days >= self.MAX_DAYS:
+            raise ValidationError(f'Zakres może mieć najwyżej {self.MAX_DAYS} dni!')
+        cleaned_data.update(date_from=date_from, date_to=date_to)
+        return cleaned_data
+
+
 class MyAuthenticationForm(AuthenticationForm):
     """Formularz do logowania użytkownika"""
     username = UsernameField(
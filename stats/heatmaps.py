@@ -0,0 +1,154 @@
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .archive import archived_worlds, is_hot, open_day
+from .caching import CACHE_TIMEOUT, KEY_PREFIX, counters, stats_cache
+from .exports import iter_chunks
+from .models import Activity, Character
+
+MINUTES_PER_DAY = 1440
+CHUNK_SIZE = 5000
+CACHE_KEY_FORMAT = KEY_PREFIX + ':heatmap:{scope}:{day:%Y%m%d}'
+
+WEEKDAYS = ('pon.', 'wt.', 'śr.', 'czw.', 'pt.', 'sob.', 'niedz.')
+
+
+@dataclass
+class Heatmap:
+    """
+    Zagregowana aktywność w zakresie dat (dla konta, świata lub wszystkich światów)
+    minutes - histogram minut dnia: ile razy postacie były online w danej minucie (suma po dniach)
+    weekday_hour - macierz 7 x 24 (poniedziałek - niedziela) z liczbą minut online postaci w danej godzinie
+    days_per_weekday - liczba dni zakresu przypadających na każdy dzień tygodnia (do uśredniania)
+    """
+    date_from: date
+    date_to: date
+    minutes: np.ndarray = field(default_factory=lambda: np.zeros(MINUTES_PER_DAY, dtype=np.int64))
+    weekday_hour: np.ndarray = field(default_factory=lambda: np.zeros((7, 24), dtype=np.int64))
+    days_per_weekday: np.ndarray = field(default_factory=lambda: np.zeros(7, dtype=np.int64))
+
+    def add_day(self, day: date, minutes: np.ndarray):
+        self.minutes += minutes
+        self.weekday_hour[day.weekday()] += minutes.reshape(24, 60).sum(axis=1)
+        self.days_per_weekday[day.weekday()] += 1
+
+    def average_online(self) -> np.ndarray:
+        """
+        :return: macierz 7 x 24 ze średnią liczbą postaci online w danej godzinie danego dnia tygodnia
+        """
+        days = np.maximum(self.days_per_weekday, 1)[:, None]
+        return self.weekday_hour / (60 * days)
+
+    def minute_buckets(self, size: int = 15) -> np.ndarray:
+        """
+        :return: średnią liczbę postaci online w przedziałach `size` minut (1440 / size wartości)
+        """
+        days = max(int(self.days_per_weekday.sum()), 1)
+        return self.minutes.reshape(-1, size).sum(axis=1) / (size * days)
+
+
+def bit_sums(packed: np.ndarray) -> np.ndarray:
+    """
+    Sumuje bitmapy (n x 180, uint8) kolumnami: jedno np.unpackbits na kawałek CHUNK_SIZE wierszy
+    :return: wektor 1440 liczb - ile bitmap ma ustawioną daną minutę
+    """
+    total = np.zeros(MINUTES_PER_DAY, dtype=np.int64)
+    for i in range(0, len(packed), CHUNK_SIZE):
+        total += np.unpackbits(packed[i:i + CHUNK_SIZE], axis=1).sum(axis=0, dtype=np.int64)
+    return total
+
+
+def scope_key(world: Optional[str] = None, aid: Optional[int] = None) -> str:
+    if aid is not None:
+        return f"account:{aid}" if world is None else f"account:{aid}:{world}"
+    return f"world:{world}" if world is not None else 'all'
+
+
+def scope_worlds(world: Optional[str] = None, aid: Optional[int] = None) -> List[str]:
+    if world is not None:
+        return [world]
+    if aid is not None:
+        return list(Character.objects.filter(account_id=aid).values_list('world', flat=True).distinct().order_by())
+    return archived_worlds()
+
+
+def archived_day_minutes(day: date, worlds: Iterable[str], aid: Optional[int] = None) -> np.ndarray:
+    """
+    Histogram minut dnia z archiwum - sumowane są zmapowane macierze dni (dla konta tylko jego wiersze)
+    """
+    total = np.zeros(MINUTES_PER_DAY, dtype=np.int64)
+    for world in worlds:
+        archived = open_day(world, day)
+        if archived is None:
+            continue
+        activity = archived.activity if aid is None else archived.activity[archived.index['aid'] == aid]
+        total += bit_sums(activity)
+    return total
+
+
+def database_minutes(days: List[date], world: Optional[str] = None,
+                     aid: Optional[int] = None) -> Dict[date, np.ndarray]:
+    """
+    Histogramy minut dni z tabeli *stats_activity*: surowe bitmapy z jednego zapytania (`values_list`) są układane
+    w macierz, rozpakowywane jednym np.unpackbits na kawałek i sumowane osobno dla każdego dnia (np.add.reduceat)
+    Zapytanie obejmuje cały zakres od pierwszego do ostatniego dnia (brakujące dni zwykle leżą obok siebie)
+    """
+    result = {day: np.zeros(MINUTES_PER_DAY, dtype=np.int64) for day in days}
+    if not days:
+        return result
+    query_set = Activity.objects.filter(date__range=(min(days), max(days)))
+    if world is not None:
+        query_set = query_set.filter(character__world=world)
+    if aid is not None:
+        query_set = query_set.filter(character__account_id=aid)
+    rows = query_set.order_by('date').values_list('date', 'activity').iterator(chunk_size=CHUNK_SIZE)
+
+    for chunk in iter_chunks(rows):
+        dates = [row[0] for row in chunk]
+        packed = np.frombuffer(b''.join(bytes(row[1]) for row in chunk), dtype=np.uint8).reshape(-1, 180)
+        starts = [0] + [i for i in range(1, len(dates)) if dates[i] != dates[i - 1]]
+        sums = np.add.reduceat(np.unpackbits(packed, axis=1), starts, axis=0, dtype=np.int64)
+        for start, minutes in zip(starts, sums):
+            if dates[start] in result:
+                result[dates[start]] += minutes
+    return result
+
+
+def day_minutes(days: List[date], world: Optional[str] = None, aid: Optional[int] = None) -> Dict[date, np.ndarray]:
+    """
+    :return: histogramy minut dla podanych dni; dni z archiwum są czytane z macierzy, pozostałe z bazy
+    """
+    worlds = scope_worlds(world, aid)
+    result = database_minutes(days, world, aid)
+    for day in days:
+        result[day] += archived_day_minutes(day, worlds, aid)
+    return result
+
+
+def heatmap(date_from: date, date_to: date, world: Optional[str] = None, aid: Optional[int] = None) -> Heatmap:
+    """
+    Tworzy heatmapę aktywności konta, świata (lub konta na świecie) albo wszystkich światów w zakresie dat
+    Histogramy zamkniętych dni są zapisywane w cache, więc zapytanie o zakres liczy tylko brakujące dni
+    i dodaje gotowe wektory; dni, które mogą się jeszcze zmienić (stats.archive.is_hot), są liczone zawsze
+    """
+    days = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    scope = scope_key(world, aid)
+    closed_keys = {CACHE_KEY_FORMAT.format(scope=scope, day=day): day for day in days if not is_hot(day)}
+    cache = stats_cache()
+    cached = {closed_keys[key]: minutes for key, minutes in cache.get_many(list(closed_keys)).items()}
+    counters.hits['heatmap'] += len(cached)
+    counters.misses['heatmap'] += len(closed_keys) - len(cached)
+
+    computed = day_minutes([day for day in days if day not in cached], world, aid)
+    cache.set_many(
+        {key: computed[day] for key, day in closed_keys.items() if day in computed},
+        timeout=CACHE_TIMEOUT
+    )
+
+    result = Heatmap(date_from, date_to)
+    for day in days:
+        result.add_day(day, cached[day] if day in cached else computed[day])
+    return result
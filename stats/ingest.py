@@ -0,0 +1,174 @@
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from django.db import transaction
+from django.db.models import Q
+
+from .caching import invalidate_minute
+from .coverage import record_tick
+from .database import current_alias
+from .leaderboards import record_minute
+from .models import Account, Character, Activity, Tick
+
+T = TypeVar('T')
+
+# SQLite ogranicza liczbę parametrów w jednym zapytaniu, więc listy w `__in` dzielimy na kawałki
+BATCH_SIZE = 500
+
+Profile = Tuple[int, int, str]
+
+
+@dataclass
+class IngestResult:
+    """
+    Podsumowanie zapisu jednej minuty aktywności
+    new_players - gracze spoza listy `known` (nowo zalogowani), dla których sprawdzano konta i postacie w bazie
+    character_ids - id postaci wszystkich zapisanych graczy; do przekazania jako `known` przy następnej minucie
+    """
+    players: int = 0
+    new_players: int = 0
+    created_accounts: int = 0
+    created_characters: int = 0
+    created_activities: int = 0
+    updated_activities: int = 0
+    duration: float = 0.0
+    character_ids: Dict[Profile, int] = field(default_factory=dict, repr=False)
+
+
+def chunks(items: Sequence[T], size: int = BATCH_SIZE) -> Iterator[Sequence[T]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def normalize_profiles(profiles: Iterable[Tuple]) -> List[Profile]:
+    """
+    Zamienia krotki (aid, cid, world) wyciągnięte ze strony na liczby i usuwa duplikaty, zachowując kolejność
+    """
+    return list(dict.fromkeys((int(aid), int(cid), world) for (aid, cid, world) in profiles))
+
+
+def set_minute(activity: bytes, minute: int) -> bytearray:
+    """
+    Ustawia bit odpowiadający danej minucie dnia
+    """
+    a = bytearray(activity)
+    a[minute // 8] |= 1 << (7 - minute % 8)
+    return a
+
+
+def ingest_minute(profiles: Iterable[Tuple], now: datetime, known: Optional[Dict[Profile, int]] = None
+                  ) -> IngestResult:
+    """
+    Zapisuje aktywność wszystkich zalogowanych graczy w danej minucie
+    Zamiast trzech `get_or_create` i `save` na gracza wykonuje stałą liczbę zapytań na każde BATCH_SIZE graczy:
+    pobiera istniejące konta, postacie i dzisiejsze aktywności, tworzy brakujące przez `bulk_create`
+    i aktualizuje tylko zmienione bitmapy przez `bulk_update` - wszystko w jednej transakcji
+    `known` - id postaci graczy zapisanych w poprzedniej minucie (IngestResult.character_ids); konta i postacie
+    sprawdzane są tylko dla graczy spoza tej listy, a pozostali dostają tylko minutę aktywności i czas ostatniej wizyty
+    W tej samej transakcji dopisuje minutę do dziennika Tick i pokrycia dnia (stats.coverage) wraz z wykrytą luką
+    Po zatwierdzeniu transakcji unieważnia w cache dzisiejsze wpisy kont, którym doszła minuta aktywności
+    """
+    start = time.perf_counter()
+    profiles = normalize_profiles(profiles)
+    minute = now.hour * 60 + now.minute
+    known = known or {}
+    new = [profile for profile in profiles if profile not in known]
+    result = IngestResult(players=len(profiles), new_players=len(new))
+
+    with transaction.atomic(using=current_alias()):
+        result.created_accounts = _ensure_accounts({aid for (aid, _, _) in new})
+        _mark_accounts_seen({aid for (aid, _, _) in profiles}, now.date(), minute)
+        character_ids, result.created_characters = _ensure_characters(new)
+        character_ids.update((profile, known[profile]) for profile in profiles if profile in known)
+        marked = _mark_activities(list(character_ids.values()), now, minute)
+        result.created_activities, result.updated_activities = len(marked['created']), len(marked['updated'])
+        worlds = {pk: world for ((_, _, world), pk) in character_ids.items()}
+        record_minute({pk: worlds[pk] for pk in marked['created'] + marked['updated']}, now.date())
+        Tick.objects.update_or_create(date=now.date(), minute=minute, defaults={'players': len(profiles)})
+        record_tick(now)
+
+    account_ids = {pk: aid for ((aid, _, _), pk) in character_ids.items()}
+    invalidate_minute(
+        now.date(),
+        {account_ids[pk] for pk in marked['created'] + marked['updated']},
+        {account_ids[pk] for pk in marked['created']}
+    )
+    result.character_ids = character_ids
+    result.duration = time.perf_counter() - start
+    return result
+
+
+def _ensure_accounts(aids: set) -> int:
+    existing = set()
+    for batch in chunks(sorted(aids)):
+        existing.update(Account.objects.filter(aid__in=batch).values_list('aid', flat=True))
+    missing = [Account(aid=aid) for aid in sorted(aids - existing)]
+    Account.objects.bulk_create(missing, batch_size=BATCH_SIZE)
+    return len(missing)
+
+
+def _mark_accounts_seen(aids: set, day: date, minute: int):
+    """
+    Ustawia kontom ostatnio widzianą minutę; nie cofa jej przy odtwarzaniu starszych nagrań
+    """
+    older = Q(last_seen_date=None) | Q(last_seen_date__lt=day) | Q(last_seen_date=day, last_seen_minute__lt=minute)
+    for batch in chunks(sorted(aids)):
+        Account.objects.filter(older, aid__in=batch).update(last_seen_date=day, last_seen_minute=minute)
+
+
+def _fetch_character_ids(profiles: List[Profile]) -> Dict[Profile, int]:
+    wanted = set(profiles)
+    character_ids = {}
+    for batch in chunks(sorted({aid for (aid, _, _) in profiles})):
+        rows = Character.objects.filter(account_id__in=batch).values_list('id', 'account_id', 'cid', 'world')
+        for (pk, aid, cid, world) in rows:
+            if (aid, cid, world) in wanted:
+                character_ids[(aid, cid, world)] = pk
+    return character_ids
+
+
+def _ensure_characters(profiles: List[Profile]) -> Tuple[Dict[Profile, int], int]:
+    character_ids = _fetch_character_ids(profiles)
+    missing = [
+        Character(account_id=aid, cid=cid, world=world)
+        for (aid, cid, world) in profiles if (aid, cid, world) not in character_ids
+    ]
+    if missing:
+        Character.objects.bulk_create(missing, batch_size=BATCH_SIZE)
+        # nie każdy backend zwraca klucze z bulk_create, więc pobieramy je ponownie
+        character_ids = _fetch_character_ids(profiles)
+    return character_ids, len(missing)
+
+
+def _mark_activities(character_ids: List[int], now: datetime, minute: int) -> Dict[str, List[int]]:
+    """
+    :return: id postaci, którym utworzono ('created') lub zmieniono ('updated') aktywność w tej minucie
+    """
+    today = now.date()
+    activities = {}
+    for batch in chunks(sorted(character_ids)):
+        for activity in Activity.objects.filter(date=today, character_id__in=batch):
+            activities[activity.character_id] = activity
+
+    to_create, to_update = [], []
+    for character_id in character_ids:
+        activity = activities.get(character_id)
+        if activity is None:
+            to_create.append(Activity(
+                character_id=character_id, date=today, activity=set_minute(bytes(180), minute), total_minutes=1
+            ))
+            continue
+        a = set_minute(activity.activity, minute)
+        if a != activity.activity:
+            activity.activity = a
+            activity.total_minutes += 1
+            to_update.append(activity)
+
+    Activity.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    Activity.objects.bulk_update(to_update, ['activity', 'total_minutes'], batch_size=BATCH_SIZE)
+    return {
+        'created': [activity.character_id for activity in to_create],
+        'updated': [activity.character_id for activity in to_update],
+    }
@@ -0,0 +1,188 @@
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F, Q, QuerySet, Sum
+
+from .archive import archived_totals
+from .database import current_alias
+from .models import Activity, LeaderboardEntry
+
+Period = LeaderboardEntry.Period
+
+BATCH_SIZE = 500
+
+
+def period_start(period: str, day: date) -> date:
+    """
+    :return: pierwszy dzień okresu rankingu, do którego należy dany dzień
+    """
+    if period == Period.WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == Period.MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def period_end(period: str, day: date) -> date:
+    """
+    :return: ostatni dzień okresu rankingu, do którego należy dany dzień
+    """
+    start = period_start(period, day)
+    if period == Period.WEEK:
+        return start + timedelta(days=6)
+    if period == Period.MONTH:
+        return (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start
+
+
+def record_minute(worlds: Dict[int, str], day: date):
+    """
+    Dolicza jedną minutę aktywności postaciom (character_id -> world) w rankingach dnia, tygodnia i miesiąca
+    Wywoływane przez ingest w tej samej transakcji co zapis bitmap
+    """
+    character_ids = sorted(worlds)
+    for period in Period.values:
+        start = period_start(period, day)
+        for i in range(0, len(character_ids), BATCH_SIZE):
+            batch = character_ids[i:i + BATCH_SIZE]
+            entries = LeaderboardEntry.objects.filter(period=period, period_start=start, character_id__in=batch)
+            existing = dict(entries.values_list('character_id', 'id'))
+            LeaderboardEntry.objects.filter(pk__in=existing.values()).update(minutes=F('minutes') + 1)
+            LeaderboardEntry.objects.bulk_create([
+                LeaderboardEntry(period=period, period_start=start, character_id=cid, world=worlds[cid], minutes=1)
+                for cid in batch if cid not in existing
+            ])
+
+
+def rebuild_period(period: str, day: date) -> int:
+    """
+    Przelicza od nowa ranking okresu zawierającego dany dzień na podstawie `Activity.total_minutes`
+    oraz czasów aktywności zapisanych w indeksach archiwum zamkniętych dni
+    Okres, który już się zakończył, zostaje oznaczony jako sfinalizowany
+    :return: liczbę pozycji w rankingu
+    """
+    start, end = period_start(period, day), period_end(period, day)
+    finalized = end < date.today()
+    totals = archived_totals(start, end)
+    rows = (
+        Activity.objects.filter(date__range=(start, end))
+        .values('character_id', 'character__world')
+        .annotate(minutes=Sum('total_minutes'))
+    )
+    for row in rows:
+        world, minutes = totals.get(row['character_id'], (row['character__world'], 0))
+        totals[row['character_id']] = (world, minutes + row['minutes'])
+    entries = [
+        LeaderboardEntry(
+            period=period, period_start=start, character_id=character_id, world=world, minutes=minutes,
+            finalized=finalized
+        )
+        for character_id, (world, minutes) in totals.items() if minutes > 0
+    ]
+    with transaction.atomic(using=current_alias()):
+        LeaderboardEntry.objects.filter(period=period, period_start=start).delete()
+        LeaderboardEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+    return len(entries)
+
+
+def finalize_day(day: date):
+    """
+    Zamyka dzień: przelicza jego ranking oraz rankingi tygodnia i miesiąca, do których należy
+    Wywoływane przy zmianie daty w *scrap-stats* oraz przez komendę *finalize-leaderboards*
+    """
+    for period in Period.values:
+        rebuild_period(period, day)
+
+
+def leaderboard(period: str, day: date, world: Optional[str] = None,
+                prof: Optional[str] = None) -> QuerySet[LeaderboardEntry]:
+    query_set = LeaderboardEntry.objects.filter(period=period, period_start=period_start(period, day))
+    if world:
+        query_set = query_set.filter(world=world)
+    if prof:
+        query_set = query_set.filter(character__prof=prof)
+    return query_set.select_related('character').order_by('-minutes', 'character_id')
+
+
+Cursor = Tuple[int, int]
+
+
+def format_cursor(entry: LeaderboardEntry) -> str:
+    return f"{entry.minutes}.{entry.character_id}"
+
+
+def parse_cursor(value: str) -> Cursor:
+    """
+    :return: klucz (minuty, id postaci) z kursora "<minuty>.<id postaci>"; ValueError, gdy kursor jest niepoprawny
+    """
+    minutes, character_id = (int(part) for part in value.split('.'))
+    if minutes < 0 or character_id < 1:
+        raise ValueError(value)
+    return minutes, character_id
+
+
+@dataclass
+class LeaderboardPage:
+    """
+    Strona rankingu wybrana kluczem (minuty, id postaci) zamiast OFFSET - zapytanie czyta z indeksu rankingu tylko
+    wiersze strony, więc czas odpowiedzi nie zależy od jej numeru ani od liczby pozycji w okresie
+    start - pozycja pierwszego wiersza w rankingu; nie jest liczona, tylko przenoszona w odnośnikach stron
+    next, previous - kursory następnej i poprzedniej strony (None, gdy takiej strony nie ma)
+    """
+    entries: List[LeaderboardEntry]
+    start: int
+    next: Optional[str]
+    previous: Optional[str]
+
+    @property
+    def next_start(self) -> int:
+        return self.start + len(self.entries)
+
+    @property
+    def rows(self) -> Iterator[Tuple[int, LeaderboardEntry]]:
+        return enumerate(self.entries, start=self.start)
+
+
+def leaderboard_page(period: str, day: date, world: Optional[str] = None, prof: Optional[str] = None,
+                     after: Optional[Cursor] = None, before: Optional[Cursor] = None, start: int = 1,
+                     per_page: int = 50) -> LeaderboardPage:
+    """
+    :param after: kursor ostatniego wiersza poprzedniej strony - strona zaczyna się tuż za nim
+    :param before: kursor pierwszego wiersza następnej strony - strona kończy się tuż przed nim
+    :param start: pozycja pierwszego wiersza strony `after` albo wiersza `before`
+    """
+    query_set = leaderboard(period, day, world, prof)
+    if before is not None:
+        minutes, character_id = before
+        rows = list(
+            query_set.filter(Q(minutes__gt=minutes) | Q(minutes=minutes, character_id__lt=character_id))
+            .order_by('minutes', '-character_id')[:per_page + 1]
+        )
+        entries = rows[:per_page][::-1]
+        if entries:
+            more = len(rows) > per_page
+            return LeaderboardPage(
+                entries=entries,
+                start=max(start - len(entries), 1) if more else 1,
+                next=format_cursor(entries[-1]),
+                previous=format_cursor(entries[0]) if more else None,
+            )
+        after, start = None, 1
+    if after is not None:
+        minutes, character_id = after
+        query_set = query_set.filter(Q(minutes__lt=minutes) | Q(minutes=minutes, character_id__gt=character_id))
+    rows = list(query_set[:per_page + 1])
+    entries = rows[:per_page]
+    return LeaderboardPage(
+        entries=entries,
+        start=max(start, 1) if after is not None else 1,
+        next=format_cursor(entries[-1]) if len(rows) > per_page else None,
+        previous=format_cursor(entries[0]) if after is not None and entries else None,
+    )
+
+
+def latest_leaderboard_date() -> Optional[date]:
+    entry = LeaderboardEntry.objects.filter(period=Period.DAY).order_by('-period_start').first()
+    return entry.period_start if entry is not None else None
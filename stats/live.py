@@ -0,0 +1,413 @@
+import asyncio
+import json
+import logging
+import socket
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from functools import cached_property
+from importlib import import_module
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+from django.urls import reverse
+
+from . import metrics
+from .ingest import Profile, normalize_profiles
+from .models import Following
+
+logger = logging.getLogger(__name__)
+
+# Strumień zmian "kto wszedł / kto wyszedł" w kolejnych minutach (Server-Sent Events)
+# Scraper (osobny proces) wylicza różnicę zbiorów graczy online i wysyła ją datagramami UDP na LIVE_FEED_ADDRESS;
+# proces ASGI odbiera je jednym gniazdem i rozsyła w pamięci (Broker) do kolejek otwartych połączeń
+# Portu UDP nie może współdzielić kilka procesów, więc przy LIVE_FEED_WORKERS = N scraper wysyła każdy datagram
+# na N kolejnych portów, a każdy worker ASGI nasłuchuje na pierwszym wolnym (feed_addresses)
+# Połączenie to tylko korutyna czekająca na kolejce, więc tysiące bezczynnych przeglądarek nie zajmują wątków
+LIVE_FEED_ADDRESS = getattr(settings, 'LIVE_FEED_ADDRESS', ('127.0.0.1', 8765))
+LIVE_FEED_WORKERS = getattr(settings, 'LIVE_FEED_WORKERS', 1)
+# wpisów (aid, cid) w jednym datagramie - zakodowany JSON zostaje daleko poniżej limitu 64 KB
+CHUNK_ENTRIES = 2000
+QUEUE_SIZE = 16
+HEARTBEAT = 25.0
+RETRY_MS = 5000
+
+
+@dataclass
+class WorldDelta:
+    """
+    Zmiany na jednym świecie w danej minucie
+    online / offline - postacie (aid, cid), które weszły do gry / z niej wyszły
+    left - konta, które wyszły z gry całkowicie (nie mają już żadnej postaci online na żadnym świecie)
+    players - liczba graczy online na świecie po tej minucie
+    Duże zmiany są dzielone na kilka obiektów z tą samą minutą i światem (po CHUNK_ENTRIES wpisów)
+    """
+    day: date
+    minute: int
+    world: str
+    players: int
+    online: List[Tuple[int, int]] = field(default_factory=list)
+    offline: List[Tuple[int, int]] = field(default_factory=list)
+    left: List[int] = field(default_factory=list)
+
+    def encode(self) -> bytes:
+        return json.dumps({
+            'date': f"{self.day:%Y%m%d}",
+            'minute': self.minute,
+            'world': self.world,
+            'players': self.players,
+            'online': self.online,
+            'offline': self.offline,
+            'left': self.left,
+        }, separators=(',', ':')).encode()
+
+    @classmethod
+    def decode(cls, data: bytes) -> 'WorldDelta':
+        d = json.loads(data)
+        return cls(
+            day=datetime.strptime(d['date'], '%Y%m%d').date(), minute=d['minute'], world=d['world'],
+            players=d['players'], online=[tuple(e) for e in d['online']],
+            offline=[tuple(e) for e in d['offline']], left=d['left'],
+        )
+
+    @cached_property
+    def by_account(self) -> Dict[int, 'WorldDelta']:
+        """
+        Zmiany rozbite na konta - liczone raz na datagram, żeby filtr obserwowanych kont kosztował O(liczba kont)
+        """
+        accounts = {}
+        for name in ('online', 'offline'):
+            for aid, cid in getattr(self, name):
+                delta = accounts.setdefault(aid, WorldDelta(self.day, self.minute, self.world, self.players))
+                getattr(delta, name).append((aid, cid))
+        for aid in self.left:
+            accounts.setdefault(aid, WorldDelta(self.day, self.minute, self.world, self.players)).left.append(aid)
+        return accounts
+
+    def for_accounts(self, aids: Set[int]) -> Optional['WorldDelta']:
+        """
+        :return: zmiany dotyczące tylko podanych kont albo None, jeśli żadne z nich się nie zmieniło
+        """
+        by_account = self.by_account
+        matched = [by_account[aid] for aid in aids if aid in by_account]
+        if not matched:
+            return None
+        return WorldDelta(
+            self.day, self.minute, self.world, self.players,
+            online=[e for d in matched for e in d.online],
+            offline=[e for d in matched for e in d.offline],
+            left=[aid for d in matched for aid in d.left],
+        )
+
+    @cached_property
+    def event(self) -> bytes:
+        """
+        Ramka SSE - kodowana raz na obiekt, bo ten sam obiekt trafia do wszystkich połączeń bez filtra kont
+        """
+        return b'event: delta\ndata: ' + self.encode() + b'\n\n'
+
+
+def feed_addresses(address: Tuple[str, int] = LIVE_FEED_ADDRESS, workers: int = LIVE_FEED_WORKERS
+                   ) -> List[Tuple[str, int]]:
+    """
+    :return: adresy odbiorników workerów ASGI - po jednym porcie na worker, od portu z `address`
+    """
+    host, port = address
+    return [(host, port + i) for i in range(max(1, workers))]
+
+
+def online_delta(previous: Set[Profile], current: Set[Profile], now: datetime) -> List[WorldDelta]:
+    """
+    Porównuje zbiory postaci (aid, cid, świat) online w poprzedniej i bieżącej minucie
+    :return: zmiany pogrupowane po światach (tylko światy, na których coś się zmieniło)
+    """
+    minute = now.hour * 60 + now.minute
+    players: Dict[str, int] = {}
+    for (_, _, world) in current:
+        players[world] = players.get(world, 0) + 1
+    online_aids = {aid for (aid, _, _) in current}
+
+    deltas: Dict[str, WorldDelta] = {}
+    for name, profiles in (('online', current - previous), ('offline', previous - current)):
+        for (aid, cid, world) in sorted(profiles):
+            delta = deltas.setdefault(world, WorldDelta(now.date(), minute, world, players.get(world, 0)))
+            getattr(delta, name).append((aid, cid))
+            if name == 'offline' and aid not in online_aids and aid not in delta.left:
+                delta.left.append(aid)
+    return [deltas[world] for world in sorted(deltas)]
+
+
+def split_delta(delta: WorldDelta, size: int = CHUNK_ENTRIES) -> List[WorldDelta]:
+    """
+    Dzieli zmiany świata na kawałki mieszczące się w jednym datagramie
+    """
+    entries = [('online', e) for e in delta.online] + [('offline', e) for e in delta.offline]
+    if len(entries) <= size:
+        return [delta]
+    parts = []
+    for i in range(0, len(entries), size):
+        part = WorldDelta(delta.day, delta.minute, delta.world, delta.players)
+        for name, entry in entries[i:i + size]:
+            getattr(part, name).append(entry)
+        offline_aids = {aid for aid, _ in part.offline}
+        part.left = [aid for aid in delta.left if aid in offline_aids]
+        parts.append(part)
+    return parts
+
+
+class FeedPublisher:
+    """
+    Strona scrapera: pamięta zbiór postaci online z ostatniej zapisanej minuty i wysyła różnice datagramami UDP
+    do odbiorników wszystkich workerów ASGI (feed_addresses)
+    Wysyłanie nie blokuje i nie zgłasza błędów - jeśli nikt nie słucha, zmiany po prostu przepadają
+    Pierwsza minuta po uruchomieniu tylko zapamiętuje stan (nie ma z czym porównać)
+    """
+
+    def __init__(self, address: Tuple[str, int] = LIVE_FEED_ADDRESS, workers: int = LIVE_FEED_WORKERS):
+        self.addresses = feed_addresses(tuple(address), workers)
+        self.previous: Optional[Set[Profile]] = None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sent = 0
+
+    def publish_minute(self, profiles: Iterable[Tuple], now: datetime) -> List[WorldDelta]:
+        current = set(normalize_profiles(profiles))
+        previous, self.previous = self.previous, current
+        if previous is None:
+            return []
+        deltas = [part for delta in online_delta(previous, current, now) for part in split_delta(delta)]
+        for delta in deltas:
+            data = delta.encode()
+            for address in self.addresses:
+                try:
+                    self.sock.sendto(data, address)
+                    self.sent += 1
+                except OSError:
+                    pass
+        return deltas
+
+    def close(self):
+        self.sock.close()
+
+
+class Subscription:
+    """
+    Kolejka jednego połączenia; zmiany spoza filtra (świat / konta) nie trafiają do kolejki
+    Gdy klient nie nadąża, najstarsze zmiany są wyrzucane, a `dropped` mówi ile ich przepadło
+    """
+
+    def __init__(self, broker: 'Broker', world: Optional[str] = None, aids: Optional[Set[int]] = None,
+                 maxsize: int = QUEUE_SIZE):
+        self.broker = broker
+        self.world = world
+        self.aids = aids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, delta: WorldDelta):
+        if self.world is not None and delta.world != self.world:
+            return
+        if self.aids is not None:
+            delta = delta.for_accounts(self.aids)
+            if delta is None:
+                return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            metrics.live_dropped.inc()
+        self.queue.put_nowait(delta)
+
+    async def get(self) -> WorldDelta:
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.subscriptions.discard(self)
+
+
+class Broker:
+    """
+    Pub/sub w pamięci procesu ASGI - publish jest wywoływane w pętli zdarzeń (z odbiornika datagramów)
+    """
+
+    def __init__(self):
+        self.subscriptions: Set[Subscription] = set()
+        self.published = 0
+
+    def subscribe(self, world: Optional[str] = None, aids: Optional[Set[int]] = None,
+                  maxsize: int = QUEUE_SIZE) -> Subscription:
+        subscription = Subscription(self, world, aids, maxsize)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def publish(self, delta: WorldDelta):
+        self.published += 1
+        for subscription in list(self.subscriptions):
+            subscription.put(delta)
+
+
+class FeedReceiver(asyncio.DatagramProtocol):
+    def __init__(self, broker: Broker):
+        self.broker = broker
+
+    def datagram_received(self, data: bytes, addr):
+        try:
+            delta = WorldDelta.decode(data)
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Strumień na żywo - niepoprawny datagram od %s", addr)
+            return
+        self.broker.publish(delta)
+
+
+broker = Broker()
+metrics.registry.add_collector('live', lambda: metrics.live_subscribers.set(len(broker.subscriptions)))
+_transport: Optional[asyncio.DatagramTransport] = None
+_receiver_lock: Optional[asyncio.Lock] = None
+
+
+async def ensure_receiver(address: Tuple[str, int] = LIVE_FEED_ADDRESS, workers: int = LIVE_FEED_WORKERS) -> bool:
+    """
+    Przy pierwszym połączeniu otwiera w procesie ASGI gniazdo odbierające zmiany od scrapera, na pierwszym wolnym
+    porcie z feed_addresses (port zajęty przez inny worker jest pomijany)
+    :return: czy odbiornik działa; False, gdy wszystkie porty są zajęte (więcej workerów niż LIVE_FEED_WORKERS)
+    """
+    global _transport, _receiver_lock
+    if _transport is not None:
+        return True
+    if _receiver_lock is None:
+        _receiver_lock = asyncio.Lock()
+    async with _receiver_lock:
+        if _transport is None:
+            addresses = feed_addresses(tuple(address), workers)
+            for local_address in addresses:
+                try:
+                    _transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                        lambda: FeedReceiver(broker), local_addr=local_address
+                    )
+                    break
+                except OSError:
+                    continue
+            else:
+                logger.warning("Strumień na żywo - wszystkie porty odbiorników %s są zajęte (LIVE_FEED_WORKERS = %d)",
+                               addresses, workers)
+                return False
+    return True
+
+
+def followed_accounts(headers: List[Tuple[bytes, bytes]]) -> Set[int]:
+    """
+    Konta obserwowane przez zalogowanego użytkownika (sesja z ciasteczka), pusty zbiór dla anonimowego
+    """
+    from django.contrib.auth import get_user
+
+    close_old_connections()
+    cookies = parse_cookie(b'; '.join(value for name, value in headers if name == b'cookie').decode('latin1'))
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+        cookies.get(settings.SESSION_COOKIE_NAME)
+    )
+    user = get_user(request)
+    if not user.is_authenticated:
+        return set()
+    return set(Following.objects.filter(user=user).values_list('account_id', flat=True))
+
+
+class LiveFeedApp:
+    """
+    Aplikacja ASGI wysyłająca zmiany jako Server-Sent Events (`event: delta`, dane jak WorldDelta.encode)
+    Parametry: world - tylko dany świat; aid (wielokrotny) - tylko podane konta; following=1 - konta obserwowane
+    przez zalogowanego użytkownika. Co HEARTBEAT sekund wysyłany jest komentarz, żeby pośrednicy nie zamykali
+    bezczynnego połączenia; `event: lagged` oznacza, że klient nie nadążał i część zmian przepadła
+    """
+
+    def __init__(self, broker: Broker = broker, heartbeat: float = HEARTBEAT):
+        self.broker = broker
+        self.heartbeat = heartbeat
+
+    async def __call__(self, scope, receive, send):
+        params = parse_qs(scope.get('query_string', b'').decode('latin1'))
+        world = params.get('world', [None])[0] or None
+        try:
+            aids = {int(aid) for aid in params.get('aid', [])}
+        except ValueError:
+            await self.error(send, 400, "Niepoprawny parametr aid")
+            return
+        if params.get('following', [''])[0] in ('1', 'true'):
+            aids |= await sync_to_async(followed_accounts)(scope.get('headers', []))
+            if not aids:
+                await self.error(send, 403, "Brak obserwowanych kont (lub użytkownik nie jest zalogowany)")
+                return
+        if not await ensure_receiver():
+            await self.error(send, 503, "Strumień na żywo jest niedostępny")
+            return
+
+        subscription = self.broker.subscribe(world=world, aids=aids or None)
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+        get = None
+        try:
+            await send({'type': 'http.response.body', 'body': f'retry: {RETRY_MS}\n\n'.encode(), 'more_body': True})
+            while True:
+                if get is None:
+                    get = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait({get, disconnect}, timeout=self.heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    break
+                if get in done:
+                    body = get.result().event
+                    get = None
+                    if subscription.dropped:
+                        body = f'event: lagged\ndata: {subscription.dropped}\n\n'.encode() + body
+                        subscription.dropped = 0
+                else:
+                    body = b': ping\n\n'
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        except OSError:
+            # klient zniknął w trakcie wysyłania
+            pass
+        finally:
+            subscription.close()
+            for task in (get, disconnect):
+                if task is not None:
+                    task.cancel()
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    async def error(send, status: int, message: str):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+        await send({'type': 'http.response.body', 'body': message.encode()})
+
+
+class LiveFeedRouter:
+    """
+    Kieruje żądania HTTP na adres strumienia (stats:live) do LiveFeedApp, a wszystko inne do aplikacji Django
+    Widok Django pod tym samym adresem obsługuje tylko serwer WSGI (runserver), gdzie strumień nie działa
+    """
+
+    def __init__(self, application, live_app: Optional[LiveFeedApp] = None):
+        self.application = application
+        self.live_app = live_app or LiveFeedApp()
+        self.path = reverse('stats:live')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == self.path:
+            await self.live_app(scope, receive, send)
+        else:
+            await self.application(scope, receive, send)
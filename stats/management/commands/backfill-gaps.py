@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stats.database import use_writer
+from stats.ingest import ingest_minute
+from stats.models import Tick
+from stats.parsing import parse_stats_page
+from stats.replay import iter_recorded_stats, recorded_minute, recorded_stats_files
+
+
+class Command(BaseCommand):
+    """
+    Komenda dogrywająca brakujące minuty z nagrania `scrap-stats --record` (np. z drugiej instancji scrapera albo
+    gdy zapis minuty do bazy się nie powiódł): zapisuje tylko nagrane minuty, których nie ma w dzienniku Tick
+    Dograna minuta znika z maski brakujących minut dnia (stats.coverage)
+    Rankingi zamkniętych już dni warto potem przeliczyć komendą finalize-leaderboards
+
+    Uruchomienie: `py .\manage.py backfill-gaps <katalog z nagraniem> [--dry-run]`
+    """
+    help = 'Dogrywa z nagrania minuty brakujące w bazie'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='katalog z nagraniem')
+        parser.add_argument('--dry-run', action='store_true', help='tylko wypisz minuty do dogrania')
+
+    def handle(self, *args, **options):
+        files = recorded_stats_files(options['directory'])
+        if not files:
+            raise CommandError(f"Brak nagranych stron /stats w {options['directory']}")
+        first, last = recorded_minute(files[0]).date(), recorded_minute(files[-1]).date()
+        recorded = set(Tick.objects.filter(date__range=(first, last)).values_list('date', 'minute'))
+
+        def missing(now) -> bool:
+            return (now.date(), now.hour * 60 + now.minute) not in recorded
+
+        filled = []
+        for now, html in iter_recorded_stats(options['directory'], only=missing):
+            if not options['dry_run']:
+                with use_writer():
+                    result = ingest_minute(parse_stats_page(html), now)
+                self.stdout.write(f"{now:%Y-%m-%d %H:%M} - {result.players} graczy")
+            else:
+                self.stdout.write(f"{now:%Y-%m-%d %H:%M}")
+            filled.append(now)
+        self.stdout.write(
+            f"{'Do dogrania' if options['dry_run'] else 'Dograno'}: {len(filled)} z {len(files)} nagranych minut"
+        )
@@ -0,0 +1,83 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from stats.models import Activity, get_start_end_list, render_activity_plot
+
+
+def legacy_start_end_list(bits: np.ndarray):
+    """Poprzednia implementacja - pętla po 1440 bitach"""
+    start_end_list = []
+    start = None
+    for i in range(0, len(bits)):
+        if bits[i] == 1 and start is None:
+            start = i
+        if bits[i] == 0 and start is not None:
+            start_end_list.append((start, i))
+            start = None
+    if start is not None:
+        start_end_list.append((start, len(bits)))
+    return start_end_list
+
+
+def legacy_activity_plot(activity: bytes) -> str:
+    """Poprzednia implementacja - ticki godzin budowane przy każdym wywołaniu"""
+    plot_width = 720
+    bits = np.unpackbits(np.asarray(bytearray(activity)))
+    div_list = []
+    for i in range(60, 1440, 60):
+        left = round(i * plot_width / 1440, 4) + 10
+        div_list.append(f"""<div class="activity-plot-hour-line" style="left: {left}px;"></div>""")
+        hour = f"{i // 60:02d}"
+        div_list.append(f"""<div class="activity-plot-hour" style="left: {left - 6}px;">{hour}</div>""")
+    for (start, end) in legacy_start_end_list(bits):
+        left = round(start * plot_width / 1440, 4) + 10
+        width = round((end - start) * plot_width / 1440, 4)
+        div_list.append(f"""<div class="activity-plot-line" style="left: {left}px; width: {width}px;"></div>""")
+    return "\n".join(div_list)
+
+
+class Command(BaseCommand):
+    """
+    Mikro-benchmark wykresu aktywności: poprzednia pętla w Pythonie, wersja wektorowa oraz wersja z cache
+    Sprawdza też, czy wszystkie wersje generują identyczny HTML
+
+    Uruchomienie: `py .\manage.py bench-activity-plot --limit 1000`
+    """
+    help = 'Porównuje czas generowania wykresu aktywności przed i po wektoryzacji'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='liczba aktywności z bazy')
+
+    def handle(self, *args, **options):
+        activities = list(Activity.objects.order_by('-total_minutes').only('id', 'activity')[:options['limit']])
+        if not activities:
+            raise CommandError('Brak aktywności w bazie')
+        bitmaps = [bytes(activity.activity) for activity in activities]
+
+        for bitmap in bitmaps:
+            bits = np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8))
+            if get_start_end_list(bits) != legacy_start_end_list(bits):
+                raise CommandError('Przedziały aktywności różnią się od poprzedniej implementacji')
+            if render_activity_plot(bitmap) != legacy_activity_plot(bitmap):
+                raise CommandError('Wykres różni się od poprzedniej implementacji')
+
+        results = {
+            'pętla (poprzednio)': self.measure(lambda: [legacy_activity_plot(b) for b in bitmaps]),
+            'wektorowo': self.measure(lambda: [render_activity_plot(b) for b in bitmaps]),
+            'wektorowo + cache': self.measure(lambda: [activity.activity_plot for activity in activities]),
+        }
+        for name, seconds in results.items():
+            self.stdout.write(f"{name}: {seconds / len(bitmaps) * 1e6:.1f} µs/wykres")
+
+    @staticmethod
+    def measure(func, repeat: int = 3) -> float:
+        func()  # rozgrzewka (wypełnia cache)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
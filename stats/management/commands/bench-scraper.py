@@ -0,0 +1,124 @@
+import time
+import tracemalloc
+from collections import Counter
+from datetime import timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from stats.ingest import ingest_minute
+from stats.parsing import STATS_PATH, parse_stats_page, parse_stats_page_bs4
+from stats.polling import MODIFIED, NOT_MODIFIED, UNCHANGED, StatsPoller
+from stats.replay import ReplayServer, iter_recorded_stats, recorded_stats_files
+
+
+class Command(BaseCommand):
+    """
+    Komenda mierząca przepustowość parsowania i zapisu na nagraniu z `scrap-stats --record`
+    Nagrane minuty są przetwarzane tak szybko, jak to możliwe, tą samą ścieżką co w *scrap-stats*
+    Domyślnie zmiany w bazie są wycofywane po zakończeniu pomiaru
+    Z `--server` strony są pobierane z lokalnego serwera odtwarzającego nagranie przez stats.polling (zapytania
+    warunkowe, skrót sekcji), a `--hold N` zwraca każdą stronę N razy z rzędu - wynik pokazuje przesłane bajty
+    i liczbę stron niepobranych (304) lub niesparsowanych (te same sekcje)
+
+    Uruchomienie: `py .\manage.py bench-scraper <katalog z nagraniem> [--server --hold 3]`
+    """
+    help = 'Mierzy przepustowość parsowania i zapisu na nagranych stronach /stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='katalog z nagraniem')
+        parser.add_argument('--server', action='store_true',
+                            help='pobieraj strony z lokalnego serwera odtwarzającego nagranie zamiast z plików')
+        parser.add_argument('--repeat', type=int, default=1, help='liczba przebiegów nagrania')
+        parser.add_argument('--hold', type=int, default=1,
+                            help='z --server: ile razy z rzędu serwer zwraca każdą stronę /stats')
+        parser.add_argument('--no-validators', action='store_true',
+                            help='z --server: serwer bez ETag i Last-Modified')
+        parser.add_argument('--no-diff', action='store_true',
+                            help='sprawdzaj konta i postacie wszystkich graczy, bez różnicowania z poprzednią minutą')
+        parser.add_argument('--keep', action='store_true', help='nie wycofuj zmian w bazie')
+        parser.add_argument('--verify', action='store_true',
+                            help='porównuj wynik szybkiego parsowania z BeautifulSoup na każdej stronie')
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='mierz szczytową pamięć przez tracemalloc (wolniej, ale dokładniej)')
+
+    def handle(self, *args, **options):
+        if not recorded_stats_files(options['directory']):
+            raise CommandError(f"Brak nagranych stron /stats w {options['directory']}")
+
+        server = poller = None
+        if options['server']:
+            server = ReplayServer(options['directory'], hold=options['hold'], validators=not options['no_validators'])
+            server.start()
+            poller = StatsPoller(requests.Session(), server.base_url + STATS_PATH)
+
+        parse_time = ingest_time = 0.0
+        queries = []
+        statuses, transferred = Counter(), 0
+        known, previous = None, None
+        if options['trace_memory']:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            with transaction.atomic():
+                for _ in range(options['repeat']):
+                    for now, html in iter_recorded_stats(options['directory']):
+                        if poller is not None:
+                            poll = poller.fetch(timeout=50)
+                            profiles, html = poll.profiles, poll.content.decode('utf-8', errors='replace')
+                            parse_time += poll.parse_time
+                            statuses[poll.status] += 1
+                            transferred += poll.transferred
+                        else:
+                            t0 = time.perf_counter()
+                            profiles = parse_stats_page(html)
+                            parse_time += time.perf_counter() - t0
+                        if options['verify'] and profiles != parse_stats_page_bs4(html):
+                            raise CommandError(f"Minuta {now}: wynik parsowania różni się od BeautifulSoup")
+
+                        if options['no_diff'] or previous != now - timedelta(minutes=1):
+                            known = None
+                        t0 = time.perf_counter()
+                        with CaptureQueriesContext(connection) as ctx:
+                            known = ingest_minute(profiles, now, known).character_ids
+                        ingest_time += time.perf_counter() - t0
+                        queries.append(len(ctx.captured_queries))
+                        previous = now
+                if not options['keep']:
+                    transaction.set_rollback(True)
+        finally:
+            total = time.perf_counter() - start
+            peak = self.peak_memory()
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        ticks = len(queries)
+        lines = [
+            f"Minut: {ticks}, czas: {total:.2f} s, {ticks / total:.1f} minut/s",
+            f"Parsowanie: {parse_time / ticks * 1000:.1f} ms/minutę, zapis: {ingest_time / ticks * 1000:.1f} ms/minutę",
+            f"Zapytania na minutę: średnio {sum(queries) / ticks:.1f}, maksymalnie {max(queries)}",
+        ]
+        if poller is not None:
+            lines.append(f"Strony /stats: przesłano {transferred / 2 ** 20:.2f} MiB, " + ', '.join(
+                f"{status}: {statuses[status]}" for status in (MODIFIED, NOT_MODIFIED, UNCHANGED)))
+        if peak is not None:
+            lines.append(f"Szczytowe zużycie pamięci: {peak / 2 ** 20:.1f} MiB")
+        self.stdout.write("\n".join(lines))
+
+    @staticmethod
+    def peak_memory():
+        if tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return peak
+        if resource is not None:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux podaje KiB
+        return None
@@ -0,0 +1,187 @@
+import argparse
+import json
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+from stats import database
+from stats.database import WRITER_ALIAS, use_writer
+from stats.ingest import ingest_minute
+from stats.models import Account, Activity, LeaderboardEntry, Tick
+from stats.parsing import parse_stats_page
+from stats.replay import iter_recorded_stats, recorded_stats_files
+
+
+class Command(BaseCommand):
+    """
+    Komenda mierząca współbieżność SQLite: `--readers` procesów (jak workery serwera WWW) wykonuje zapytania jak
+    w widokach (ostatnia minuta, aktywność konta w dniu, strona rankingu), a w tym czasie komenda zapisuje kolejne
+    minuty z nagrania `scrap-stats --record` tą samą ścieżką co scraper (połączenie zapisu), co `--interval` sekund
+    Pomiar odbywa się na kopii bazy w katalogu tymczasowym, więc zapisane minuty są naprawdę zatwierdzane
+    Z `--baseline` kopia jest w trybie journal_mode=DELETE, bez pragm i bez połączenia zapisu - dla porównania
+
+    Uruchomienie: `py .\manage.py bench-sqlite <katalog z nagraniem> [--readers 8] [--seconds 20] [--baseline]`
+    """
+    help = 'Mierzy opóźnienia odczytów i zapisu minut SQLite przy równoległych czytelnikach'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='katalog z nagraniem')
+        parser.add_argument('--readers', type=int, default=8, help='liczba procesów czytających')
+        parser.add_argument('--seconds', type=float, default=20.0, help='czas pomiaru')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='odstęp (s) między zapisami kolejnych minut; 0 - zapis bez przerw')
+        parser.add_argument('--baseline', action='store_true',
+                            help='bez WAL, pragm i połączenia zapisu (konfiguracja sprzed profilu produkcyjnego)')
+        # tryb procesu czytającego uruchamianego przez samą komendę
+        parser.add_argument('--reader-config', default=None, help=argparse.SUPPRESS)
+        parser.add_argument('--seed', type=int, default=0, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['reader_config'] is not None:
+            self.reader(json.loads(Path(options['reader_config']).read_text()), options['seed'])
+            return
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite':
+            raise CommandError("Komenda obsługuje tylko bazę SQLite")
+        if not recorded_stats_files(options['directory']):
+            raise CommandError(f"Brak nagranych stron /stats w {options['directory']}")
+        pages = [parse_stats_page(html) for _, html in iter_recorded_stats(options['directory'])]
+        sample = Activity.objects.order_by('-date').values_list('date', flat=True).first()
+        if sample is None:
+            raise CommandError("Baza nie zawiera aktywności")
+        aids = list(
+            Activity.objects.filter(date=sample).order_by('-total_minutes')
+            .values_list('character__account_id', flat=True)[:500]
+        )
+        last_tick = Tick.latest()
+        start_day = (last_tick.date if last_tick is not None else sample) + timedelta(days=1)
+
+        directory = Path(tempfile.mkdtemp(prefix='bench-sqlite-'))
+        aliases = {DEFAULT_DB_ALIAS, WRITER_ALIAS}
+        names = {alias: connections[alias].settings_dict['NAME'] for alias in aliases}
+        try:
+            path = self.copy_database(names[DEFAULT_DB_ALIAS], directory / 'db.sqlite3', options['baseline'])
+            self.use_database(path, options['baseline'])
+            self.stdout.write(f"Tryb: {'baseline' if options['baseline'] else 'profil produkcyjny'}, "
+                              f"journal_mode={self.journal_mode()}, czytelników: {options['readers']}")
+            config = directory / 'reader.json'
+            config.write_text(json.dumps({
+                'database': str(path), 'baseline': options['baseline'], 'aids': aids, 'day': f"{sample:%Y-%m-%d}",
+                'start': time.time() + 3, 'seconds': options['seconds'],
+            }))
+            self.run(pages, config, datetime.combine(start_day, datetime.min.time()), options)
+        finally:
+            connections.close_all()
+            for alias, name in names.items():
+                connections[alias].settings_dict['NAME'] = name
+            database.pragmas_enabled = True
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def use_database(path: Path, baseline: bool):
+        connections.close_all()
+        for alias in {DEFAULT_DB_ALIAS, WRITER_ALIAS}:
+            connections[alias].settings_dict['NAME'] = str(path)
+        database.pragmas_enabled = not baseline
+
+    @staticmethod
+    def copy_database(source, target: Path, baseline: bool) -> Path:
+        src, dst = sqlite3.connect(source), sqlite3.connect(target)
+        try:
+            src.backup(dst)
+            dst.execute(f"PRAGMA journal_mode = {'DELETE' if baseline else 'WAL'}")
+        finally:
+            src.close()
+            dst.close()
+        return target
+
+    @staticmethod
+    def journal_mode() -> str:
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            return cursor.fetchone()[0]
+
+    def run(self, pages: List[list], config: Path, start: datetime, options):
+        readers = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'django', 'bench-sqlite', options['directory'], '--reader-config', str(config),
+                 '--seed', str(i)],
+                stdout=subprocess.PIPE, text=True
+            )
+            for i in range(options['readers'])
+        ]
+        # procesy czytające zaczynają o ustalonej godzinie (po załadowaniu Django), zapis startuje razem z nimi
+        time.sleep(max(json.loads(config.read_text())['start'] - time.time(), 0))
+
+        write_latencies, write_errors = [], 0
+        began = time.perf_counter()
+        i = 0
+        while time.perf_counter() - began < options['seconds']:
+            slot = began + i * options['interval']
+            if slot > time.perf_counter():
+                time.sleep(slot - time.perf_counter())
+            t0 = time.perf_counter()
+            try:
+                if options['baseline']:
+                    ingest_minute(pages[i % len(pages)], start + timedelta(minutes=i))
+                else:
+                    with use_writer():
+                        ingest_minute(pages[i % len(pages)], start + timedelta(minutes=i))
+            except OperationalError as e:
+                write_errors += 1
+                self.stderr.write(f"Minuta {i}: {e}")
+            write_latencies.append(time.perf_counter() - t0)
+            i += 1
+        elapsed = time.perf_counter() - began
+
+        results = [json.loads(reader.communicate()[0]) for reader in readers]
+        read_latencies = [latency for result in results for latency in result['latencies']]
+        read_errors = sum(result['errors'] for result in results)
+        lines = [
+            f"Zapis: {len(write_latencies)} minut, {self.percentiles(write_latencies)}, błędy: {write_errors}",
+            f"Odczyt: {len(read_latencies)} żądań ({len(read_latencies) / elapsed:.0f}/s), "
+            f"{self.percentiles(read_latencies)}, błędy: {read_errors}",
+        ]
+        self.stdout.write("\n".join(lines))
+
+    def reader(self, config: dict, seed: int):
+        """
+        Proces czytający: jedno "żądanie" to zapytania strony szczegółów i rankingu - ostatnia minuta, konto,
+        aktywność konta w dniu, pierwsza strona dziennego rankingu; wynik (opóźnienia, błędy) trafia na stdout
+        """
+        self.use_database(Path(config['database']), config['baseline'])
+        aids, day = config['aids'], date.fromisoformat(config['day'])
+        rng = np.random.default_rng(seed)
+        latencies, errors = [], 0
+        time.sleep(max(config['start'] - time.time(), 0))
+        end = time.time() + config['seconds']
+        while time.time() < end:
+            aid = int(aids[rng.integers(len(aids))])
+            t0 = time.perf_counter()
+            try:
+                Tick.latest()
+                Account.objects.filter(pk=aid).first()
+                list(Activity.objects.filter(character__account_id=aid, date=day).select_related('character'))
+                list(LeaderboardEntry.objects.filter(period='d', period_start=day)
+                     .order_by('-minutes', 'character_id')[:50])
+            except OperationalError:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+        connections.close_all()
+        self.stdout.write(json.dumps({'latencies': latencies, 'errors': errors}))
+
+    @staticmethod
+    def percentiles(latencies: List[float]) -> str:
+        if not latencies:
+            return "brak pomiarów"
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        return f"p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, max {max(latencies) * 1000:.1f} ms"
@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stats.bitmaps import co_online, find_alt_pairs, likely_alts, load_account_matrix, load_character_matrix
+from stats.converters import DateConverter
+from stats.models import Character
+
+
+class Command(BaseCommand):
+    """
+    Komenda odpytująca bitmapy aktywności świata wczytane do jednej macierzy NumPy:
+    - co-online - konta najczęściej online razem z kontem --aid (z --cid: postacie razem z postacią)
+    - alts - pary kont, które nie grają jednocześnie, ale przekazują sobie aktywność (prawdopodobne multikonta);
+      z --aid tylko dla podanego konta
+
+    Uruchomienie: `py .\manage.py bitmap-query alts --world jaruna --date 2023-01-14 --to 2023-01-15`
+    """
+    help = 'Szuka postaci aktywnych razem oraz prawdopodobnych multikont na podstawie bitmap aktywności'
+
+    def add_arguments(self, parser):
+        to_date = DateConverter().to_python
+        parser.add_argument('query', choices=('co-online', 'alts'))
+        parser.add_argument('--world', required=True)
+        parser.add_argument('--date', type=to_date, required=True, help='dzień (RRRR-MM-DD)')
+        parser.add_argument('--to', type=to_date, default=None, help='ostatni dzień zakresu (RRRR-MM-DD)')
+        parser.add_argument('--aid', type=int, default=None, help='id konta')
+        parser.add_argument('--cid', type=int, default=None, help='id postaci (tylko co-online)')
+        parser.add_argument('--min-handoffs', type=int, default=3, help='minimalna liczba przekazań aktywności')
+        parser.add_argument('--max-overlap', type=int, default=0, help='maksymalna liczba wspólnych minut online')
+        parser.add_argument('--exact', action='store_true', help='porównaj wszystkie pary zamiast LSH')
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        query, aid, cid = options['query'], options['aid'], options['cid']
+        if query == 'co-online' and aid is None:
+            raise CommandError('Zapytanie co-online wymaga --aid')
+
+        start = time.perf_counter()
+        if query == 'co-online' and cid is not None:
+            matrix = load_character_matrix(options['world'], options['date'], options['to'])
+            character = Character.objects.filter(account_id=aid, cid=cid, world=options['world']).first()
+            if character is None:
+                raise CommandError(f"Brak postaci [{aid}][{cid}] na świecie {options['world']}")
+            key = character.pk
+        else:
+            matrix = load_account_matrix(options['world'], options['date'], options['to'])
+            key = aid
+        loaded = time.perf_counter()
+
+        if query == 'co-online':
+            rows = co_online(matrix, key, options['limit'])
+            if cid is not None:
+                characters = Character.objects.in_bulk([k for k, _ in rows])
+                lines = [f"{characters[k]}\t{minutes} min." for k, minutes in rows]
+            else:
+                lines = [f"[{k}]\t{minutes} min." for k, minutes in rows]
+        elif key is not None:
+            rows = likely_alts(matrix, key, options['min_handoffs'], options['max_overlap'], limit=options['limit'])
+            lines = [f"[{k}]\t{handed} przekazań\t{overlap} wspólnych min." for k, handed, overlap in rows]
+        else:
+            rows = find_alt_pairs(matrix, options['min_handoffs'], options['max_overlap'], exact=options['exact'])
+            lines = [
+                f"[{a}] [{b}]\t{handed} przekazań\t{overlap} wspólnych min."
+                for a, b, handed, overlap in rows[:options['limit']]
+            ]
+
+        if lines:
+            self.stdout.write("\n".join(lines))
+        self.stderr.write(
+            f"{len(matrix)} wierszy x {matrix.packed.shape[1]} B, wczytanie {loaded - start:.2f} s, "
+            f"zapytanie {time.perf_counter() - loaded:.2f} s"
+        )
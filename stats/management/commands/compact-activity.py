@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stats.archive import ARCHIVE_DIR, HOT_DAYS, closed_days, compact_day, compact_world_day
+from stats.converters import DateConverter
+
+
+class Command(BaseCommand):
+    """
+    Komenda przenosząca aktywność zamkniętych dni z tabeli *stats_activity* do archiwum macierzy dni (stats.archive)
+    Bez argumentów przenosi wszystkie dni starsze niż ACTIVITY_HOT_DAYS; *scrap-stats* robi to samo po zmianie daty
+
+    Uruchomienie: `py .\manage.py compact-activity [--date RRRR-MM-DD] [--world aldous]`
+    """
+    help = 'Przenosi aktywność zamkniętych dni do archiwum'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=DateConverter().to_python, default=None, help='przenieś tylko ten dzień')
+        parser.add_argument('--world', default=None, help='przenieś tylko ten świat')
+
+    def handle(self, *args, **options):
+        world = options['world']
+        start = time.perf_counter()
+        if options['date'] is not None:
+            try:
+                moved = compact_day(options['date'], world)
+            except ValueError as e:
+                raise CommandError(f"{e} (ostatnie {HOT_DAYS} dni zostają w bazie)")
+            results = [(options['date'], w, n) for w, n in moved.items()]
+        else:
+            results = [
+                (day, w, compact_world_day(w, day))
+                for day, w in closed_days() if world is None or w == world
+            ]
+
+        for day, w, moved in results:
+            self.stdout.write(f"{w} {day}: {moved} wierszy")
+        self.stdout.write(
+            f"Przeniesiono {sum(r[2] for r in results)} wierszy aktywności do {ARCHIVE_DIR} "
+            f"w {time.perf_counter() - start:.2f} s"
+        )
@@ -0,0 +1,56 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stats.converters import DateConverter
+from stats.exports import count_activity_rows, iter_activity_rows, write_binary, write_csv, write_npz
+
+
+class Command(BaseCommand):
+    """
+    Komenda eksportująca aktywność konta, świata i/lub zakresu dat w formatach do analiz:
+    - bin - spakowane bitmapy z nagłówkiem (stats.exports.read_binary otwiera plik jako tablicę NumPy)
+    - npz - kolumny NumPy (aid, cid, world, date, total_minutes, activity)
+    - csv - jeden wiersz na dzień, bitmapa w base64
+    Dane są czytane strumieniowo z bazy oraz z archiwum zamkniętych dni
+
+    Uruchomienie: `py .\manage.py export-activity --world aldous --from 2023-01-01 --format npz -o aldous.npz`
+    """
+    help = 'Eksportuje aktywność w formacie binarnym, NPZ lub CSV'
+
+    def add_arguments(self, parser):
+        to_date = DateConverter().to_python
+        parser.add_argument('--aid', type=int, default=None, help='id konta')
+        parser.add_argument('--world', default=None, help='nazwa świata')
+        parser.add_argument('--from', dest='date_from', type=to_date, default=None, help='pierwszy dzień (RRRR-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=to_date, default=None, help='ostatni dzień (RRRR-MM-DD)')
+        parser.add_argument('--format', choices=('bin', 'npz', 'csv'), default='bin')
+        parser.add_argument('-o', '--output', default='-',
+                            help='plik wynikowy; "-" oznacza standardowe wyjście (tylko bin i csv)')
+
+    def handle(self, *args, **options):
+        selection = {
+            'aid': options['aid'], 'world': options['world'],
+            'date_from': options['date_from'], 'date_to': options['date_to'],
+        }
+        output, fmt = options['output'], options['format']
+
+        if fmt == 'npz':
+            if output == '-':
+                raise CommandError('Format npz wymaga podania pliku wynikowego (-o)')
+            count = write_npz(iter_activity_rows(**selection), count_activity_rows(**selection), output)
+        elif fmt == 'bin':
+            if output == '-':
+                count = write_binary(iter_activity_rows(**selection), sys.stdout.buffer)
+            else:
+                with open(output, 'wb') as f:
+                    count = write_binary(iter_activity_rows(**selection), f)
+        else:
+            if output == '-':
+                count = write_csv(iter_activity_rows(**selection), sys.stdout)
+            else:
+                with open(output, 'w', newline='', encoding='utf-8') as f:
+                    count = write_csv(iter_activity_rows(**selection), f)
+
+        if output != '-':
+            self.stdout.write(f"Zapisano {count} dni aktywności do {output}")
@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from stats.archive import archived_dates, archived_worlds
+from stats.converters import DateConverter
+from stats.leaderboards import Period, period_start, rebuild_period
+from stats.models import Activity
+
+
+class Command(BaseCommand):
+    """
+    Komenda przeliczająca zmaterializowane rankingi (dzień, tydzień, miesiąc) z tabeli *stats_activity* i archiwum
+    Bez argumentów przelicza wszystkie okresy, dla których jest aktywność - np. po pierwszym wdrożeniu rankingów
+
+    Uruchomienie: `py .\manage.py finalize-leaderboards [--date RRRR-MM-DD]`
+    """
+    help = 'Przelicza rankingi aktywności z tabeli stats_activity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=DateConverter().to_python, default=None,
+                            help='przelicz tylko okresy zawierające ten dzień')
+
+    def handle(self, *args, **options):
+        if options['date'] is not None:
+            dates = [options['date']]
+        else:
+            dates = set(Activity.objects.values_list('date', flat=True).distinct().order_by())
+            for world in archived_worlds():
+                dates.update(archived_dates(world))
+
+        for period in Period.values:
+            starts = sorted({period_start(period, day) for day in dates})
+            for start in starts:
+                entries = rebuild_period(period, start)
+                self.stdout.write(f"Ranking {Period(period).label} {start}: {entries} pozycji")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from stats.replay import ReplayServer
+
+
+class Command(BaseCommand):
+    """
+    Komenda uruchamiająca lokalny serwer odtwarzający nagranie z `scrap-stats --record`
+    Razem z `scrap-stats --base-url` pozwala testować scraper bez odpytywania margonem.pl
+    Z `--hold N` każda strona /stats jest zwracana N razy z rzędu - scraper dostaje wtedy 304 na zapytania warunkowe
+    (albo, z `--no-validators`, tę samą stronę, której nie parsuje ponownie)
+
+    Uruchomienie: `py .\manage.py replay-stats <katalog z nagraniem> --port 8001 [--hold 3]`
+    """
+    help = 'Odtwarza nagrane strony /stats i profili jako lokalny serwer HTTP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='katalog z nagraniem')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--hold', type=int, default=1, help='ile razy z rzędu zwracać każdą stronę /stats')
+        parser.add_argument('--no-validators', action='store_true',
+                            help='bez ETag i Last-Modified (serwer nie obsługuje zapytań warunkowych)')
+
+    def handle(self, *args, **options):
+        server = ReplayServer(options['directory'], port=options['port'], hold=options['hold'],
+                              validators=not options['no_validators'])
+        self.stdout.write(f"Odtwarzanie {len(server.stats_files)} stron /stats pod {server.base_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -1,63 +1,109 @@
-import re
-import time
-from datetime import datetime
+import asyncio
+import signal
 
-import requests
-from bs4 import BeautifulSoup
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from stats.models import Account, Character, Activity
+from stats import metrics
+from stats.database import set_journal_mode
+from stats.engine import ScraperEngine
+from stats.live import FeedPublisher
+from stats.parsing import BASE_URL
+from stats.refresh import DEFAULT_BUDGET
+from stats.replay import Recorder
+from stats.sharding import Shard, Supervisor
 
 
 class Command(BaseCommand):
     """
     Komenda służąca do aktualizacji:
     - tabeli *stats_activity* z aktywnością graczy
-    - tabeli *stats_character* z danymi o postaciach
+    - tabeli *stats_character* z danymi o postaciach (nowe postacie i okresowe odświeżanie profili, stats.refresh)
+    Zmiany listy graczy online są wysyłane do strumienia na żywo serwera ASGI (settings.LIVE_FEED_ADDRESS)
+    Z `--metrics-port` metryki scrapera (stats.metrics) są dostępne pod http://127.0.0.1:<port>/metrics
+    Z `--workers N` proces zapisuje tylko minuty, a profile uzupełnia N procesów potomnych `--shard k/N`
+    (każdy dla kont o aid % N == k, stats.sharding); procesy `--shard` można też uruchamiać ręcznie, np. na innych
+    maszynach - klucz jest dzierżawiony w bazie, więc dwa procesy z tym samym kluczem nie dublują pracy
 
-    Uruchomienie: `py .\manage.py scrap-stats`
+    Uruchomienie: `py .\manage.py scrap-stats [--workers 4]` albo `py .\manage.py scrap-stats --shard 1/4`
     """
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='liczba równoległych zapytań o profile postaci')
+        parser.add_argument('--deadline', type=float, default=50.0,
+                            help='maksymalny czas (s) pobierania strony /stats w jednej minucie')
+        parser.add_argument('--queue-size', type=int, default=100,
+                            help='maksymalna liczba postaci oczekujących na uzupełnienie profilu')
+        parser.add_argument('--ticks', type=int, default=None,
+                            help='liczba minut, po której komenda się kończy (domyślnie bez końca)')
+        parser.add_argument('--record', metavar='DIR', default=None,
+                            help='zapisuj pobrane strony do katalogu (do odtworzenia przez replay-stats)')
+        parser.add_argument('--base-url', default=BASE_URL,
+                            help='adres serwisu, np. lokalnego serwera replay-stats')
+        parser.add_argument('--no-live-feed', action='store_true',
+                            help='nie wysyłaj zmian graczy online do strumienia na żywo')
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help='port lokalnego serwera metryk w formacie Prometheusa')
+        parser.add_argument('--profile-budget', type=int, default=DEFAULT_BUDGET,
+                            help='maksymalna liczba zapytań o profile na minutę (0 - bez limitu); '
+                                 'z --workers dzielona między procesy')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='liczba procesów uzupełniających profile (0 - wszystko w jednym procesie)')
+        parser.add_argument('--shard', type=Shard.parse, default=None, metavar='K/N',
+                            help='tylko uzupełnianie profili kont o aid %% N == K (bez pobierania /stats)')
+
     def handle(self, *args, **options):
-        last_now = None
-        while True:
-            now = datetime.now().replace(second=0, microsecond=0)
-            # nowa minuta - pobieramy statystyki
-            if last_now != now:
-                last_now = now
-                minute = now.hour * 60 + now.minute
-
-                r = requests.get("https://www.margonem.pl/stats")
-                soup = BeautifulSoup(r.text, 'html.parser')
-                text = "".join([str(s) for s in soup.find_all("div", attrs={"class": "news-body"})[1:9:7]])
-                profiles = re.findall(r'/profile/view,(\d+)#char_(\d+),(\w+)', text)
-
-                for (aid, cid, world) in profiles:
-                    account, _ = Account.objects.get_or_create(aid=aid)
-                    char, _ = Character.objects.get_or_create(account=account, cid=cid, world=world)
-                    activity, _ = Activity.objects.get_or_create(character=char, date=now.date())
-                    a = bytearray(activity.activity)
-                    a[minute // 8] += 2 ** (8 - minute % 8 - 1)
-                    activity.activity = a
-                    activity.save()
-                print(f"Minuta {minute} - {len(profiles)} aktywnych graczy")
-            # w międzyczasie uzupełniamy dane o profilach
-            else:
-                char_query_set = Character.objects.filter(lvl=None)
-                if char_query_set.exists():
-                    char = char_query_set[0]
-                    aid = char.account.aid
-                    cid = char.cid
-                    world = char.world
-                    r2 = requests.get(f"https://www.margonem.pl/profile/view,{aid}#char_{cid},{world}")
-                    soup = BeautifulSoup(r2.text, 'html.parser').find_all(attrs={"data-id": cid})[0]
-                    avatar_url = soup.find("span", attrs={"class": "cimg"})["style"][70:-3]
-                    nick = soup.find("input", attrs={"class": "chnick"})["value"]
-                    lvl = soup.find("input", attrs={"class": "chlvl"})["value"]
-                    prof = soup.find("input", attrs={"class": "chprof"})["value"]
-
-                    char.avatar_url = avatar_url
-                    char.nick = nick
-                    char.lvl = lvl
-                    char.prof = prof
-                    char.save()
-            time.sleep(1)
+        workers, shard = options['workers'], options['shard']
+        if workers < 0:
+            raise CommandError("Liczba procesów uzupełniających nie może być ujemna")
+        if options['profile_budget'] < 0:
+            raise CommandError("Budżet zapytań o profile nie może być ujemny")
+        if workers and shard is not None:
+            raise CommandError("Opcje --workers i --shard wykluczają się")
+        set_journal_mode()
+        if options['metrics_port'] is not None:
+            metrics.serve(options['metrics_port'])
+        engine = ScraperEngine(
+            concurrency=options['concurrency'],
+            deadline=options['deadline'],
+            queue_size=options['queue_size'],
+            base_url=options['base_url'],
+            recorder=Recorder(options['record']) if options['record'] else None,
+            publisher=None if options['no_live_feed'] or shard is not None else FeedPublisher(),
+            poll=shard is None,
+            enrich=not workers,
+            shard=shard,
+            budget=options['profile_budget'],
+        )
+        supervisor = None
+        if workers:
+            supervisor = Supervisor([Shard(i, workers) for i in range(workers)], lambda s: self.worker_args(s, options))
+            supervisor.start()
+        try:
+            asyncio.run(self.run(engine, options['ticks']))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if supervisor is not None:
+                supervisor.stop()
+
+    @staticmethod
+    async def run(engine: ScraperEngine, ticks):
+        # SIGTERM (np. od nadzorcy procesów) anuluje silnik, żeby zwolnił dzierżawę i zamknął połączenia
+        task = asyncio.current_task()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        except NotImplementedError:
+            # Windows nie obsługuje sygnałów w pętli asyncio - proces jest kończony bez sprzątania
+            pass
+        await engine.run(ticks=ticks)
+
+    @staticmethod
+    def worker_args(shard: Shard, options) -> list:
+        args = ['scrap-stats', '--shard', str(shard), '--concurrency', str(options['concurrency']),
+                '--queue-size', str(options['queue_size']), '--base-url', options['base_url'],
+                '--profile-budget', str(-(-options['profile_budget'] // shard.count))]
+        if options['record']:
+            args += ['--record', options['record']]
+        if options['metrics_port'] is not None:
+            args += ['--metrics-port', str(options['metrics_port'] + 1 + shard.index)]
+        return args
@@ -0,0 +1,278 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Liczniki i histogramy gorących ścieżek (zapis minuty, uzupełnianie profili, widoki) w formacie tekstowym Prometheusa
+# Każdy proces ma własny rejestr: serwer WWW wystawia go pod stats:metrics (tylko z tokenem STATS_METRICS_TOKEN),
+# scraper - na porcie --metrics-port. Przy STATS_METRICS = False middleware wyłącza się przy starcie
+# (MiddlewareNotUsed), a wywołania z silnika kończą się na jednym sprawdzeniu flagi
+enabled = getattr(settings, 'STATS_METRICS', True)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TICK_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[tuple, object] = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if not enabled:
+            return
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        """
+        Ustawia wartość licznika prowadzonego gdzie indziej (np. stats.caching.counters) - dla kolektorów
+        """
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        if not enabled:
+            return
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    Histogram o stałych przedziałach: dla każdej kombinacji etykiet liczniki przedziałów, suma i liczba obserwacji
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        if not enabled:
+            return
+        key = self.key(labels)
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self.values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Metryki procesu oraz kolektory - funkcje wywoływane tuż przed renderowaniem, które przepisują stan prowadzony
+    gdzie indziej (liczniki cache, liczba połączeń strumienia na żywo) do metryk
+    """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: Dict[str, Callable[[], None]] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, name: str, collector: Callable[[], None]):
+        self.collectors[name] = collector
+
+    def render(self) -> str:
+        for collector in list(self.collectors.values()):
+            collector()
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+registry = Registry()
+
+# --- scraper ---
+tick_seconds = registry.register(Histogram(
+    'stats_tick_seconds', 'Czas całej minuty scrapera (pobranie, parsowanie, zapis)', buckets=TICK_BUCKETS))
+tick_phase_seconds = registry.register(Histogram(
+    'stats_tick_phase_seconds', 'Czas etapu minuty scrapera', ['phase'], buckets=TICK_BUCKETS))
+tick_players = registry.register(Gauge('stats_tick_players', 'Liczba graczy online w ostatniej zapisanej minucie'))
+missed_ticks = registry.register(Counter('stats_missed_ticks_total', 'Pominięte minuty', ['reason']))
+poll_results = registry.register(Counter(
+    'stats_poll_results_total', 'Pobrania strony /stats: sparsowane, 304, te same sekcje z graczami', ['result']))
+poll_bytes = registry.register(Counter('stats_poll_bytes_total', 'Bajty treści strony /stats przesłane przez sieć'))
+enrich_queue = registry.register(Gauge('stats_enrich_queue', 'Postacie czekające w kolejce na pobranie profilu'))
+enrich_pending = registry.register(Gauge(
+    'stats_enrich_pending', 'Postacie bez danych z profilu (lvl=None) przy ostatnim planowaniu'))
+refresh_planned = registry.register(Gauge(
+    'stats_refresh_planned', 'Postacie wybrane do pobrania profilu przy ostatnim planowaniu', ['priority']))
+write_queue = registry.register(Gauge('stats_write_queue', 'Zadania czekające w kolejce zapisu do bazy'))
+enrich_in_flight = registry.register(Gauge('stats_enrich_in_flight', 'Pobierane w tej chwili profile'))
+enriched = registry.register(Counter(
+    'stats_enriched_total', 'Pobrane profile postaci według wyniku i priorytetu', ['result', 'priority']))
+db_task_seconds = registry.register(Histogram(
+    'stats_db_task_seconds', 'Czas zadania w wątku zapisu scrapera', ['task'], buckets=TICK_BUCKETS))
+db_task_queries = registry.register(Histogram(
+    'stats_db_task_queries', 'Liczba zapytań zadania w wątku zapisu scrapera', ['task'], buckets=COUNT_BUCKETS))
+
+# --- widoki ---
+request_seconds = registry.register(Histogram(
+    'stats_request_seconds', 'Czas obsługi żądania', ['view', 'method', 'status']))
+request_queries = registry.register(Histogram(
+    'stats_request_queries', 'Liczba zapytań do bazy na żądanie', ['view'], buckets=COUNT_BUCKETS))
+request_db_seconds = registry.register(Histogram(
+    'stats_request_db_seconds', 'Łączny czas zapytań do bazy na żądanie', ['view']))
+cache_hits = registry.register(Counter('stats_cache_hits_total', 'Trafienia cache widoków', ['kind']))
+cache_misses = registry.register(Counter('stats_cache_misses_total', 'Chybienia cache widoków', ['kind']))
+live_subscribers = registry.register(Gauge('stats_live_subscribers', 'Otwarte połączenia strumienia na żywo'))
+live_dropped = registry.register(Counter(
+    'stats_live_dropped_total', 'Zmiany wyrzucone z kolejek klientów strumienia, którzy nie nadążają'))
+
+
+def collect_cache_counters():
+    from .caching import counters
+
+    for kind, values in counters.snapshot().items():
+        cache_hits.set_total(values['hits'], kind=kind)
+        cache_misses.set_total(values['misses'], kind=kind)
+
+
+registry.add_collector('cache', collect_cache_counters)
+
+
+class QueryMeter:
+    """
+    Liczy zapytania i ich łączny czas na wszystkich połączeniach bieżącego wątku (connection.execute_wrapper)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._stack = ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+    def __enter__(self) -> 'QueryMeter':
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+class MetricsMiddleware:
+    """
+    Mierzy czas żądania, liczbę i czas zapytań do bazy, z podziałem na widok (nazwa z URL), metodę i status
+    Treść odpowiedzi strumieniowych (eksport) jest generowana po wyjściu z middleware, więc nie jest liczona
+    """
+
+    def __init__(self, get_response):
+        if not enabled:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with QueryMeter() as meter:
+            response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        request_seconds.observe(time.perf_counter() - start, view=view, method=request.method,
+                                status=response.status_code)
+        request_queries.observe(meter.count, view=view)
+        request_db_seconds.observe(meter.duration, view=view)
+        return response
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = '127.0.0.1') -> Optional[ThreadingHTTPServer]:
+    """
+    Wystawia metryki procesu (np. scrapera) pod http://host:port/metrics w wątku w tle
+    """
+    if not enabled:
+        return None
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
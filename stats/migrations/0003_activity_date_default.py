@@ -0,0 +1,19 @@
+# Generated by Django 4.1.4 on 2026-10-17 07:37
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0002_following"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="activity",
+            name="date",
+            field=models.DateField(default=datetime.date.today),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.4 on 2026-10-17 07:46
+
+from django.db import migrations, models
+
+
+def backfill_total_minutes(apps, schema_editor):
+    Activity = apps.get_model("stats", "Activity")
+    batch = []
+    for activity in Activity.objects.only("id", "activity").iterator(chunk_size=2000):
+        activity.total_minutes = bin(int.from_bytes(bytes(activity.activity), "big")).count("1")
+        batch.append(activity)
+        if len(batch) >= 2000:
+            Activity.objects.bulk_update(batch, ["total_minutes"])
+            batch = []
+    Activity.objects.bulk_update(batch, ["total_minutes"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0003_activity_date_default"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="activity",
+            name="total_minutes",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_total_minutes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="activity",
+            index=models.Index(
+                fields=["date", "-total_minutes"], name="activity_date_minutes_idx"
+            ),
+        ),
+    ]
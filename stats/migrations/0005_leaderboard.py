@@ -0,0 +1,67 @@
+# Generated by Django 4.1.4 on 2026-10-17 07:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0004_activity_total_minutes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("d", "Day"), ("w", "Week"), ("m", "Month")],
+                        max_length=1,
+                    ),
+                ),
+                ("period_start", models.DateField()),
+                ("world", models.CharField(max_length=10)),
+                ("minutes", models.PositiveIntegerField(default=0)),
+                ("finalized", models.BooleanField(default=False)),
+                (
+                    "character",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="stats.character",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="leaderboardentry",
+            index=models.Index(
+                fields=["period", "period_start", "-minutes", "character"],
+                name="leaderboard_minutes_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="leaderboardentry",
+            index=models.Index(
+                fields=["period", "period_start", "world", "-minutes", "character"],
+                name="leaderboard_world_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="leaderboardentry",
+            constraint=models.UniqueConstraint(
+                fields=("period", "period_start", "character"),
+                name="leaderboard_unique_entry",
+            ),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.1.4 on 2026-10-17 07:52
+
+from django.db import migrations, models
+
+
+def backfill_last_seen(apps, schema_editor):
+    Account = apps.get_model("stats", "Account")
+    Activity = apps.get_model("stats", "Activity")
+    last_seen = {}
+    rows = Activity.objects.values_list("character__account_id", "date", "activity")
+    for aid, day, activity in rows.iterator(chunk_size=2000):
+        bits = int.from_bytes(bytes(activity), "big")
+        if not bits:
+            continue
+        # minuta m to bit 1439 - m, więc ostatnia minuta dnia to najniższy ustawiony bit
+        minute = 1440 - (bits & -bits).bit_length()
+        if aid not in last_seen or (day, minute) > last_seen[aid]:
+            last_seen[aid] = (day, minute)
+    accounts = [
+        Account(aid=aid, last_seen_date=day, last_seen_minute=minute)
+        for aid, (day, minute) in last_seen.items()
+    ]
+    Account.objects.bulk_update(
+        accounts, ["last_seen_date", "last_seen_minute"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0005_leaderboard"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tick",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("minute", models.SmallIntegerField()),
+                ("players", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="account",
+            name="last_seen_date",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="account",
+            name="last_seen_minute",
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_last_seen, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="tick",
+            constraint=models.UniqueConstraint(
+                fields=("date", "minute"), name="tick_unique_minute"
+            ),
+        ),
+    ]
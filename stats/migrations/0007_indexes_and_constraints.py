@@ -0,0 +1,98 @@
+# Generated by Django 4.1.4 on 2026-10-17 08:24
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_bitmaps(bitmaps):
+    merged = 0
+    for activity in bitmaps:
+        merged |= int.from_bytes(bytes(activity), "big")
+    return merged.to_bytes(180, "big"), bin(merged).count("1")
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Przed dodaniem ograniczeń unikalności scala duplikaty powstałe przy równoległych get_or_create:
+    postacie (aktywności przenoszone na najstarszą postać, wpisy rankingów usuwane - odbuduje je
+    finalize-leaderboards), bitmapy aktywności z tego samego dnia (OR) i powtórzone obserwowania
+    """
+    Character = apps.get_model("stats", "Character")
+    Activity = apps.get_model("stats", "Activity")
+    LeaderboardEntry = apps.get_model("stats", "LeaderboardEntry")
+    Following = apps.get_model("stats", "Following")
+
+    duplicated = (
+        Character.objects.values("account_id", "cid", "world")
+        .annotate(n=Count("id"), keep=Min("id"))
+        .filter(n__gt=1)
+    )
+    for group in duplicated:
+        others = Character.objects.filter(
+            account_id=group["account_id"], cid=group["cid"], world=group["world"]
+        ).exclude(pk=group["keep"])
+        Activity.objects.filter(character__in=others).update(character_id=group["keep"])
+        LeaderboardEntry.objects.filter(character__in=others).delete()
+        others.delete()
+
+    duplicated = (
+        Activity.objects.values("character_id", "date")
+        .annotate(n=Count("id"), keep=Min("id"))
+        .filter(n__gt=1)
+    )
+    for group in duplicated:
+        rows = Activity.objects.filter(
+            character_id=group["character_id"], date=group["date"]
+        )
+        activity, total_minutes = merge_bitmaps(rows.values_list("activity", flat=True))
+        rows.filter(pk=group["keep"]).update(
+            activity=activity, total_minutes=total_minutes
+        )
+        rows.exclude(pk=group["keep"]).delete()
+
+    duplicated = (
+        Following.objects.values("user_id", "account_id")
+        .annotate(n=Count("id"), keep=Min("id"))
+        .filter(n__gt=1)
+    )
+    for group in duplicated:
+        Following.objects.filter(
+            user_id=group["user_id"], account_id=group["account_id"]
+        ).exclude(pk=group["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0006_account_last_seen"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="character",
+            index=models.Index(
+                condition=models.Q(("lvl", None)),
+                fields=["id"],
+                name="character_pending_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="activity",
+            constraint=models.UniqueConstraint(
+                fields=("character", "date"), name="activity_unique_day"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="character",
+            constraint=models.UniqueConstraint(
+                fields=("account", "cid", "world"), name="character_unique_profile"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="following",
+            constraint=models.UniqueConstraint(
+                fields=("user", "account"), name="following_unique_account"
+            ),
+        ),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 4.1.4 on 2026-10-17 08:38
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+import stats.models
+
+
+def minute_bits(first, last):
+    """
+    Bity minut [first, last) dnia w masce 1440 bitów zapisanej jako liczba (big-endian, minuta 0 to najstarszy bit)
+    """
+    return ((1 << (last - first)) - 1) << (1440 - last)
+
+
+def build_coverage(apps, schema_editor):
+    """
+    Odtwarza pokrycie dni z dziennika Tick: zapisane minuty to `known`, a przerwy między kolejnymi zapisanymi
+    minutami to `unknown` (dni przed pierwszą zapisaną minutą i dni w całości objęte przerwą pozostają nieśledzone)
+    """
+    Tick = apps.get_model("stats", "Tick")
+    Coverage = apps.get_model("stats", "Coverage")
+
+    known, unknown = defaultdict(int), defaultdict(int)
+    previous = None
+    for day, minute in (
+        Tick.objects.order_by("date", "minute").values_list("date", "minute").iterator()
+    ):
+        now = datetime.combine(day, datetime.min.time()) + timedelta(minutes=minute)
+        known[day] |= minute_bits(minute, minute + 1)
+        gap = previous + timedelta(minutes=1) if previous is not None else now
+        while gap < now:
+            stop = min(
+                now,
+                datetime.combine(gap.date() + timedelta(days=1), datetime.min.time()),
+            )
+            last = 1440 if stop.date() != gap.date() else stop.hour * 60 + stop.minute
+            if gap.date() in (previous.date(), day):
+                unknown[gap.date()] |= minute_bits(gap.hour * 60 + gap.minute, last)
+            gap = stop
+        previous = now
+
+    Coverage.objects.bulk_create(
+        [
+            Coverage(
+                date=day,
+                known=known[day].to_bytes(180, "big"),
+                unknown=unknown[day].to_bytes(180, "big"),
+                known_minutes=bin(known[day]).count("1"),
+                unknown_minutes=bin(unknown[day]).count("1"),
+            )
+            for day in sorted(set(known) | set(unknown))
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0007_indexes_and_constraints"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Coverage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                (
+                    "known",
+                    models.BinaryField(
+                        default=stats.models.activity_default, max_length=180
+                    ),
+                ),
+                (
+                    "unknown",
+                    models.BinaryField(
+                        default=stats.models.activity_default, max_length=180
+                    ),
+                ),
+                ("known_minutes", models.PositiveSmallIntegerField(default=0)),
+                ("unknown_minutes", models.PositiveSmallIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="coverage",
+            constraint=models.UniqueConstraint(
+                fields=("date",), name="coverage_unique_day"
+            ),
+        ),
+        migrations.RunPython(build_coverage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.1.4 on 2026-10-17 08:48
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+
+
+def mark_enriched_stale(apps, schema_editor):
+    """
+    Postacie uzupełnione przed śledzeniem czasu odświeżenia traktuje jak odświeżone tydzień temu (STALE_MAX_AGE
+    w stats.refresh) - trafią do kolejki ponownego odświeżania, a nowe postacie (lvl=None) pozostają bez czasu
+    """
+    Character = apps.get_model("stats", "Character")
+    Character.objects.exclude(lvl=None).update(
+        refreshed_at=datetime.now() - timedelta(days=7)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0009_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="character",
+            name="refreshed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="account",
+            index=models.Index(
+                fields=["last_seen_date", "last_seen_minute"],
+                name="account_last_seen_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="character",
+            index=models.Index(fields=["refreshed_at"], name="character_refreshed_idx"),
+        ),
+        migrations.RunPython(mark_enriched_stale, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
-from typing import List, Tuple
+from datetime import date, datetime
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 import numpy as np
 from django.contrib.auth.models import User
@@ -9,12 +11,62 @@ class Account(models.Model):
     """
     Reprezentuje konto gracza
     aid - account id - id konta
+    last_seen_date, last_seen_minute - dzień i minuta dnia, w której gracz był ostatnio zalogowany (aktualizowane
+    przy zapisie każdej minuty, żeby nie trzeba było przeglądać aktywności)
     """
     aid = models.IntegerField(primary_key=True)
+    last_seen_date = models.DateField(blank=True, null=True)
+    last_seen_minute = models.SmallIntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # gracze online w ostatniej minucie - harmonogram odświeżania profili (stats.refresh)
+            models.Index(fields=['last_seen_date', 'last_seen_minute'], name='account_last_seen_idx'),
+        ]
 
     def __str__(self):
         return f"[{self.aid}]"
 
+    def is_online(self, tick: Optional['Tick']) -> bool:
+        """
+        :return: czy gracz był zalogowany w podanej (zwykle ostatniej zapisanej) minucie
+        """
+        return (
+            tick is not None and tick.is_recent
+            and (self.last_seen_date, self.last_seen_minute) == (tick.date, tick.minute)
+        )
+
+
+class Tick(models.Model):
+    """
+    Reprezentuje jedną zapisaną minutę pobierania strony https://www.margonem.pl/stats
+    date, minute - dzień i minuta dnia (0-1439)
+    players - liczba zalogowanych graczy
+    """
+    date = models.DateField()
+    minute = models.SmallIntegerField()
+    players = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'minute'], name='tick_unique_minute'),
+        ]
+
+    def __str__(self):
+        return f"[{self.date} {self.minute // 60:02d}:{self.minute % 60:02d}] {self.players}"
+
+    @property
+    def is_recent(self) -> bool:
+        """
+        :return: czy minuta jest na tyle świeża, że pokazuje stan "teraz" (scraper działa)
+        """
+        now = datetime.now()
+        return self.date == now.date() and now.hour * 60 + now.minute - self.minute <= 2
+
+    @classmethod
+    def latest(cls) -> Optional['Tick']:
+        return cls.objects.order_by('-date', '-minute').first()
+
 
 class Character(models.Model):
     """
@@ -27,6 +79,8 @@ class Character(models.Model):
     lvl - poziom doświadczenia (dodatni, mniejszy niż 500)
     prof - profesja (klasa postaci); wojownik (w), mag (m), łowca (h), tropiciel (t), paladyn (p), tancerz ostrzy (b)
     avatar_url - link (końcówka linku) do avatara postaci
+    refreshed_at - czas ostatniej próby pobrania profilu (None - jeszcze nie pobierany); według niego scraper
+    ponownie odświeża nick, poziom, profesję i avatar (stats.refresh)
     """
 
     class Profession(models.TextChoices):
@@ -44,6 +98,18 @@ class Character(models.Model):
     lvl = models.SmallIntegerField(blank=True, null=True)
     prof = models.CharField(max_length=1, choices=Profession.choices, default=Profession.WARRIOR)
     avatar_url = models.CharField(max_length=200, blank=True)
+    refreshed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'cid', 'world'], name='character_unique_profile'),
+        ]
+        indexes = [
+            # częściowy indeks postaci bez danych z profilu - kursor scrapera nie przegląda całej tabeli
+            models.Index(fields=['id'], condition=models.Q(lvl=None), name='character_pending_idx'),
+            # najdawniej odświeżane profile - kolejka ponownego odświeżania
+            models.Index(fields=['refreshed_at'], name='character_refreshed_idx'),
+        ]
 
     def __str__(self):
         return f"{self.account}[{self.cid}] {self.nick_or_null} {self.lvl_prof_or_null} {self.world}"
@@ -61,6 +127,32 @@ def activity_default():
     return bytearray(180)
 
 
+def format_minutes(total_minutes: int) -> str:
+    """
+    :return: reprezentację czasu w postaci napisu X godz. Y min.
+    """
+    hours = int(total_minutes // 60)
+    minutes = int(total_minutes % 60)
+    str_ = f"{minutes} min."
+    if hours > 0:
+        str_ = f"{hours} godz. " + str_
+    return str_
+
+
+def bits_str(activity: bytes) -> str:
+    """
+    :return: bitmapę dnia jako napis 1440 znaków '0'/'1'
+    """
+    return format(int.from_bytes(activity, 'big'), f'0{len(activity) * 8}b')
+
+
+def count_minutes(activity: bytes) -> int:
+    """
+    :return: liczbę ustawionych bitów (minut aktywności) w bitmapie dnia
+    """
+    return bin(int.from_bytes(activity, 'big')).count('1')
+
+
 class Activity(models.Model):
     """
     Reprezentuje aktywność gracza na danej postaci w ciągu jednego dnia
@@ -71,82 +163,169 @@ class Activity(models.Model):
     1 oznacza że gracz był zalogowny i grał na danej postaci, natomiast 0 że nie był
     """
     character = models.ForeignKey(Character, on_delete=models.CASCADE)
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(default=date.today)
     activity = models.BinaryField(max_length=180, default=activity_default)  # 60 * 24 / 8
+    # czas aktywności w minutach (liczba jedynek w `activity`) - przechowywany, żeby ranking mógł sortować w bazie
+    total_minutes = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # jedna bitmapa na postać i dzień; indeks (character, date) obsługuje też zapytania o dni postaci
+            models.UniqueConstraint(fields=['character', 'date'], name='activity_unique_day'),
+        ]
+        indexes = [
+            models.Index(fields=['date', '-total_minutes'], name='activity_date_minutes_idx'),
+        ]
 
     def __str__(self):
         return f"[{self.date}]{self.character}"
 
+    def save(self, *args, **kwargs):
+        self.total_minutes = count_minutes(self.activity)
+        super().save(*args, **kwargs)
+
     @property
-    def total_minutes(self) -> int:
+    def activity_time(self) -> str:
         """
-        :return: czas aktywności w minutach
+        :return: reprezentację aktywności w postaci napisu X godz. Y min.
         """
-        return self.__bits_unpacked.sum()
+        return format_minutes(self.total_minutes)
 
     @property
-    def activity_time(self) -> str:
+    def activity_plot(self) -> str:
         """
-        :return: reprezentację aktywności w postaci napisu X godz. Y min.
+        :return: fragment HTML wykresu aktywności; zapamiętany w procesie pod kluczem (id, bitmapa),
+        więc dla dni, które już się skończyły, jest generowany tylko raz
         """
-        total_minutes = self.total_minutes
-        hours = int(total_minutes // 60)
-        minutes = int(total_minutes % 60)
-        str_ = f"{minutes} min."
-        if hours > 0:
-            str_ = f"{hours} godz. " + str_
-        return str_
+        return cached_activity_plot(self.pk, bytes(self.activity))
 
     @property
-    def activity_plot(self):
-        plot_width = 720
-        bits = self.__bits_unpacked
-        start_end_list = self.__get_start_end_list(bits)
-
-        # tworzenie div-ów oznaczających godziny (ticki na wykresie)
-        div_list = []
-        for i in range(60, 1440, 60):
-            left = round(i * plot_width / 1440, 4) + 10
-            div_line = f"""<div class="activity-plot-hour-line" style="left: {left}px;"></div>"""
-            div_list.append(div_line)
-
-            hour = f"{i // 60:02d}"
-            div_hour = f"""<div class="activity-plot-hour" style="left: {left - 6}px;">{hour}</div>"""
-            div_list.append(div_hour)
-
-        # tworzenie div-ów oznaczających aktywność gracza
-        for (start, end) in start_end_list:
-            left = round(start * plot_width / 1440, 4) + 10
-            width = round((end - start) * plot_width / 1440, 4)
-            div = f"""<div class="activity-plot-line" style="left: {left}px; width: {width}px;"></div>"""
-            div_list.append(div)
-
-        return "\n".join(div_list)
+    def start_end_list(self) -> List[Tuple[int, int]]:
+        return get_start_end_list(self.__bits_unpacked)
 
     @property
     def bits_str(self) -> str:
-        return "".join(self.__bits_unpacked.astype(str))
+        return bits_str(self.activity)
 
     @property
     def __bits_unpacked(self) -> np.ndarray:
         return np.unpackbits(np.asarray(bytearray(self.activity)))
 
-    @staticmethod
-    def __get_start_end_list(bits: np.ndarray) -> List[Tuple[int, int]]:
+
+class Coverage(models.Model):
+    """
+    Reprezentuje pokrycie jednego dnia przez scraper - dwie maski 1440 bitów równoległe do bitmap aktywności:
+    known - minuty zapisane (jest dla nich wiersz Tick)
+    unknown - minuty jawnie oznaczone jako brakujące: luki między kolejnymi zapisanymi minutami (przekroczony
+    limit czasu, zbyt długi tick, restart scrapera); 0 w bitmapie aktywności w takiej minucie nie znaczy "offline"
+    Minuty spoza obu masek nie były śledzone (przed pierwszym uruchomieniem scrapera albo jeszcze nie nadeszły)
+    known_minutes, unknown_minutes - liczby ustawionych bitów, żeby sumy dla tygodnia i miesiąca liczyła baza
+    """
+    date = models.DateField()
+    known = models.BinaryField(max_length=180, default=activity_default)
+    unknown = models.BinaryField(max_length=180, default=activity_default)
+    known_minutes = models.PositiveSmallIntegerField(default=0)
+    unknown_minutes = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date'], name='coverage_unique_day'),
+        ]
+
+    def __str__(self):
+        return f"[{self.date}] {self.known_minutes}/{self.unknown_minutes}"
+
+    @property
+    def ratio(self) -> Optional[float]:
         """
-        Listę bitów transformuje na listę par indeksów określających położenie podciągów jedynek w ciągu bitów
+        :return: udział zapisanych minut wśród śledzonych (zapisanych i brakujących) albo None, gdy nie ma żadnych
         """
-        start_end_list = []
-        start = None
-        for i in range(0, len(bits)):
-            if bits[i] == 1 and start is None:
-                start = i
-            if bits[i] == 0 and start is not None:
-                start_end_list.append((start, i))
-                start = None
-        if start is not None:
-            start_end_list.append((start, len(bits)))
-        return start_end_list
+        tracked = self.known_minutes + self.unknown_minutes
+        return self.known_minutes / tracked if tracked else None
+
+    @property
+    def percent(self) -> Optional[float]:
+        ratio = self.ratio
+        return round(100 * ratio, 1) if ratio is not None else None
+
+    def as_dict(self) -> dict:
+        return {'known_minutes': self.known_minutes, 'unknown_minutes': self.unknown_minutes}
+
+    @property
+    def unknown_time(self) -> str:
+        return format_minutes(self.unknown_minutes)
+
+    @property
+    def unknown_intervals(self) -> List[Tuple[int, int]]:
+        return get_start_end_list(np.unpackbits(np.frombuffer(bytes(self.unknown), dtype=np.uint8)))
+
+    @property
+    def unknown_plot(self) -> str:
+        """
+        :return: fragment HTML z przedziałami brakujących minut, nakładany na wykresy aktywności dnia
+        """
+        return render_segments(self.unknown, 'activity-plot-unknown')
+
+
+ACTIVITY_PLOT_WIDTH = 720
+ACTIVITY_PLOT_CACHE_SIZE = 4096
+
+
+def _hour_ticks_html(plot_width: int) -> str:
+    """
+    Tworzy div-y oznaczające godziny (ticki na wykresie) - są takie same dla każdego wykresu
+    """
+    div_list = []
+    for i in range(60, 1440, 60):
+        left = round(i * plot_width / 1440, 4) + 10
+        div_list.append(f"""<div class="activity-plot-hour-line" style="left: {left}px;"></div>""")
+
+        hour = f"{i // 60:02d}"
+        div_list.append(f"""<div class="activity-plot-hour" style="left: {left - 6}px;">{hour}</div>""")
+    return "\n".join(div_list)
+
+
+HOUR_TICKS_HTML = _hour_ticks_html(ACTIVITY_PLOT_WIDTH)
+
+
+def get_start_end_list(bits: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Listę bitów transformuje na listę par indeksów określających położenie podciągów jedynek w ciągu bitów
+    Początki i końce podciągów to miejsca, w których różnica sąsiednich bitów (z zerami na brzegach) jest niezerowa
+    """
+    padded = np.concatenate(([0], bits, [0])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+@lru_cache(maxsize=ACTIVITY_PLOT_CACHE_SIZE)
+def cached_activity_plot(pk: int, activity: bytes) -> str:
+    """
+    Klucz zawiera całą bitmapę (180 bajtów), więc zmiana aktywności w trakcie dnia oznacza nowy wpis w cache
+    """
+    return render_activity_plot(activity)
+
+
+def render_activity_plot(activity: bytes, plot_width: int = ACTIVITY_PLOT_WIDTH) -> str:
+    """
+    Tworzy fragment HTML wykresu aktywności: ticki godzin oraz div-y oznaczające aktywność gracza
+    """
+    ticks = HOUR_TICKS_HTML if plot_width == ACTIVITY_PLOT_WIDTH else _hour_ticks_html(plot_width)
+    segments = render_segments(activity, 'activity-plot-line', plot_width)
+    return "\n".join([ticks, segments]) if segments else ticks
+
+
+def render_segments(mask: bytes, css_class: str, plot_width: int = ACTIVITY_PLOT_WIDTH) -> str:
+    """
+    Tworzy div-y o podanej klasie dla każdego przedziału ustawionych bitów maski dnia
+    """
+    bits = np.unpackbits(np.frombuffer(bytes(mask), dtype=np.uint8))
+    div_list = []
+    for (start, end) in get_start_end_list(bits):
+        left = round(start * plot_width / 1440, 4) + 10
+        width = round((end - start) * plot_width / 1440, 4)
+        div_list.append(f"""<div class="{css_class}" style="left: {left}px; width: {width}px;"></div>""")
+    return "\n".join(div_list)
 
 
 class Following(models.Model):
@@ -158,5 +337,71 @@ class Following(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'account'], name='following_unique_account'),
+        ]
+
     def __str__(self):
         return f"{self.user} - {self.account}"
+
+
+class LeaderboardEntry(models.Model):
+    """
+    Reprezentuje pozycję postaci w zmaterializowanym rankingu aktywności za dzień, tydzień lub miesiąc
+    period - okres rankingu: dzień (d), tydzień (w), miesiąc (m)
+    period_start - pierwszy dzień okresu (dla tygodnia poniedziałek, dla miesiąca pierwszy dzień miesiąca)
+    world - świat postaci (skopiowany z Character, żeby ranking świata korzystał tylko z indeksu)
+    minutes - łączny czas aktywności w okresie
+    finalized - okres się zakończył i ranking został przeliczony z tabeli *stats_activity*
+    Ranking jest aktualizowany przyrostowo przy zapisie każdej minuty (stats.leaderboards)
+    """
+
+    class Period(models.TextChoices):
+        DAY = 'd'
+        WEEK = 'w'
+        MONTH = 'm'
+
+    period = models.CharField(max_length=1, choices=Period.choices)
+    period_start = models.DateField()
+    character = models.ForeignKey(Character, on_delete=models.CASCADE)
+    world = models.CharField(max_length=10)
+    minutes = models.PositiveIntegerField(default=0)
+    finalized = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'character'], name='leaderboard_unique_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'period_start', '-minutes', 'character'], name='leaderboard_minutes_idx'),
+            models.Index(fields=['period', 'period_start', 'world', '-minutes', 'character'],
+                         name='leaderboard_world_idx'),
+        ]
+
+    def __str__(self):
+        return f"[{self.period}{self.period_start}]{self.character} {self.minutes}"
+
+    @property
+    def activity_time(self) -> str:
+        return format_minutes(self.minutes)
+
+
+class Lease(models.Model):
+    """
+    Reprezentuje dzierżawę pracy przez jeden proces scrapera (stats.sharding)
+    name - nazwa pracy, np. "enrich:1/4" - uzupełnianie profili kont o aid % 4 == 1
+    owner - identyfikator procesu (host:pid)
+    expires_at - koniec dzierżawy; właściciel ją odnawia, a po jej wygaśnięciu pracę może przejąć inny proces
+    """
+    name = models.CharField(max_length=40)
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name'], name='lease_unique_name'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} - {self.owner} do {self.expires_at:%H:%M:%S}"
@@ -0,0 +1,192 @@
+import hashlib
+import html as html_entities
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+BASE_URL = "https://www.margonem.pl"
+STATS_PATH = "/stats"
+PROFILE_PATH = "/profile/view,{aid}#char_{cid},{world}"
+
+PROFILE_LINK_RE = re.compile(r'/profile/view,(\d+)#char_(\d+),(\w+)')
+
+
+# sekcje `div.news-body` strony /stats, w których są listy zalogowanych graczy
+STATS_SECTIONS = (1, 8)
+
+DIV_TAG_RE = re.compile(r'<(/?)div\b([^>]*)>', re.IGNORECASE)
+NEWS_BODY_CLASS_RE = re.compile(r'\bclass\s*=\s*(["\']?)[^"\'>]*(?<![\w-])news-body(?![\w-])')
+
+# tagi i atrybuty dla szybkiej ścieżki strony profilu (wartości atrybutów w cudzysłowach mogą zawierać `>`)
+TAG_RE = re.compile(r'<(/?)([a-zA-Z][\w-]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>')
+ATTR_RE = re.compile(r'([^\s=/>"\']+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+VOID_TAGS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'wbr'))
+# pola profilu: klucz -> (tag, klasa, atrybut)
+PROFILE_FIELDS = {
+    'avatar_url': ('span', 'cimg', 'style'),
+    'nick': ('input', 'chnick', 'value'),
+    'lvl': ('input', 'chlvl', 'value'),
+    'prof': ('input', 'chprof', 'value'),
+}
+
+
+def stats_section_extents(html: str) -> Dict[int, Tuple[int, int]]:
+    """
+    Jedno przejście po tagach <div> bez budowania drzewa dokumentu: zlicza otwarcia `div.news-body` w kolejności
+    dokumentu (jak `find_all`), śledzi zagnieżdżenie divów i kończy skanowanie, gdy zamknie się ostatnia potrzebna
+    sekcja
+    :return: zakresy (początek, koniec) sekcji STATS_SECTIONS w tekście strony
+    """
+    last_section = max(STATS_SECTIONS)
+    section = -1
+    stack = []
+    extents = {}
+    for m in DIV_TAG_RE.finditer(html):
+        if m.group(1):
+            if stack:
+                opened = stack.pop()
+                if opened in STATS_SECTIONS:
+                    extents[opened] = (extents[opened][0], m.end())
+                    if opened == last_section:
+                        break
+        elif not m.group(2).rstrip().endswith('/'):
+            if NEWS_BODY_CLASS_RE.search(m.group(2)):
+                section += 1
+                stack.append(section)
+                if section in STATS_SECTIONS:
+                    extents[section] = (m.start(), len(html))
+            else:
+                stack.append(None)
+    return extents
+
+
+def sections_digest(html: str, extents: Dict[int, Tuple[int, int]]) -> bytes:
+    """
+    :return: skrót treści sekcji z listami graczy - ta sama wartość oznacza tę samą listę zalogowanych graczy,
+             nawet jeśli reszta strony (np. reklamy, godzina) się zmieniła
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for section in STATS_SECTIONS:
+        if section in extents:
+            start, end = extents[section]
+            digest.update(html[start:end].encode())
+        digest.update(b'\0')
+    return digest.digest()
+
+
+def extract_stats_profiles(html: str, extents: Optional[Dict[int, Tuple[int, int]]] = None
+                           ) -> Iterator[Tuple[str, str, str]]:
+    """
+    Szybka ścieżka parsowania strony /stats - linki profili tylko z zakresów sekcji (stats_section_extents)
+    Zwraca krotki (aid, cid, world) z sekcji STATS_SECTIONS w tej samej kolejności co `parse_stats_page_bs4`
+    """
+    if extents is None:
+        extents = stats_section_extents(html)
+    for section in STATS_SECTIONS:
+        if section in extents:
+            start, end = extents[section]
+            for match in PROFILE_LINK_RE.finditer(html, start, end):
+                yield match.groups()
+
+
+def parse_stats_page_bs4(html: str) -> List[Tuple[str, str, str]]:
+    """
+    Wyciąga ze strony https://www.margonem.pl/stats listę zalogowanych graczy w postaci krotek (aid, cid, world)
+    Wolna, ale odporna ścieżka budująca całe drzewo dokumentu przez BeautifulSoup
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    text = "".join([str(s) for s in soup.find_all("div", attrs={"class": "news-body"})[1:9:7]])
+    return PROFILE_LINK_RE.findall(text)
+
+
+def parse_stats_page(html: str, extents: Optional[Dict[int, Tuple[int, int]]] = None
+                     ) -> List[Tuple[str, str, str]]:
+    """
+    Wyciąga ze strony https://www.margonem.pl/stats listę zalogowanych graczy w postaci krotek (aid, cid, world)
+    Gdy szybka ścieżka nic nie znajdzie (np. zmienił się układ strony), korzysta z BeautifulSoup
+    `extents` - zakresy sekcji, jeśli zostały już wyznaczone (stats.polling)
+    """
+    profiles = list(extract_stats_profiles(html, extents))
+    if not profiles:
+        profiles = parse_stats_page_bs4(html)
+    return profiles
+
+
+def tag_attrs(text: str) -> Dict[str, str]:
+    """
+    :return: atrybuty tagu (nazwy małymi literami, encje HTML zamienione na znaki; powtórzony atrybut - ostatni,
+             jak w BeautifulSoup)
+    """
+    return {
+        m.group(1).lower(): html_entities.unescape(next((v for v in m.group(2, 3, 4) if v is not None), ''))
+        for m in ATTR_RE.finditer(text)
+    }
+
+
+def profile_element_extent(html: str, cid: int) -> Optional[Tuple[int, int]]:
+    """
+    Jedno przejście po tagach: znajduje pierwszy element z atrybutem data-id równym `cid` (jak `find_all`) i jego
+    koniec - zamknięcie tagu o tej samej nazwie na tym samym poziomie zagnieżdżenia (albo koniec strony)
+    :return: zakres (początek, koniec) elementu postaci albo None
+    """
+    data_id = str(cid)
+    name, depth, start = None, 0, 0
+    for m in TAG_RE.finditer(html):
+        closing, tag = m.group(1), m.group(2).lower()
+        if name is None:
+            if not closing and data_id in m.group(3) and tag_attrs(m.group(3)).get('data-id') == data_id:
+                if tag in VOID_TAGS or m.group(3).rstrip().endswith('/'):
+                    return m.start(), m.end()
+                name, depth, start = tag, 1, m.start()
+        elif tag == name:
+            if closing:
+                depth -= 1
+                if depth == 0:
+                    return start, m.end()
+            elif not m.group(3).rstrip().endswith('/'):
+                depth += 1
+    return (start, len(html)) if name is not None else None
+
+
+def parse_profile(html: str, cid: int) -> Optional[dict]:
+    """
+    Wyciąga ze strony profilu dane postaci o podanym cid: avatar_url, nick, lvl, prof
+    Szybka ścieżka czyta tylko tagi elementu postaci; gdy nie znajdzie wszystkich pól, korzysta z BeautifulSoup
+    Zwraca None, jeśli postaci nie ma na stronie (np. została usunięta)
+    """
+    extent = profile_element_extent(html, cid)
+    if extent is None:
+        return None
+    data = {}
+    for m in TAG_RE.finditer(html, *extent):
+        if m.group(1):
+            continue
+        tag = m.group(2).lower()
+        attrs = None
+        for key, (field_tag, field_class, attr) in PROFILE_FIELDS.items():
+            if key in data or tag != field_tag:
+                continue
+            attrs = attrs if attrs is not None else tag_attrs(m.group(3))
+            if field_class in attrs.get('class', '').split() and attr in attrs:
+                data[key] = attrs[attr]
+    if len(data) < len(PROFILE_FIELDS):
+        return parse_profile_bs4(html, cid)
+    data['avatar_url'] = data['avatar_url'][70:-3]
+    return {key: data[key] for key in PROFILE_FIELDS}
+
+
+def parse_profile_bs4(html: str, cid: int) -> Optional[dict]:
+    """
+    Wolna, ale odporna ścieżka `parse_profile` budująca całe drzewo dokumentu przez BeautifulSoup
+    """
+    found = BeautifulSoup(html, 'html.parser').find_all(attrs={"data-id": cid})
+    if not found:
+        return None
+    soup = found[0]
+    return {
+        'avatar_url': soup.find("span", attrs={"class": "cimg"})["style"][70:-3],
+        'nick': soup.find("input", attrs={"class": "chnick"})["value"],
+        'lvl': soup.find("input", attrs={"class": "chlvl"})["value"],
+        'prof': soup.find("input", attrs={"class": "chprof"})["value"],
+    }
@@ -0,0 +1,80 @@
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import requests
+
+from .parsing import parse_stats_page, sections_digest, stats_section_extents
+
+# Pobieranie strony /stats co minutę bez powtarzania pracy, gdy strona się nie zmieniła:
+# - zapytanie warunkowe (If-None-Match / If-Modified-Since), jeśli serwer podał ETag lub Last-Modified - odpowiedź
+#   304 nie ma treści, więc nie ma czego przesyłać ani parsować
+# - skrót sekcji z listami graczy - gdy serwer nie obsługuje zapytań warunkowych albo zmieniła się tylko reszta
+#   strony, lista graczy z poprzedniej minuty jest używana bez wyciągania linków profili
+# W obu przypadkach gracze z poprzedniej minuty nadal są online i ich minuta aktywności jest zapisywana
+MODIFIED = 'modified'
+NOT_MODIFIED = 'not_modified'
+UNCHANGED = 'unchanged'
+
+
+@dataclass
+class PollResult:
+    """
+    profiles - lista zalogowanych graczy (aid, cid, world)
+    content - treść strony (przy 304 - treść z poprzedniej minuty, np. do nagrania)
+    status - MODIFIED (strona sparsowana), NOT_MODIFIED (odpowiedź 304) albo UNCHANGED (te same sekcje z graczami)
+    transferred - liczba bajtów treści przesłanych przez sieć (po kompresji, jeśli serwer podał Content-Length)
+    parse_time - czas wyznaczania sekcji, skrótu i parsowania w sekundach
+    """
+    profiles: List[tuple]
+    content: bytes
+    status: str
+    transferred: int
+    parse_time: float
+
+
+class StatsPoller:
+    """
+    Pobiera stronę /stats przez wspólną sesję HTTP (keep-alive, gzip) i pamięta walidatory, skrót sekcji
+    oraz listę graczy z ostatniej udanej odpowiedzi
+    """
+
+    def __init__(self, session: requests.Session, url: str):
+        self.session = session
+        self.url = url
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.digest: Optional[bytes] = None
+        self.profiles: Optional[List[tuple]] = None
+        self.content = b''
+
+    def conditional_headers(self) -> dict:
+        if self.profiles is None:
+            return {}
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def fetch(self, timeout: float) -> PollResult:
+        r = self.session.get(self.url, headers=self.conditional_headers(), timeout=timeout)
+        if r.status_code == 304 and self.profiles is not None:
+            return PollResult(self.profiles, self.content, NOT_MODIFIED, 0, 0.0)
+        r.raise_for_status()
+        transferred = int(r.headers.get('Content-Length', len(r.content)))
+
+        start = time.perf_counter()
+        html = r.text
+        extents = stats_section_extents(html)
+        digest = sections_digest(html, extents) if extents else None
+        if digest is not None and digest == self.digest:
+            profiles, status = self.profiles, UNCHANGED
+        else:
+            profiles, status = parse_stats_page(html, extents), MODIFIED
+        parse_time = time.perf_counter() - start
+
+        self.etag, self.last_modified = r.headers.get('ETag'), r.headers.get('Last-Modified')
+        self.digest, self.profiles, self.content = digest, profiles, r.content
+        return PollResult(profiles, r.content, status, transferred, parse_time)
@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.db.models import Q, QuerySet
+
+from .ingest import chunks
+from .leaderboards import period_start
+from .models import Character, LeaderboardEntry, Tick
+from .sharding import Shard
+
+# Harmonogram pobierania profili postaci: nowe postacie (lvl=None) oraz ponowne odświeżanie nicku, poziomu,
+# profesji i avatara postaci, które mają już dane. Co PLAN_INTERVAL kandydaci są wybierani zapytaniami po indeksach
+# (po jednym na priorytet, najwyżej `limit` wierszy) do kolejki priorytetowej w pamięci, z której scraper pobiera
+# profile w tempie budżetu zapytań na minutę. Czas ostatniej próby (Character.refreshed_at) ustawia też nieudane
+# pobranie, więc postać bez profilu nie wraca na początek kolejki co minutę
+PENDING, ONLINE, RANKED, STALE = range(4)
+PRIORITY_NAMES = ('pending', 'online', 'ranked', 'stale')
+# po jakim czasie profil postaci danego priorytetu jest odświeżany ponownie
+PENDING_RETRY = timedelta(minutes=10)
+ONLINE_MAX_AGE = timedelta(hours=6)
+RANKED_MAX_AGE = timedelta(days=1)
+STALE_MAX_AGE = timedelta(days=7)
+# ile pierwszych pozycji tygodniowego rankingu aktywności ma pierwszeństwo
+RANKED_TOP = 500
+PLAN_INTERVAL = 60.0
+# domyślny limit zapytań o profile na minutę (0 - bez limitu)
+DEFAULT_BUDGET = 300
+
+# (id postaci, aid, cid, świat)
+Candidate = Tuple[int, int, int, str]
+FIELDS = ('id', 'account_id', 'cid', 'world')
+
+
+def plan(now: datetime, limit: int, shard: Optional[Shard] = None) -> List[Tuple[int, Candidate]]:
+    """
+    Wybiera postacie do pobrania profilu, od najpilniejszych:
+    - PENDING - bez danych z profilu (częściowy indeks character_pending_idx), ponawiane po PENDING_RETRY
+    - ONLINE - zalogowane w ostatniej zapisanej minucie (account_last_seen_idx), profil starszy niż ONLINE_MAX_AGE
+    - RANKED - w czołówce tygodniowego rankingu (leaderboard_minutes_idx), profil starszy niż RANKED_MAX_AGE
+    - STALE - pozostałe o profilu starszym niż STALE_MAX_AGE, od najdawniej odświeżanych (character_refreshed_idx)
+    :return: najwyżej `limit` krotek (priorytet, kandydat) każdego priorytetu; z `shard` - tylko konta klucza
+    """
+    def narrow(query_set: QuerySet) -> QuerySet:
+        return shard.filter(query_set) if shard is not None else query_set
+
+    def rows(priority: int, query_set: QuerySet) -> List[Tuple[int, Candidate]]:
+        return [(priority, row) for row in narrow(query_set).values_list(*FIELDS)[:limit]]
+
+    pending = Character.objects.filter(Q(refreshed_at=None) | Q(refreshed_at__lt=now - PENDING_RETRY), lvl=None)
+    result = rows(PENDING, pending.order_by('id'))
+
+    tick = Tick.latest()
+    if tick is not None:
+        online = Character.objects.filter(
+            account__last_seen_date=tick.date, account__last_seen_minute=tick.minute,
+            refreshed_at__lt=now - ONLINE_MAX_AGE
+        )
+        result += rows(ONLINE, online.order_by('refreshed_at'))
+
+    week = period_start(LeaderboardEntry.Period.WEEK, now.date())
+    top = list(
+        LeaderboardEntry.objects.filter(period=LeaderboardEntry.Period.WEEK, period_start=week)
+        .order_by('-minutes', 'character_id').values_list('character_id', flat=True)[:RANKED_TOP]
+    )
+    rank = {character_id: i for i, character_id in enumerate(top)}
+    ranked = []
+    for batch in chunks(top):
+        ranked += rows(RANKED, Character.objects.filter(id__in=batch, refreshed_at__lt=now - RANKED_MAX_AGE))
+    result += sorted(ranked, key=lambda item: rank[item[1][0]])[:limit]
+
+    stale = Character.objects.filter(refreshed_at__lt=now - STALE_MAX_AGE).order_by('refreshed_at')
+    result += rows(STALE, stale)
+    return result
+
+
+class RefreshQueue:
+    """
+    Indeksowana kolejka priorytetowa postaci do pobrania profilu: kopiec (priorytet, kolejność dodania, id postaci)
+    i słownik id postaci -> priorytet, więc postać jest w kolejce najwyżej raz, a ponowne dodanie z pilniejszym
+    priorytetem przesuwa ją do przodu (nieaktualny wpis w kopcu jest pomijany przy zdejmowaniu)
+    Zdjęte postacie są w `taken` do wywołania `done` - kolejne planowanie nie doda ich, zanim profil zostanie zapisany
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[int, int, int]] = []
+        self.priorities: Dict[int, int] = {}
+        self.candidates: Dict[int, Candidate] = {}
+        self.taken: Set[int] = set()
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.priorities)
+
+    def push(self, priority: int, candidate: Candidate) -> bool:
+        """
+        :return: czy postać została dodana albo przesunięta do przodu
+        """
+        pk = candidate[0]
+        if pk in self.taken or self.priorities.get(pk, priority + 1) <= priority:
+            return False
+        self.priorities[pk] = priority
+        self.candidates[pk] = candidate
+        heapq.heappush(self.heap, (priority, next(self.counter), pk))
+        return True
+
+    def pop(self) -> Optional[Tuple[int, Candidate]]:
+        while self.heap:
+            priority, _, pk = heapq.heappop(self.heap)
+            if self.priorities.get(pk) != priority:
+                continue
+            del self.priorities[pk]
+            self.taken.add(pk)
+            return priority, self.candidates.pop(pk)
+        return None
+
+    def done(self, pk: int):
+        self.taken.discard(pk)
+
+    def clear(self):
+        """
+        Usuwa oczekujące postacie (przed nowym planowaniem); zdjęte, ale niezapisane, pozostają w `taken`
+        """
+        self.heap, self.priorities, self.candidates = [], {}, {}
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(PRIORITY_NAMES, 0)
+        for priority in self.priorities.values():
+            counts[PRIORITY_NAMES[priority]] += 1
+        return counts
+
+
+class Budget:
+    """
+    Limit zapytań o profile na minutę - kubełek żetonów odnawiany w sposób ciągły, z zapasem na kilka sekund
+    `per_minute` = 0 wyłącza limit
+    """
+
+    def __init__(self, per_minute: int, burst_seconds: float = 5.0):
+        self.per_minute = per_minute
+        self.capacity = max(1.0, per_minute * burst_seconds / 60)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """
+        Zabiera żeton (także na kredyt)
+        :return: ile sekund trzeba odczekać przed zapytaniem
+        """
+        if not self.per_minute:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens * 60 / self.per_minute)
@@ -0,0 +1,150 @@
+import gzip
+import re
+import threading
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+STATS_DIR = 'stats'
+PROFILE_DIR = 'profile'
+STATS_FILE_FORMAT = '%Y%m%d-%H%M'
+
+
+class Recorder:
+    """
+    Zapisuje na dysk (gzip) surowe strony pobierane przez *scrap-stats*:
+    - <katalog>/stats/RRRRMMDD-GGMM.html.gz - strona /stats z danej minuty
+    - <katalog>/profile/<aid>.html.gz - strona profilu konta (fragment #char_... nie trafia do serwera)
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+        (self.directory / STATS_DIR).mkdir(parents=True, exist_ok=True)
+        (self.directory / PROFILE_DIR).mkdir(parents=True, exist_ok=True)
+
+    def save_stats(self, now: datetime, content: bytes):
+        self._save(self.directory / STATS_DIR / f"{now.strftime(STATS_FILE_FORMAT)}.html.gz", content)
+
+    def save_profile(self, aid: int, content: bytes):
+        self._save(self.directory / PROFILE_DIR / f"{aid}.html.gz", content)
+
+    @staticmethod
+    def _save(path: Path, content: bytes):
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(gzip.compress(content))
+        tmp.replace(path)
+
+
+def _read(path: Path) -> str:
+    return gzip.decompress(path.read_bytes()).decode('utf-8', errors='replace')
+
+
+def recorded_stats_files(directory: Union[str, Path]) -> List[Path]:
+    return sorted((Path(directory) / STATS_DIR).glob('*.html.gz'))
+
+
+def recorded_minute(path: Path) -> datetime:
+    return datetime.strptime(path.name[:-len('.html.gz')], STATS_FILE_FORMAT)
+
+
+def iter_recorded_stats(directory: Union[str, Path],
+                        only: Optional[Callable[[datetime], bool]] = None) -> Iterator[Tuple[datetime, str]]:
+    """
+    Zwraca nagrane strony /stats w kolejności nagrania wraz z minutą, z której pochodzą
+    `only` - tylko minuty spełniające warunek (pozostałe pliki nie są rozpakowywane)
+    """
+    for path in recorded_stats_files(directory):
+        now = recorded_minute(path)
+        if only is None or only(now):
+            yield now, _read(path)
+
+
+def load_recorded_profile(directory: Union[str, Path], aid: int) -> Optional[str]:
+    path = Path(directory) / PROFILE_DIR / f"{aid}.html.gz"
+    return _read(path) if path.exists() else None
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    Lokalny zamiennik margonem.pl odtwarzający nagranie:
+    - GET /stats zwraca kolejne nagrane strony /stats (po ostatniej wraca do pierwszej); każda strona jest zwracana
+      `hold` razy z rzędu, jak u serwisu, który odświeża stronę rzadziej niż co minutę
+    - GET /profile/view,<aid> zwraca nagraną stronę profilu lub 404
+    - z `validators` strona /stats ma ETag i Last-Modified, a zapytanie warunkowe o niezmienioną stronę dostaje 304
+    - klient akceptujący gzip dostaje nagrany plik bez rozpakowywania (Content-Encoding: gzip)
+    Uruchomienie w tle: `server.start()`, adres: `server.base_url`
+    """
+    daemon_threads = True
+
+    def __init__(self, directory: Union[str, Path], port: int = 0, hold: int = 1, validators: bool = True):
+        super().__init__(('127.0.0.1', port), ReplayRequestHandler)
+        self.directory = Path(directory)
+        self.stats_files = recorded_stats_files(directory)
+        self.hold = max(hold, 1)
+        self.validators = validators
+        self.next_stats = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stats_file(self) -> Optional[Path]:
+        if not self.stats_files:
+            return None
+        with self.lock:
+            path = self.stats_files[self.next_stats // self.hold % len(self.stats_files)]
+            self.next_stats += 1
+        return path
+
+    def profile_file(self, aid: int) -> Optional[Path]:
+        path = self.directory / PROFILE_DIR / f"{aid}.html.gz"
+        return path if path.exists() else None
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    PROFILE_RE = re.compile(r'^/profile/view,(\d+)')
+
+    def do_GET(self):
+        headers = {}
+        if self.path.rstrip('/') == '/stats':
+            path = self.server.stats_file()
+            if path is not None and self.server.validators:
+                headers['ETag'] = f'"{path.name}"'
+                headers['Last-Modified'] = format_datetime(recorded_minute(path).replace(tzinfo=timezone.utc), True)
+                if (self.headers.get('If-None-Match') == headers['ETag']
+                        or self.headers.get('If-Modified-Since') == headers['Last-Modified']):
+                    self.send_response(304)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    return
+        else:
+            match = self.PROFILE_RE.match(self.path)
+            path = self.server.profile_file(int(match.group(1))) if match else None
+
+        if path is None:
+            self.send_error(404)
+            return
+        content = path.read_bytes()
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+        else:
+            content = gzip.decompress(content)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
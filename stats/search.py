@@ -0,0 +1,206 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.db.models import Q
+
+from .caching import KEY_PREFIX, stats_cache
+from .ingest import BATCH_SIZE, chunks
+from .models import Account, Character
+
+# Indeks podpowiedzi w pamięci procesu: posortowane tablice kluczy przeszukiwane przez bisect
+# - nicki postaci (casefold) -> postacie, ID kont jako tekst -> konta
+# Indeks budowany jest przy starcie procesu serwera (djangoProject.asgi/wsgi), żeby pierwsze żądanie nie czekało
+# na przejście tabel kont i postaci (w innych procesach - leniwie przy pierwszym zapytaniu), a potem uzupełniany
+# przyrostowo: nowe postacie (id większe od największego znanego), postacie czekające na dane z profilu (lvl=None)
+# oraz postacie, których profil scraper odświeżył od poprzedniego odświeżenia indeksu (Character.refreshed_at)
+# Scraper po zapisaniu profilu zapisuje w cache znacznik, po którym procesy WWW wiedzą, że warto odświeżyć indeks
+GENERATION_KEY = KEY_PREFIX + ':search:generation'
+# co ile sekund zapytanie sprawdza znacznik w cache i co ile najpóźniej odświeża indeks bez znacznika
+CHECK_INTERVAL = 1.0
+REFRESH_INTERVAL = 60.0
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# zapas na profile zapisane z czasem sprzed odświeżenia indeksu, ale zatwierdzone już po nim
+REFRESHED_MARGIN = timedelta(seconds=5)
+# największy znak Unicode - klucz (prefiks + MAX_CHAR) jest większy od wszystkich kluczy z tym prefiksem
+MAX_CHAR = '\U0010ffff'
+
+
+@dataclass(frozen=True)
+class Entry:
+    character_id: int
+    aid: int
+    cid: int
+    world: str
+    nick: str
+    lvl: Optional[int]
+    prof: str
+
+    def as_dict(self) -> dict:
+        return {'aid': self.aid, 'cid': self.cid, 'world': self.world, 'nick': self.nick, 'lvl': self.lvl,
+                'prof': self.prof}
+
+
+def normalize(text: str) -> str:
+    return text.strip().casefold()
+
+
+class SearchIndex:
+    """
+    nick_keys - posortowane krotki (nick casefold, id postaci); entries - dane postaci po id
+    account_keys - posortowane ID kont jako tekst (podpowiedzi po początku ID), accounts - zbiór ID kont
+    pending - id postaci bez danych z profilu, sprawdzane przy każdym odświeżeniu
+    refreshed_since - od tego czasu odświeżenia profili nie są jeszcze w indeksie
+    """
+
+    def __init__(self):
+        self.nick_keys: List[Tuple[str, int]] = []
+        self.entries: Dict[int, Entry] = {}
+        self.account_keys: List[str] = []
+        self.accounts: Set[int] = set()
+        self.pending: Set[int] = set()
+        self.max_id = 0
+        self.refreshed_since: Optional[datetime] = None
+        self.generation = None
+        self.loaded = False
+        self.checked = 0.0
+        self.refreshed = 0.0
+        self.lock = threading.Lock()
+
+    # --- budowanie i aktualizacja ---
+
+    def build(self):
+        self.refreshed_since = datetime.now() - REFRESHED_MARGIN
+        accounts = sorted(Account.objects.values_list('aid', flat=True))
+        rows = Character.objects.values_list('id', 'account_id', 'cid', 'world', 'nick', 'lvl', 'prof')
+        entries, pending, max_id = {}, set(), 0
+        for row in rows.iterator(chunk_size=BATCH_SIZE * 10):
+            max_id = max(max_id, row[0])
+            if row[5] is None:
+                pending.add(row[0])
+            if row[4]:
+                entries[row[0]] = Entry(*row)
+        self.entries, self.pending, self.max_id = entries, pending, max_id
+        self.nick_keys = sorted((normalize(entry.nick), pk) for pk, entry in entries.items())
+        self.accounts = set(accounts)
+        self.account_keys = sorted(str(aid) for aid in accounts)
+        self.loaded = True
+        self.refreshed = time.monotonic()
+
+    def refresh(self) -> int:
+        """
+        Dociąga z bazy nowe postacie, te, które czekały na dane z profilu, i te o odświeżonym profilu
+        :return: liczbę zmienionych wpisów
+        """
+        fields = ('id', 'account_id', 'cid', 'world', 'nick', 'lvl', 'prof')
+        since, self.refreshed_since = self.refreshed_since, datetime.now() - REFRESHED_MARGIN
+        rows = list(Character.objects.filter(id__gt=self.max_id).values_list(*fields))
+        if since is not None:
+            rows += Character.objects.filter(refreshed_at__gte=since).values_list(*fields)
+        for batch in chunks(sorted(self.pending)):
+            rows += Character.objects.filter(Q(id__in=batch), ~Q(lvl=None)).values_list(*fields)
+        for row in rows:
+            self.update(Entry(*row))
+        self.refreshed = time.monotonic()
+        return len(rows)
+
+    def update(self, entry: Entry):
+        """
+        Wstawia lub podmienia postać w indeksie - bisect + insort, bez przebudowy tablic
+        """
+        self.max_id = max(self.max_id, entry.character_id)
+        if entry.lvl is None:
+            self.pending.add(entry.character_id)
+        else:
+            self.pending.discard(entry.character_id)
+        if entry.aid not in self.accounts:
+            self.accounts.add(entry.aid)
+            insort(self.account_keys, str(entry.aid))
+
+        # stary klucz znika przed podmianą wpisu - równoległe wyszukiwanie nie trafi na klucz bez wpisu
+        old = self.entries.get(entry.character_id)
+        if old is not None:
+            key = (normalize(old.nick), old.character_id)
+            i = bisect_left(self.nick_keys, key)
+            if i < len(self.nick_keys) and self.nick_keys[i] == key:
+                del self.nick_keys[i]
+        if entry.nick:
+            self.entries[entry.character_id] = entry
+            insort(self.nick_keys, (normalize(entry.nick), entry.character_id))
+        else:
+            self.entries.pop(entry.character_id, None)
+
+    def ensure_fresh(self):
+        """
+        Leniwie buduje indeks w bieżącym procesie, a potem najwyżej raz na CHECK_INTERVAL sprawdza znacznik scrapera
+        (odświeża po jego zmianie albo po REFRESH_INTERVAL); pozostałe zapytania nie dotykają ani cache, ani bazy
+        """
+        now = time.monotonic()
+        if self.loaded and now - self.checked < CHECK_INTERVAL:
+            return
+        with self.lock:
+            if not self.loaded:
+                self.generation = stats_cache().get(GENERATION_KEY)
+                self.build()
+                self.checked = now
+                return
+            if now - self.checked < CHECK_INTERVAL:
+                return
+            self.checked = now
+            generation = stats_cache().get(GENERATION_KEY)
+            if generation != self.generation or now - self.refreshed >= REFRESH_INTERVAL:
+                self.generation = generation
+                self.refresh()
+
+    # --- zapytania ---
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> dict:
+        """
+        :return: postacie o nicku zaczynającym się od zapytania (alfabetycznie) i konta o ID zaczynającym się
+                 od zapytania (gdy składa się z cyfr), najwyżej `limit` każdego rodzaju
+        Wyszukiwanie nie bierze blokady, więc odświeżanie w innym wątku może w trakcie przesunąć klucze albo
+        podmienić wpis - klucz bez wpisu lub z nieaktualnym nickiem jest pomijany zamiast zgłaszać KeyError
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return {'characters': [], 'accounts': []}
+        nick_keys, entries = self.nick_keys, self.entries
+        start, end = bisect_left(nick_keys, (prefix,)), bisect_left(nick_keys, (prefix + MAX_CHAR,))
+        characters = []
+        for i in range(start, end):
+            if len(characters) >= limit:
+                break
+            try:
+                nick, pk = nick_keys[i]
+            except IndexError:
+                break
+            entry = entries.get(pk)
+            if entry is not None and normalize(entry.nick) == nick:
+                characters.append(entry.as_dict())
+        accounts = []
+        if prefix.isdigit():
+            start, end = bisect_left(self.account_keys, prefix), bisect_left(self.account_keys, prefix + MAX_CHAR)
+            accounts = [int(aid) for aid in self.account_keys[start:min(end, start + limit)]]
+        return {'characters': characters, 'accounts': accounts}
+
+    def has_account(self, aid: int) -> bool:
+        return aid in self.accounts
+
+
+index = SearchIndex()
+
+
+def get_index() -> SearchIndex:
+    index.ensure_fresh()
+    return index
+
+
+def mark_enriched():
+    """
+    Wywoływane przez scraper po zapisaniu danych z profilu - procesy WWW odświeżą indeks przy następnym zapytaniu
+    """
+    stats_cache().set(GENERATION_KEY, time.time(), None)
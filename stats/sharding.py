@@ -0,0 +1,170 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, QuerySet
+
+from .database import current_alias
+from .models import Lease
+
+# Podział uzupełniania profili między procesy: proces z kluczem k/N obsługuje konta o aid % N == k
+# (wszystkie postacie konta trafiają do jednego procesu - profil pobierany jest dla konta)
+# Każdy klucz jest dzierżawiony w tabeli Lease, więc dwa procesy z tym samym kluczem (podwójne uruchomienie,
+# stary proces jeszcze działa po restarcie) nie pobierają tych samych profili
+# Zapis minuty zostaje w jednym procesie - strona /stats to jedno żądanie na minutę, a SQLite ma jednego pisarza
+LEASE_TTL = 60.0
+# co ile sekund nadzorca sprawdza, czy procesy uzupełniające żyją
+SUPERVISOR_INTERVAL = 5.0
+# proces, który zakończył się przed MIN_UPTIME sekund, to nieudane uruchomienie: kolejne jest opóźniane wykładniczo
+# (RESTART_DELAY * 2^(n-1), najwyżej MAX_RESTART_DELAY), a po MAX_FAILURES nieudanych z rzędu nadzorca się poddaje
+MIN_UPTIME = 60.0
+RESTART_DELAY = 5.0
+MAX_RESTART_DELAY = 300.0
+MAX_FAILURES = 5
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int = 0
+    count: int = 1
+
+    @classmethod
+    def parse(cls, value: str) -> 'Shard':
+        """
+        :param value: klucz w postaci "k/N", 0 <= k < N
+        """
+        try:
+            index, count = (int(part) for part in value.split('/'))
+        except ValueError:
+            raise ValueError(f"Niepoprawny klucz podziału: {value} (oczekiwano k/N)")
+        if not 0 <= index < count:
+            raise ValueError(f"Niepoprawny klucz podziału: {value} (wymagane 0 <= k < N)")
+        return cls(index, count)
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    @property
+    def lease_name(self) -> str:
+        return f"enrich:{self}"
+
+    def owns(self, aid: int) -> bool:
+        return aid % self.count == self.index
+
+    def filter(self, query_set: QuerySet, field: str = 'account_id') -> QuerySet:
+        if self.count == 1:
+            return query_set
+        return query_set.alias(shard=F(field) % self.count).filter(shard=self.index)
+
+
+def owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def acquire_lease(name: str, owner: str, ttl: float = LEASE_TTL) -> bool:
+    """
+    Bierze albo odnawia dzierżawę; udaje się, gdy dzierżawa nie istnieje, należy do `owner` albo wygasła
+    :return: czy proces ma dzierżawę przez najbliższe `ttl` sekund
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=ttl)
+    with transaction.atomic(using=current_alias()):
+        taken = Lease.objects.filter(Q(owner=owner) | Q(expires_at__lt=now), name=name)
+        if taken.update(owner=owner, expires_at=expires_at):
+            return True
+        if Lease.objects.filter(name=name).exists():
+            return False
+        try:
+            with transaction.atomic(using=current_alias()):
+                Lease.objects.create(name=name, owner=owner, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        return True
+
+
+def release_lease(name: str, owner: str):
+    Lease.objects.filter(name=name, owner=owner).delete()
+
+
+class Supervisor:
+    """
+    Uruchamia procesy uzupełniające (`command(shard)` to argumenty komendy manage.py) i wznawia te, które się
+    zakończyły - po nieudanym uruchomieniu z wykładniczo rosnącym opóźnieniem, a po MAX_FAILURES z rzędu już nie
+    Procesy potomne dostają ten sam interpreter, skrypt (manage.py), katalog roboczy i zmienne środowiskowe
+    (np. DJANGO_SETTINGS_MODULE) co nadzorca; wznowiony proces przejmuje dzierżawę klucza najpóźniej po LEASE_TTL
+    """
+
+    def __init__(self, shards: List[Shard], command: Callable[[Shard], List[str]],
+                 log: Callable[[str], None] = print):
+        self.shards = shards
+        self.command = command
+        self.log = log
+        self.script = os.path.abspath(sys.argv[0])
+        self.cwd = os.getcwd()
+        self.env = os.environ.copy()
+        self.processes: List[Optional[subprocess.Popen]] = [None] * len(shards)
+        self.started = [0.0] * len(shards)
+        self.failures = [0] * len(shards)
+        self.restart_at: List[Optional[float]] = [None] * len(shards)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, name='supervisor', daemon=True)
+
+    def start(self):
+        for i in range(len(self.shards)):
+            self.spawn(i)
+        self.thread.start()
+
+    def spawn(self, i: int):
+        self.restart_at[i] = None
+        self.started[i] = time.monotonic()
+        self.processes[i] = subprocess.Popen(
+            [sys.executable, self.script, *self.command(self.shards[i])], cwd=self.cwd, env=self.env
+        )
+
+    def restart_delay(self, failures: int) -> float:
+        return min(MAX_RESTART_DELAY, RESTART_DELAY * 2 ** (failures - 1)) if failures else 0.0
+
+    def exited(self, i: int, returncode: int):
+        """
+        Planuje wznowienie procesu `i`, który zakończył się z kodem `returncode`
+        """
+        now = time.monotonic()
+        self.processes[i] = None
+        self.failures[i] = self.failures[i] + 1 if now - self.started[i] < MIN_UPTIME else 0
+        shard = self.shards[i]
+        if self.failures[i] >= MAX_FAILURES:
+            self.log(f"Proces uzupełniający {shard} zakończył się (kod {returncode}) - {self.failures[i]} nieudanych "
+                     f"uruchomień z rzędu, nie zostanie wznowiony")
+            return
+        delay = self.restart_delay(self.failures[i])
+        self.restart_at[i] = now + delay
+        self.log(f"Proces uzupełniający {shard} zakończył się (kod {returncode})"
+                 f" - uruchamiam ponownie za {delay:.0f} s")
+
+    def watch(self):
+        while not self.stopped.wait(SUPERVISOR_INTERVAL):
+            for i, process in enumerate(self.processes):
+                if process is not None and process.poll() is not None:
+                    self.exited(i, process.returncode)
+                restart_at = self.restart_at[i]
+                if restart_at is not None and time.monotonic() >= restart_at and not self.stopped.is_set():
+                    self.spawn(i)
+
+    def stop(self):
+        self.stopped.set()
+        for process in self.processes:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
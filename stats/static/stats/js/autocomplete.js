@@ -0,0 +1,38 @@
+const suggestions = document.getElementById("account-suggestions")
+const searchInput = document.getElementById("id_account_id")
+let searchTimeout = null;
+
+function showSuggestions(data) {
+    suggestions.replaceChildren();
+    for (const character of data.characters) {
+        const option = document.createElement("option");
+        option.value = character.aid;
+        option.label = `${character.nick} (${character.world}${character.lvl ? ", " + character.lvl + character.prof : ""})`;
+        suggestions.append(option);
+    }
+    for (const aid of data.accounts) {
+        const option = document.createElement("option");
+        option.value = aid;
+        option.label = `Konto ${aid}`;
+        suggestions.append(option);
+    }
+}
+
+if (suggestions != null && searchInput != null) {
+    searchInput.setAttribute("list", suggestions.id);
+    searchInput.setAttribute("autocomplete", "off");
+    searchInput.addEventListener("input", () => {
+        clearTimeout(searchTimeout);
+        const query = searchInput.value.trim();
+        if (query.length === 0) {
+            suggestions.replaceChildren();
+            return;
+        }
+        searchTimeout = setTimeout(() => {
+            fetch(`${suggestions.dataset.url}?q=${encodeURIComponent(query)}`)
+                .then((response) => response.json())
+                .then(showSuggestions)
+                .catch(() => suggestions.replaceChildren());
+        }, 150);
+    });
+}
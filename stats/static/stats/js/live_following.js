@@ -0,0 +1,21 @@
+const followingTable = document.getElementById("following-table")
+
+function setOnline(aid, online) {
+    const row = followingTable.querySelector(`tr[data-aid="${aid}"]`)
+    if (row != null) {
+        row.querySelector(".online").hidden = !online;
+    }
+}
+
+if (window.EventSource && followingTable.dataset.liveUrl) {
+    const source = new EventSource(followingTable.dataset.liveUrl);
+    source.addEventListener("delta", (event) => {
+        const delta = JSON.parse(event.data);
+        for (const [aid] of delta.online) {
+            setOnline(aid, true);
+        }
+        for (const aid of delta.left) {
+            setOnline(aid, false);
+        }
+    });
+}
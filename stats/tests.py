@@ -0,0 +1,1311 @@
+import os
+import asyncio
+import base64
+import importlib
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, time as day_time
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+from unittest import mock
+
+import numpy as np
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import bitmaps, coverage, database, heatmaps, ingest, leaderboards, live, polling, refresh, search
+from .archive import compact_day
+from .exports import count_activity_rows, iter_activity_rows, write_npz
+from .forms import HeatmapForm, validate_account_id
+from .caching import counters, detail_key
+from .engine import ScraperEngine
+from .ingest import ingest_minute
+from .leaderboards import Period, finalize_day, leaderboard, leaderboard_page, parse_cursor, rebuild_period
+from .models import (Account, Activity, Character, Coverage, Following, LeaderboardEntry, Tick, cached_activity_plot,
+                     get_start_end_list, render_activity_plot)
+from .parsing import extract_stats_profiles, parse_profile, parse_profile_bs4, parse_stats_page, parse_stats_page_bs4
+from .search import Entry, SearchIndex, get_index, normalize
+from .sharding import MAX_FAILURES, MIN_UPTIME, Shard, Supervisor, acquire_lease
+from .views import LeaderboardView
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'stats-tests'}}
+DUMMY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+# zapytania zapisujące/czytające, dla których sprawdzany jest plan (SAVEPOINT, INSERT itp. są pomijane)
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+# pełne przejście tabeli w planie SQLite: "SCAN tabela" (także "SCAN tabela USING [COVERING] INDEX ..."),
+# ale nie "SCAN CONSTANT ROW" ani przejście wyniku podzapytania
+FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)(?!\()(\S+)')
+INDEX_SCAN = re.compile(r'^SCAN \S+ USING (COVERING )?INDEX')
+LIMIT = re.compile(r'\bLIMIT \d+\s*$')
+
+
+def bitmap(*minutes: int) -> bytes:
+    """
+    :return: bitmapę aktywności (180 bajtów) z zaznaczonymi minutami dnia
+    """
+    activity = bytearray(180)
+    for minute in minutes:
+        activity[minute // 8] |= 0x80 >> (minute % 8)
+    return bytes(activity)
+
+
+class ArchiveTestCase(TestCase):
+    """
+    Testy z pustym katalogiem archiwum (stats.archive) i pustym cache w pamięci procesu
+    """
+    cache_settings = LOCMEM_CACHE
+
+    def setUp(self):
+        archive_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, archive_dir, ignore_errors=True)
+        patcher = mock.patch('stats.archive.ARCHIVE_DIR', archive_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        settings_override = override_settings(CACHES=self.cache_settings)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        caches['default'].clear()
+        counters.reset()
+
+
+class IngestMinuteTests(ArchiveTestCase):
+    """
+    Zapis minuty: nowe konta i postacie są tworzone hurtowo, znane dostają tylko bit minuty (OR z bitmapą dnia),
+    a liczba zapytań nie zależy od liczby graczy online (w granicach ingest.BATCH_SIZE)
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.now = datetime(2026, 10, 17, 12, 0)
+
+    @staticmethod
+    def profiles(count: int, first_aid: int = 1) -> List[Tuple[int, int, str]]:
+        return [(aid, aid * 10, 'tarhuna') for aid in range(first_aid, first_aid + count)]
+
+    def test_unknown_players_are_created_in_batches(self):
+        count = 2 * ingest.BATCH_SIZE + 1
+        with mock.patch.object(Account.objects, 'bulk_create', wraps=Account.objects.bulk_create) as bulk_create:
+            result = ingest_minute(self.profiles(count) + [(1, 10, 'tarhuna')], self.now)
+        bulk_create.assert_called_once()
+        self.assertEqual(bulk_create.call_args.kwargs['batch_size'], ingest.BATCH_SIZE)
+        self.assertEqual((result.players, result.new_players), (count, count))
+        self.assertEqual((result.created_accounts, result.created_characters, result.created_activities),
+                         (count, count, count))
+        self.assertEqual(len(result.character_ids), count)
+        self.assertEqual(Account.objects.filter(last_seen_date=self.now.date(), last_seen_minute=720).count(), count)
+        self.assertEqual(Activity.objects.filter(date=self.now.date(), total_minutes=1).count(), count)
+
+    def test_known_players_are_updated(self):
+        first = ingest_minute(self.profiles(3), self.now)
+        with mock.patch('stats.ingest._ensure_characters', wraps=ingest._ensure_characters) as ensure:
+            second = ingest_minute(self.profiles(4), self.now + timedelta(minutes=1), first.character_ids)
+        self.assertEqual(ensure.call_args.args[0], [(4, 40, 'tarhuna')])
+        self.assertEqual((second.new_players, second.created_accounts, second.created_characters), (1, 1, 1))
+        self.assertEqual((second.created_activities, second.updated_activities), (1, 3))
+        activity = Activity.objects.get(character__account_id=1, date=self.now.date())
+        self.assertEqual(bytes(activity.activity), bitmap(720, 721))
+        self.assertEqual(activity.total_minutes, 2)
+        self.assertEqual(Account.objects.get(pk=1).last_seen_minute, 721)
+
+    def test_minute_is_merged_with_existing_bitmap(self):
+        account = Account.objects.create(aid=1)
+        character = Character.objects.create(account=account, cid=10, world='tarhuna')
+        Activity.objects.create(character=character, date=self.now.date(), activity=bitmap(5, 720), total_minutes=2)
+        # powtórzona minuta (np. odtworzone nagranie) nie zmienia bitmapy ani licznika minut
+        result = ingest_minute(self.profiles(1), self.now)
+        self.assertEqual((result.created_activities, result.updated_activities), (0, 0))
+        result = ingest_minute(self.profiles(1), self.now - timedelta(minutes=700))
+        self.assertEqual(result.updated_activities, 1)
+        activity = Activity.objects.get(pk=character.activity_set.get().pk)
+        self.assertEqual(bytes(activity.activity), bitmap(5, 20, 720))
+        self.assertEqual(activity.total_minutes, 3)
+        # starsza minuta nie cofa czasu ostatniej wizyty
+        self.assertEqual(Account.objects.get(pk=1).last_seen_minute, 720)
+
+    def tick_queries(self, count: int, first_aid: int, hour: int) -> Tuple[int, int]:
+        """
+        :return: liczbę zapytań minuty z nowymi graczami i następnej minuty z tymi samymi graczami
+        """
+        now = datetime.combine(self.now.date(), day_time(hour, 0))
+        with CaptureQueriesContext(connection) as new:
+            first = ingest_minute(self.profiles(count, first_aid), now)
+        with CaptureQueriesContext(connection) as known:
+            ingest_minute(self.profiles(count, first_aid), now + timedelta(minutes=1), first.character_ids)
+        return len(new), len(known)
+
+    def test_query_count_does_not_depend_on_players(self):
+        # wcześniejsza minuta dnia, żeby oba pomiary trafiały na tę samą sytuację: luka od poprzedniego ticku
+        ingest_minute([], datetime.combine(self.now.date(), day_time(10, 0)))
+        small = self.tick_queries(2, 1, 12)
+        self.assertLess(small[1], small[0])
+        # 120 graczy mieści się w jednym zapytaniu bulk_create/bulk_update (limit 999 parametrów SQLite w Django
+        # to 124 wiersze Character, najszerszej tabeli), więc liczba zapytań musi być taka sama jak dla 2 graczy
+        self.assertEqual(self.tick_queries(120, 1000, 14), small)
+        # paczki ingest.BATCH_SIZE dzielą tylko zapytania `__in`, nie dokładają zapytań na gracza
+        new, known = self.tick_queries(ingest.BATCH_SIZE, 5000, 16)
+        self.assertLess(known, small[1] + 10)
+        self.assertLess(new, small[0] + 20)
+
+
+class CoverageTests(TestCase):
+    """
+    Maski pokrycia dnia: zapisana minuta trafia do `known`, luka od poprzedniej zapisanej minuty do `unknown`
+    (także przez północ i po dłuższej przerwie), a dograna minuta przechodzi z `unknown` do `known`
+    """
+    day = date(2026, 10, 14)
+
+    @staticmethod
+    def tick(day: date, hour: int, minute: int):
+        # jak ingest_minute: wiersz Tick i pokrycie w tej samej transakcji
+        now = datetime.combine(day, day_time(hour, minute))
+        Tick.objects.create(date=day, minute=hour * 60 + minute, players=1)
+        coverage.record_tick(now)
+
+    def masks(self, day: date) -> Tuple[List[int], List[int]]:
+        """
+        :return: listy minut zapisanych i brakujących; sprawdza też zgodność liczników z maskami
+        """
+        row = Coverage.objects.get(date=day)
+        known = np.flatnonzero(coverage.unpack(row.known)).tolist()
+        unknown = np.flatnonzero(coverage.unpack(row.unknown)).tolist()
+        self.assertEqual((row.known_minutes, row.unknown_minutes), (len(known), len(unknown)))
+        return known, unknown
+
+    def test_consecutive_minutes(self):
+        self.tick(self.day, 10, 0)
+        self.tick(self.day, 10, 1)
+        self.assertEqual(self.masks(self.day), ([600, 601], []))
+
+    def test_gap_within_day(self):
+        self.tick(self.day, 10, 0)
+        self.tick(self.day, 10, 5)
+        self.assertEqual(self.masks(self.day), ([600, 605], [601, 602, 603, 604]))
+
+    def test_gap_across_midnight(self):
+        next_day = self.day + timedelta(days=1)
+        self.tick(self.day, 23, 57)
+        self.tick(next_day, 0, 2)
+        self.assertEqual(self.masks(self.day), ([1437], [1438, 1439]))
+        self.assertEqual(self.masks(next_day), ([2], [0, 1]))
+
+    def test_restart_after_long_outage(self):
+        self.tick(self.day, 12, 0)
+        self.tick(self.day + timedelta(days=3), 6, 0)
+        self.assertEqual(self.masks(self.day), ([720], list(range(721, 1440))))
+        # dni w całości objęte luką zostają nieśledzone
+        self.assertFalse(Coverage.objects.filter(date__range=(self.day + timedelta(days=1),
+                                                              self.day + timedelta(days=2))).exists())
+        self.assertEqual(self.masks(self.day + timedelta(days=3)), ([360], list(range(360))))
+        self.assertEqual(coverage.period_coverage(self.day, self.day + timedelta(days=3)),
+                         {'known_minutes': 2, 'unknown_minutes': 719 + 360})
+
+    def test_backfill_turns_unknown_into_known(self):
+        self.tick(self.day, 10, 0)
+        self.tick(self.day, 10, 5)
+        # minuta dograna z nagrania: luka przed nią jest już oznaczona, a minuty zapisane nie stają się brakujące
+        self.tick(self.day, 10, 3)
+        self.assertEqual(self.masks(self.day), ([600, 603, 605], [601, 602, 604]))
+        self.tick(self.day, 10, 1)
+        self.tick(self.day, 10, 2)
+        self.tick(self.day, 10, 4)
+        self.assertEqual(self.masks(self.day), ([600, 601, 602, 603, 604, 605], []))
+
+    def test_first_tick_has_no_gap(self):
+        self.tick(self.day, 10, 0)
+        self.assertEqual(self.masks(self.day), ([600], []))
+        with self.assertNumQueries(4):
+            # poprzednia minuta tuż przed: zapytanie o Tick i pokrycie dnia (odczyt i zapis) + Tick.create
+            self.tick(self.day, 10, 1)
+
+
+class LeaderboardTests(ArchiveTestCase):
+    """
+    Ranking aktualizowany przy zapisie minuty jest zgodny z przeliczonym z aktywności (także po kompaktowaniu dnia),
+    zamknięty okres jest finalizowany, a strony są wybierane kluczem bez przeskoków i powtórzeń
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.today = date.today()
+        self.past = self.today - timedelta(days=40)
+
+    @staticmethod
+    def entries() -> set:
+        return set(LeaderboardEntry.objects.values_list('period', 'period_start', 'character_id', 'world', 'minutes'))
+
+    def ingest_days(self, *days: date):
+        # gracz k jest online przez k minut dnia, gracz 4 tylko pierwszego dnia
+        for day in days:
+            for minute in range(5):
+                profiles = [(aid, aid, 'tarhuna' if aid % 2 else 'narwhals') for aid in range(1, 5) if minute < aid]
+                if day != days[0]:
+                    profiles = [profile for profile in profiles if profile[0] != 4]
+                ingest_minute(profiles, datetime.combine(day, day_time(10, minute)))
+
+    def test_recorded_minutes_match_recomputation(self):
+        self.ingest_days(self.past, self.past + timedelta(days=1))
+        recorded = self.entries()
+        self.assertIn((Period.DAY, self.past, Character.objects.get(cid=4).pk, 'narwhals', 4), recorded)
+        for period in Period.values:
+            for day in (self.past, self.past + timedelta(days=1)):
+                rebuild_period(period, day)
+        self.assertEqual(self.entries(), recorded)
+
+    def test_finalize_closed_day(self):
+        self.ingest_days(self.past)
+        self.ingest_days(self.today)
+        recorded = self.entries()
+        compact_day(self.past)
+        self.assertFalse(Activity.objects.filter(date=self.past).exists())
+        finalize_day(self.past)
+        # po kompaktowaniu czasy są liczone z indeksów archiwum
+        self.assertEqual(self.entries(), recorded)
+        self.assertEqual(set(LeaderboardEntry.objects.filter(period_start__lte=self.past)
+                             .values_list('finalized', flat=True)), {True})
+        self.assertEqual(set(LeaderboardEntry.objects.filter(period=Period.DAY, period_start=self.today)
+                             .values_list('finalized', flat=True)), {False})
+
+    def create_entries(self, minutes: List[int]):
+        for cid, value in enumerate(minutes, start=1):
+            account = Account.objects.create(aid=cid)
+            character = Character.objects.create(account=account, cid=cid, world='tarhuna')
+            LeaderboardEntry.objects.create(period=Period.DAY, period_start=self.past, character=character,
+                                            world='tarhuna', minutes=value)
+
+    def test_keyset_pages(self):
+        self.create_entries([5, 1, 5, 3, 5, 1, 3, 2])
+        expected = [(position, entry.pk) for position, entry in
+                    enumerate(leaderboard(Period.DAY, self.past).order_by('-minutes', 'character_id'), start=1)]
+        forward, page = [], leaderboard_page(Period.DAY, self.past, per_page=3)
+        while True:
+            forward.append(page)
+            if page.next is None:
+                break
+            page = leaderboard_page(Period.DAY, self.past, after=parse_cursor(page.next), start=page.next_start,
+                                    per_page=3)
+        self.assertEqual([len(page.entries) for page in forward], [3, 3, 2])
+        self.assertEqual([(position, entry.pk) for page in forward for position, entry in page.rows], expected)
+        backward = [page]
+        while page.previous is not None:
+            page = leaderboard_page(Period.DAY, self.past, before=parse_cursor(page.previous), start=page.start,
+                                    per_page=3)
+            backward.append(page)
+        self.assertEqual([(position, entry.pk) for page in reversed(backward) for position, entry in page.rows],
+                         expected)
+        self.assertEqual(backward[-1].start, 1)
+
+    def test_view_pages_without_offset(self):
+        self.create_entries([5, 1, 5, 3, 5, 1, 3, 2])
+        url = reverse('stats:leaderboard_json')
+        params = {'date': self.past.isoformat()}
+        with mock.patch.object(LeaderboardView, 'PER_PAGE', 3), CaptureQueriesContext(connection) as queries:
+            first = self.client.get(url, params).json()
+            second = self.client.get(url, {**params, **first['next']}).json()
+            third = self.client.get(url, {**params, **second['next']}).json()
+            back = self.client.get(url, {**params, **third['previous']}).json()
+        self.assertEqual([r['position'] for r in first['results'] + second['results'] + third['results']],
+                         list(range(1, 9)))
+        self.assertIsNone(third['next'])
+        self.assertEqual(back['results'], second['results'])
+        for query in queries.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+            self.assertNotIn('COUNT(', query['sql'])
+
+    def test_invalid_cursor_shows_first_page(self):
+        self.create_entries([5, 1])
+        for after in ('x', '1.2.3', '-1.5'):
+            with self.subTest(after):
+                response = self.client.get(reverse('stats:leaderboard'),
+                                           {'date': self.past.isoformat(), 'after': after, 'start': '7'})
+                self.assertEqual(response.context['page'].start, 1)
+                self.assertEqual(len(response.context['page'].entries), 2)
+
+
+class ActivityPlotTests(SimpleTestCase):
+    """
+    Wektorowe przedziały aktywności i wykres są zgodne z poprzednią pętlą po bitach (bench-activity-plot),
+    są od niej wielokrotnie szybsze, a wykres bitmapy jest generowany raz na proces
+    """
+    bench = importlib.import_module('stats.management.commands.bench-activity-plot')
+
+    def bitmaps(self) -> List[bytes]:
+        rng = np.random.default_rng(7)
+        return [bitmap(), bitmap(*range(1440)), bitmap(0), bitmap(1439), bitmap(0, 1, 1438, 1439),
+                bitmap(*range(0, 1440, 2)), *(rng.integers(0, 256, 180, dtype=np.uint8).tobytes() for _ in range(20))]
+
+    def test_matches_loop(self):
+        for activity in self.bitmaps():
+            bits = np.unpackbits(np.frombuffer(activity, dtype=np.uint8))
+            self.assertEqual(get_start_end_list(bits), self.bench.legacy_start_end_list(bits))
+            self.assertEqual(render_activity_plot(activity), self.bench.legacy_activity_plot(activity))
+
+    def test_faster_than_loop(self):
+        bits = [np.unpackbits(np.frombuffer(activity, dtype=np.uint8)) for activity in self.bitmaps()]
+        loop = self.bench.Command.measure(lambda: [self.bench.legacy_start_end_list(b) for b in bits])
+        vectorized = self.bench.Command.measure(lambda: [get_start_end_list(b) for b in bits])
+        # pomiar na współdzielonej maszynie jest zaszumiony - w praktyce różnica to dwa rzędy wielkości
+        self.assertLess(vectorized * 5, loop)
+
+    def test_plot_rendered_once(self):
+        cached_activity_plot.cache_clear()
+        self.addCleanup(cached_activity_plot.cache_clear)
+        activity = Activity(pk=1, activity=bitmap(60, 61))
+        with mock.patch('stats.models.render_activity_plot', wraps=render_activity_plot) as render:
+            plot = activity.activity_plot
+            self.assertEqual(Activity(pk=1, activity=bitmap(60, 61)).activity_plot, plot)
+            self.assertEqual(render.call_count, 1)
+            activity.activity = bitmap(60, 61, 62)
+            self.assertNotEqual(activity.activity_plot, plot)
+            self.assertEqual(render.call_count, 2)
+
+
+class DetailViewQueriesTests(ArchiveTestCase):
+    """
+    Liczba zapytań strony szczegółów: postacie są czytane przy każdym żądaniu, a lista dni i aktywności dnia
+    pochodzą z cache
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.today = date.today()
+        self.past = self.today - timedelta(days=10)
+        self.archived = self.today - timedelta(days=20)
+        self.account = Account.objects.create(aid=1001)
+        self.characters = [
+            Character.objects.create(account=self.account, cid=cid, world=world, nick=f"postac{cid}", lvl=50)
+            for cid, world in ((1, 'tarhuna'), (2, 'tarhuna'), (3, 'narwhals'))
+        ]
+        for day in (self.today, self.past, self.archived):
+            for character in self.characters[:2]:
+                Activity.objects.create(character=character, date=day, activity=bitmap(60, 61, 62))
+            Coverage.objects.create(date=day, known_minutes=1440)
+        compact_day(self.archived)
+
+    def get(self, day: date):
+        response = self.client.get(reverse('stats:detail', args=[self.account.aid, day]))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assert_queries(self, day: date, cold: int, warm: int):
+        with self.assertNumQueries(cold):
+            self.get(day)
+        with self.assertNumQueries(warm):
+            response = self.get(day)
+        self.assertEqual(counters.hits['detail'], 1)
+        return response
+
+    def test_today(self):
+        response = self.assert_queries(self.today, cold=6, warm=3)
+        self.assertEqual(response.context['real_activity_date'], self.today)
+
+    def test_past_day(self):
+        self.assert_queries(self.past, cold=6, warm=3)
+
+    def test_archived_day(self):
+        self.assertFalse(Activity.objects.filter(date=self.archived).exists())
+        response = self.assert_queries(self.archived, cold=6, warm=3)
+        activities = [activity for _, activity in response.context['character_activity_list'] if activity]
+        self.assertEqual([activity.total_minutes for activity in activities], [3, 3])
+
+    def test_cached_entry_has_no_characters(self):
+        self.get(self.archived)
+        self.get(self.past)
+        for day in (self.archived, self.past):
+            for activity in caches['default'].get(detail_key(self.account.aid, day)).values():
+                self.assertNotIn('character', activity._state.fields_cache)
+
+    def test_renamed_character_on_cached_day(self):
+        self.get(self.past)
+        Character.objects.filter(pk=self.characters[0].pk).update(nick='nowy', lvl=51)
+        response = self.get(self.past)
+        self.assertEqual(counters.hits['detail'], 1)
+        self.assertContains(response, 'nowy')
+
+
+class ExportValidatorsTests(ArchiveTestCase):
+    """
+    ETag eksportu zmienia się razem z danymi konta, także gdy ostatnia minuta aktywności konta się nie zmienia
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.today = date.today()
+        self.closed = self.today - timedelta(days=5)
+        self.account = Account.objects.create(aid=2002, last_seen_date=self.today, last_seen_minute=600)
+        self.character = Character.objects.create(account=self.account, cid=1, world='tarhuna')
+        Activity.objects.create(character=self.character, date=self.today, activity=bitmap(600))
+        Activity.objects.create(character=self.character, date=self.closed, activity=bitmap(60))
+
+    def etag(self) -> str:
+        response = self.client.get(reverse('stats:export', args=[self.account.aid]))
+        self.assertEqual(response.status_code, 200)
+        b''.join(response.streaming_content)
+        return response['ETag']
+
+    def test_not_modified(self):
+        etag = self.etag()
+        response = self.client.get(reverse('stats:export', args=[self.account.aid]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_backfilled_minute_changes_etag(self):
+        etag = self.etag()
+        ingest_minute([(self.account.aid, 1, 'tarhuna')], datetime.combine(self.closed, day_time(2, 0)))
+        self.assertEqual(Account.objects.get(pk=self.account.aid).last_seen_minute, 600)
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_compaction_changes_etag(self):
+        compact_day(self.closed)
+        etag = self.etag()
+        Activity.objects.create(character=self.character, date=self.closed, activity=bitmap(61))
+        with_row = self.etag()
+        compact_day(self.closed)
+        self.assertEqual(len({etag, with_row, self.etag()}), 3)
+
+
+class ActivityExportTests(ArchiveTestCase):
+    """
+    Dzień dograny do bazy po kompaktowaniu jest eksportowany raz, z bitmapami z archiwum i z bazy połączonymi przez OR
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.closed = date.today() - timedelta(days=5)
+        self.account = Account.objects.create(aid=3003)
+        self.characters = [
+            Character.objects.create(account=self.account, cid=cid, world='tarhuna') for cid in (1, 2)
+        ]
+        for character in self.characters:
+            Activity.objects.create(character=character, date=self.closed, activity=bitmap(10, 11))
+            Activity.objects.create(character=character, date=self.closed - timedelta(days=1), activity=bitmap(5))
+        compact_day(self.closed)
+        compact_day(self.closed - timedelta(days=1))
+        Activity.objects.create(character=self.characters[0], date=self.closed, activity=bitmap(11, 12))
+
+    def assert_rows(self, rows: list):
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(len({row[:4] for row in rows}), 4)
+        merged = next(row for row in rows if row[1] == 1 and row[3] == self.closed)
+        self.assertEqual((merged[4], bytes(merged[5])), (3, bitmap(10, 11, 12)))
+
+    def test_account(self):
+        rows = list(iter_activity_rows(aid=self.account.aid))
+        self.assertEqual([row[:4] for row in rows], sorted(row[:4] for row in rows))
+        self.assert_rows(rows)
+
+    def test_all_accounts(self):
+        self.assert_rows(list(iter_activity_rows()))
+
+    def test_compaction_syncs_files_before_deleting_rows(self):
+        with mock.patch('stats.archive.os.fsync', wraps=os.fsync) as fsync:
+            compact_day(self.closed)
+        # bitmapy, indeks, dziennik kont oraz katalog po każdym z nich
+        self.assertGreaterEqual(fsync.call_count, 6)
+        self.assertFalse(Activity.objects.filter(date=self.closed).exists())
+        self.assert_rows(list(iter_activity_rows(aid=self.account.aid)))
+
+    def test_npz_truncated_to_written_rows(self):
+        count = count_activity_rows(aid=self.account.aid)
+        self.assertEqual(count, 5)
+        path = Path(tempfile.mkdtemp()) / 'export.npz'
+        self.addCleanup(shutil.rmtree, path.parent, ignore_errors=True)
+        written = write_npz(iter_activity_rows(aid=self.account.aid), count, path)
+        self.assertEqual(written, 4)
+        with np.load(path) as npz:
+            self.assertEqual({len(npz[name]) for name in npz.files}, {written})
+            self.assertEqual(npz['total_minutes'].tolist(), [1, 3, 1, 2])
+
+
+class ApiTests(ArchiveTestCase):
+    """
+    API JSON: kolejne strony kursora `next` obejmują wszystkie wiersze bez powtórzeń i przeskoków, parametry
+    zawężają wynik, a niepoprawne lub zmienione kursory i parametry dają 400
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.day = date.today() - timedelta(days=10)
+        self.days = [self.day + timedelta(days=i) for i in range(5)]
+        self.account = Account.objects.create(aid=1)
+        characters = [Character.objects.create(account=self.account, cid=cid, world=world)
+                      for cid, world in ((1, 'tarhuna'), (2, 'narwhals'))]
+        for i, day in enumerate(self.days):
+            Activity.objects.create(character=characters[i % 2], date=day, activity=bitmap(*range(i + 1)))
+        compact_day(self.days[0])
+        # ranking dnia z remisami na granicach stron
+        for cid, (world, minutes) in enumerate((('tarhuna', 5), ('narwhals', 5), ('tarhuna', 5), ('tarhuna', 3),
+                                                ('narwhals', 3), ('tarhuna', 1), ('narwhals', 1)), start=10):
+            account = Account.objects.create(aid=cid)
+            character = Character.objects.create(account=account, cid=cid, world=world)
+            LeaderboardEntry.objects.create(period=Period.DAY, period_start=self.day, character=character, world=world,
+                                            minutes=minutes)
+
+    def get(self, name: str, *args, status: int = 200, **params) -> dict:
+        response = self.client.get(reverse(f'stats:{name}', args=args), params)
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def walk(self, name: str, *args, key: str, **params) -> List[list]:
+        """
+        :return: listę wyników kolejnych stron, od pierwszej do strony bez `next`
+        """
+        pages, after = [], None
+        while True:
+            data = self.get(name, *args, **params, **({'after': after} if after else {}))
+            pages.append(data[key])
+            after = data['next']
+            if after is None:
+                return pages
+
+    def test_leaderboard_pages(self):
+        expected = list(LeaderboardEntry.objects.filter(period=Period.DAY).order_by('-minutes', 'character_id')
+                        .values_list('character__cid', 'minutes'))
+        for limit in (1, 2, 3, 7, 8):
+            with self.subTest(limit=limit):
+                pages = self.walk('api_leaderboard', key='results', date=self.day.isoformat(), limit=limit)
+                self.assertEqual([(r['cid'], r['minutes']) for page in pages for r in page], expected)
+                self.assertTrue(all(0 < len(page) <= limit for page in pages))
+
+    def test_leaderboard_filters(self):
+        pages = self.walk('api_leaderboard', key='results', date=self.day.isoformat(), world='narwhals', limit=1)
+        self.assertEqual([r['cid'] for page in pages for r in page], [11, 14, 16])
+        self.assertEqual(self.get('api_leaderboard', date=self.day.isoformat(), period='w')['results'], [])
+        self.assertEqual(self.get('api_leaderboard', period='d')['period_start'], self.day.isoformat())
+
+    def test_leaderboard_invalid_parameters(self):
+        for params in ({'after': 'abc'}, {'after': '5'}, {'after': '5.11.1'}, {'after': '-1.11'}, {'after': '5.x'},
+                       {'limit': '0'}, {'limit': '501'}, {'limit': 'x'}, {'period': 'y'}, {'date': '2026-13-01'}):
+            with self.subTest(**params):
+                self.assertIn('error', self.get('api_leaderboard', status=400, **params))
+
+    def test_account_days_pages(self):
+        for limit in (1, 2, 5):
+            with self.subTest(limit=limit):
+                pages = self.walk('api_account_days', 1, key='days', limit=limit)
+                days = [day for page in pages for day in page]
+                self.assertEqual([day['date'] for day in days], [day.isoformat() for day in self.days])
+                # pierwszy dzień jest już tylko w archiwum
+                self.assertEqual([day['minutes'] for day in days], [1, 2, 3, 4, 5])
+
+    def test_account_days_filters(self):
+        data = self.get('api_account_days', 1, **{'from': self.days[1].isoformat(), 'to': self.days[3].isoformat()})
+        self.assertEqual([day['date'] for day in data['days']], [day.isoformat() for day in self.days[1:4]])
+        self.assertEqual(data['days'][0]['characters'], [[2, 'narwhals', 2]])
+        self.assertIsNone(data['next'])
+        for params in ({'after': '2026-13-01'}, {'after': 'x'}, {'from': '1.5'}, {'limit': '-1'}):
+            with self.subTest(**params):
+                self.assertIn('error', self.get('api_account_days', 1, status=400, **params))
+        self.get('api_account_days', 999, status=404)
+
+    def test_account_sessions_formats(self):
+        day = self.days[2]
+        intervals = self.get('api_account_sessions', 1, day)
+        self.assertEqual(intervals['characters'], [{'cid': 1, 'world': 'tarhuna', 'minutes': 3, 'intervals': [[0, 3]]}])
+        encoded = self.get('api_account_sessions', 1, day, format='base64')['characters'][0]['activity']
+        self.assertEqual(base64.b64decode(encoded), bitmap(0, 1, 2))
+        self.get('api_account_sessions', 1, day, status=400, format='xml')
+
+
+class HeatmapViewTests(ArchiveTestCase):
+    """
+    Limit zakresu heatmapy obowiązuje także wtedy, gdy jeden z końców zakresu jest domyślny
+    """
+
+    def get(self, **params: str):
+        with mock.patch('stats.views.heatmap', wraps=heatmaps.heatmap) as build:
+            response = self.client.get(reverse('stats:heatmap'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, build
+
+    def test_default_range(self):
+        today = date.today()
+        _, build = self.get()
+        build.assert_called_once_with(today - timedelta(days=6), today, None, None)
+        _, build = self.get(date_to='2020-01-10')
+        build.assert_called_once_with(date(2020, 1, 4), date(2020, 1, 10), None, None)
+
+    def test_one_sided_range_is_limited(self):
+        response, build = self.get(date_from='1990-01-01')
+        build.assert_not_called()
+        self.assertContains(response, f'Zakres może mieć najwyżej {HeatmapForm.MAX_DAYS} dni!')
+        _, build = self.get(date_from=(date.today() - timedelta(days=HeatmapForm.MAX_DAYS - 1)).isoformat())
+        build.assert_called_once()
+
+    def test_reversed_range(self):
+        response, build = self.get(date_from='2020-01-10', date_to='2020-01-01')
+        build.assert_not_called()
+        self.assertContains(response, 'Początek zakresu musi być przed jego końcem!')
+        response, build = self.get(date_from=(date.today() + timedelta(days=1)).isoformat())
+        build.assert_not_called()
+
+
+def free_ports(count: int) -> int:
+    """
+    :return: pierwszy z `count` kolejnych wolnych portów UDP na 127.0.0.1
+    """
+    for port in range(20000 + os.getpid() % 20000, 65000, count):
+        sockets = []
+        try:
+            for i in range(count):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sockets.append(sock)
+                sock.bind(('127.0.0.1', port + i))
+            return port
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+    raise RuntimeError("Brak wolnych portów UDP")
+
+
+class LiveFeedWorkersTests(SimpleTestCase):
+    """
+    Każdy worker ASGI ma własny port odbiornika, a scraper wysyła zmiany na porty wszystkich workerów
+    """
+
+    def setUp(self):
+        self.port = free_ports(2)
+        self.sockets = []
+        for i in range(2):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.settimeout(2)
+            self.addCleanup(sock.close)
+            self.sockets.append(sock)
+
+    def test_publisher_sends_to_every_worker(self):
+        for i, sock in enumerate(self.sockets):
+            sock.bind(('127.0.0.1', self.port + i))
+        publisher = live.FeedPublisher(('127.0.0.1', self.port), workers=2)
+        self.addCleanup(publisher.close)
+        now = datetime(2026, 10, 17, 12, 0)
+        publisher.publish_minute([(1, 11, 'tarhuna')], now)
+        deltas = publisher.publish_minute([(2, 22, 'tarhuna')], now + timedelta(minutes=1))
+        for sock in self.sockets:
+            self.assertEqual(live.WorldDelta.decode(sock.recv(65536)).online, deltas[0].online)
+
+    def test_receiver_skips_port_of_another_worker(self):
+        self.sockets[0].bind(('127.0.0.1', self.port))
+
+        async def start():
+            try:
+                return await live.ensure_receiver(('127.0.0.1', self.port), workers=2), live._transport
+            finally:
+                if live._transport is not None:
+                    live._transport.close()
+                live._transport, live._receiver_lock = None, None
+
+        started, transport = asyncio.run(start())
+        self.assertTrue(started)
+        self.assertEqual(transport.get_extra_info('sockname')[1], self.port + 1)
+
+    def test_receiver_without_free_port(self):
+        self.sockets[0].bind(('127.0.0.1', self.port))
+
+        async def start():
+            with self.assertLogs('stats.live', 'WARNING'):
+                return await live.ensure_receiver(('127.0.0.1', self.port), workers=1)
+
+        self.assertFalse(asyncio.run(start()))
+        live._receiver_lock = None
+
+
+@override_settings(STATS_METRICS_TOKEN='sekret')
+class MonitoringAccessTests(TestCase):
+    """
+    Metryki i liczniki cache wymagają tokenu - adres 127.0.0.1 (np. za pośrednikiem) nie wystarcza
+    """
+
+    def test_requires_token(self):
+        for name in ('metrics', 'cache_stats'):
+            with self.subTest(name):
+                url = reverse(f'stats:{name}')
+                self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 404)
+                self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer inny').status_code, 404)
+                self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer sekret').status_code, 200)
+
+    @override_settings(STATS_METRICS_TOKEN='')
+    def test_disabled_without_token(self):
+        self.assertEqual(self.client.get(reverse('stats:metrics'), HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+
+
+class SearchIndexTests(SimpleTestCase):
+    """
+    Wyszukiwanie bez blokady pomija klucze, których wpis zniknął albo zmienił nick w trakcie odświeżania
+    """
+
+    def setUp(self):
+        self.index = SearchIndex()
+        for pk, nick in enumerate(('Abc', 'Abd', 'Abe', 'Xyz'), start=1):
+            self.index.update(Entry(pk, pk * 10, pk, 'tarhuna', nick, 50, 'w'))
+
+    def test_search(self):
+        result = self.index.search('ab', limit=2)
+        self.assertEqual([c['nick'] for c in result['characters']], ['Abc', 'Abd'])
+        self.assertEqual(self.index.search('1')['accounts'], [10])
+
+    def test_missing_and_stale_entries_are_skipped(self):
+        # stan jak w połowie `update` w innym wątku: klucz bez wpisu i wpis z nowym nickiem pod starym kluczem
+        del self.index.entries[1]
+        self.index.entries[2] = Entry(2, 20, 2, 'tarhuna', 'Nowy', 50, 'w')
+        self.assertIn((normalize('Abd'), 2), self.index.nick_keys)
+        result = self.index.search('ab', limit=2)
+        self.assertEqual([c['nick'] for c in result['characters']], ['Abe'])
+
+
+class SearchIndexRefreshTests(ArchiveTestCase):
+    """
+    Indeks podpowiedzi jest budowany przy starcie serwera, a odświeżenie dodaje konta zapisane przez scraper
+    """
+
+    def test_built_at_server_start(self):
+        sys.modules.pop('djangoProject.wsgi', None)
+        with mock.patch.object(search.index, 'loaded', False), mock.patch.object(search.index, 'build') as build:
+            importlib.import_module('djangoProject.wsgi')
+        build.assert_called_once_with()
+
+    def test_refresh_adds_ingested_accounts(self):
+        now = datetime(2026, 10, 14, 12, 0)
+        ingest_minute([(1, 10, 'tarhuna')], now)
+        index = SearchIndex()
+        index.build()
+        ingest_minute([(1, 10, 'tarhuna'), (2, 20, 'tarhuna')], now + timedelta(minutes=1))
+        self.assertFalse(index.has_account(2))
+        self.assertEqual(index.refresh(), 1)
+        self.assertTrue(index.has_account(2))
+        self.assertEqual(index.search('2')['accounts'], [2])
+        # znane konto jest sprawdzane w indeksie, bez zapytania do bazy
+        with mock.patch('stats.forms.get_index', return_value=index), self.assertNumQueries(0):
+            validate_account_id(2)
+
+
+class RelatedAccountsTests(ArchiveTestCase):
+    """
+    Macierz kont zamkniętego dnia jest budowana raz na świat i dzień, a wynik konta jest w cache
+    """
+
+    def setUp(self):
+        super().setUp()
+        bitmaps._closed_account_matrix.cache_clear()
+        self.addCleanup(bitmaps._closed_account_matrix.cache_clear)
+        self.closed = date.today() - timedelta(days=5)
+        # konto 1 kończy sesje tuż przed sesjami konta 2, konto 3 gra razem z kontem 1
+        for aid, minutes in ((1, [*range(10, 20), *range(40, 50)]), (2, [*range(20, 30), *range(50, 60)]),
+                             (3, [*range(10, 15)])):
+            account = Account.objects.create(aid=aid)
+            character = Character.objects.create(account=account, cid=aid, world='tarhuna')
+            Activity.objects.create(character=character, date=self.closed, activity=bitmap(*minutes))
+        compact_day(self.closed)
+
+    def get(self, aid: int):
+        response = self.client.get(reverse('stats:related', args=[aid, self.closed]))
+        self.assertEqual(response.status_code, 200)
+        return response.context['related_list']
+
+    def test_matrix_built_once_per_world_and_day(self):
+        with mock.patch('stats.bitmaps.load_account_matrix', wraps=bitmaps.load_account_matrix) as load:
+            related = self.get(1)
+            self.assertEqual(self.get(2)[0][2], [(1, 2, 0)])
+            self.get(1)
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(related, [('tarhuna', [(3, 5)], [(2, 2, 0)])])
+        self.assertEqual((counters.hits['related'], counters.misses['related']), (1, 2))
+
+
+def stats_page(*sections: str) -> str:
+    """
+    :return: strona /stats z sekcjami `div.news-body` o podanej treści
+    """
+    body = ''.join(f'<div class="news-header">{i}</div><div class="news-body">{section}</div>'
+                   for i, section in enumerate(sections))
+    return f'<html><body><div id="content">{body}</div></body></html>'
+
+
+def profile_link(aid: int, cid: int, world: str) -> str:
+    return f'<a href="/profile/view,{aid}#char_{cid},{world}">gracz</a>'
+
+
+def profile_page(*characters: str) -> str:
+    return f'<html><body><ul class="characters">{"".join(characters)}</ul></body></html>'
+
+
+def profile_character(cid: int, nick: str, lvl: str = '50', prof: str = 'w', quote: str = '"') -> str:
+    style = 'background-image: url(' + 'x' * 48 + f'/m/{cid}.gif\');'
+    q = quote
+    return (
+        f'<li class="char-row" data-id={q}{cid}{q}><div class="char-avatar"><span class="cimg" style="{style}">'
+        f'</span></div><div class="char-data"><input type="hidden" class="chnick" value={q}{nick}{q}>'
+        f'<input type=hidden class="chlvl" value={q}{lvl}{q}><input class="chprof other" value={q}{prof}{q}/>'
+        f'</div></li>'
+    )
+
+
+class StatsPageParsingTests(SimpleTestCase):
+    """
+    Szybka ścieżka parsowania strony /stats (stats_section_extents) daje te same krotki co BeautifulSoup
+    """
+
+    def assert_same(self, html: str) -> list:
+        profiles = list(extract_stats_profiles(html))
+        self.assertEqual(profiles, parse_stats_page_bs4(html))
+        return profiles
+
+    def test_sections(self):
+        sections = [profile_link(i, i, 'ignored') for i in range(10)]
+        sections[1] = profile_link(1, 11, 'tarhuna') + '<div class="inner"><div>' + profile_link(2, 22, 'tarhuna')
+        sections[1] += '</div></div>'
+        sections[8] = '<div class="news-body-extra">' + profile_link(3, 33, 'narwhals') + '</div>'
+        profiles = self.assert_same(stats_page(*sections))
+        self.assertEqual(profiles, [('1', '11', 'tarhuna'), ('2', '22', 'tarhuna'), ('3', '33', 'narwhals')])
+        self.assertEqual(parse_stats_page(stats_page(*sections)), profiles)
+
+    def test_malformed_section(self):
+        sections = [''] * 10
+        sections[1] = profile_link(1, 11, 'tarhuna') + '<div/>' + profile_link(2, 22, 'tarhuna')
+        # niezamknięty div w sekcji 8 - sekcja ciągnie się do końca dokumentu
+        sections[8] = '<div class="unclosed">' + profile_link(3, 33, 'narwhals')
+        sections[9] = profile_link(4, 44, 'narwhals')
+        self.assert_same(stats_page(*sections))
+
+    def test_missing_sections(self):
+        self.assert_same(stats_page(profile_link(1, 11, 'tarhuna'), profile_link(2, 22, 'tarhuna')))
+
+    def test_empty_page(self):
+        self.assertEqual(self.assert_same(''), [])
+        self.assertEqual(parse_stats_page(''), [])
+
+
+class ProfileParsingTests(SimpleTestCase):
+    """
+    Szybka ścieżka `parse_profile` daje ten sam wynik co BeautifulSoup (parse_profile_bs4)
+    """
+
+    def assert_same(self, html: str, cid: int):
+        data = parse_profile(html, cid)
+        self.assertEqual(data, parse_profile_bs4(html, cid))
+        return data
+
+    def test_profile(self):
+        html = profile_page(profile_character(5, 'Pierwsza'), profile_character(7, 'Druga &amp; Spółka', '120', 'm'))
+        self.assertEqual(self.assert_same(html, 7), {
+            'avatar_url': '/m/7.gif', 'nick': 'Druga & Spółka', 'lvl': '120', 'prof': 'm'
+        })
+        self.assertEqual(self.assert_same(html, 5)['nick'], 'Pierwsza')
+
+    def test_single_quoted_attributes(self):
+        self.assert_same(profile_page(profile_character(9, 'Nick>Z', quote="'")), 9)
+
+    def test_missing_character(self):
+        self.assertIsNone(self.assert_same(profile_page(profile_character(5, 'Pierwsza')), 6))
+
+    def test_empty_page(self):
+        self.assertIsNone(self.assert_same('', 5))
+
+    def test_malformed_character(self):
+        html = profile_page(profile_character(5, 'Pierwsza').replace('class="chlvl"', 'class="level"'))
+        with self.assertRaises(TypeError):
+            parse_profile_bs4(html, 5)
+        with self.assertRaises(TypeError):
+            parse_profile(html, 5)
+
+    def test_unclosed_character(self):
+        html = profile_page(profile_character(5, 'Pierwsza').replace('</li>', ''))
+        self.assert_same(html, 5)
+
+
+class RefreshPlanTests(TestCase):
+    """
+    Planowanie odświeżania profili w ustalonej chwili `now`: każdy priorytet wybiera tylko postacie, których profil
+    jest starszy niż jego próg, najwyżej `limit` na priorytet
+    """
+    now = datetime(2026, 10, 14, 12, 0)
+
+    def character(self, cid: int, refreshed: Optional[timedelta], lvl: Optional[int] = 50, online: bool = False):
+        account = Account.objects.create(aid=cid, last_seen_date=self.now.date(),
+                                         last_seen_minute=720 if online else 600)
+        return Character.objects.create(account=account, cid=cid, world='tarhuna', lvl=lvl,
+                                        refreshed_at=self.now - refreshed if refreshed is not None else None)
+
+    def test_priorities_and_thresholds(self):
+        Tick.objects.create(date=self.now.date(), minute=720, players=2)
+        pending = self.character(1, None, lvl=None)
+        self.character(2, timedelta(minutes=5), lvl=None)
+        retried = self.character(3, timedelta(minutes=11), lvl=None)
+        online = self.character(4, timedelta(hours=7), online=True)
+        self.character(5, timedelta(hours=1), online=True)
+        ranked = self.character(6, timedelta(days=2))
+        ranked_fresh = self.character(7, timedelta(hours=12))
+        stale = self.character(8, timedelta(days=8))
+        self.character(9, timedelta(days=2))
+        week = leaderboards.period_start(Period.WEEK, self.now.date())
+        for character, minutes in ((ranked, 10), (ranked_fresh, 20)):
+            LeaderboardEntry.objects.create(period=Period.WEEK, period_start=week, character=character,
+                                            world='tarhuna', minutes=minutes)
+        result = [(priority, candidate[0]) for priority, candidate in refresh.plan(self.now, 10)]
+        self.assertEqual(result, [
+            (refresh.PENDING, pending.pk), (refresh.PENDING, retried.pk), (refresh.ONLINE, online.pk),
+            (refresh.RANKED, ranked.pk), (refresh.STALE, stale.pk),
+        ])
+        self.assertEqual(refresh.plan(self.now, 1)[:2], [
+            (refresh.PENDING, (pending.pk, 1, 1, 'tarhuna')), (refresh.ONLINE, (online.pk, 4, 4, 'tarhuna')),
+        ])
+
+
+class RefreshQueueTests(SimpleTestCase):
+    """
+    Kolejka odświeżania: pilniejszy priorytet pierwszy, w obrębie priorytetu kolejność dodania, postać najwyżej raz
+    (także zdjęta, dopóki jej profil nie zostanie zapisany)
+    """
+
+    def setUp(self):
+        self.queue = refresh.RefreshQueue()
+
+    def pop_all(self) -> List[Tuple[int, int]]:
+        result = []
+        while (item := self.queue.pop()) is not None:
+            result.append((item[0], item[1][0]))
+        return result
+
+    def test_priority_order(self):
+        for priority, pk in ((refresh.STALE, 1), (refresh.RANKED, 2), (refresh.PENDING, 3), (refresh.ONLINE, 4),
+                             (refresh.PENDING, 5)):
+            self.assertTrue(self.queue.push(priority, (pk, pk, pk, 'tarhuna')))
+        self.assertEqual(self.queue.counts(), {'pending': 2, 'online': 1, 'ranked': 1, 'stale': 1})
+        self.assertEqual(self.pop_all(), [(refresh.PENDING, 3), (refresh.PENDING, 5), (refresh.ONLINE, 4),
+                                          (refresh.RANKED, 2), (refresh.STALE, 1)])
+
+    def test_duplicates(self):
+        candidate = (1, 1, 1, 'tarhuna')
+        self.assertTrue(self.queue.push(refresh.STALE, candidate))
+        self.assertFalse(self.queue.push(refresh.STALE, candidate))
+        self.assertFalse(self.queue.push(refresh.STALE + 1, candidate))
+        # pilniejszy priorytet przesuwa postać do przodu; stary wpis w kopcu jest pomijany
+        self.assertTrue(self.queue.push(refresh.ONLINE, candidate))
+        self.queue.push(refresh.RANKED, (2, 2, 2, 'tarhuna'))
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual(self.pop_all(), [(refresh.ONLINE, 1), (refresh.RANKED, 2)])
+
+    def test_taken_until_done(self):
+        candidate = (1, 1, 1, 'tarhuna')
+        self.queue.push(refresh.STALE, candidate)
+        self.queue.push(refresh.STALE, (2, 2, 2, 'tarhuna'))
+        self.assertEqual(self.queue.pop()[1], candidate)
+        self.assertFalse(self.queue.push(refresh.PENDING, candidate))
+        self.queue.clear()
+        self.assertEqual(len(self.queue), 0)
+        self.assertFalse(self.queue.push(refresh.PENDING, candidate))
+        self.queue.done(1)
+        self.assertTrue(self.queue.push(refresh.PENDING, candidate))
+        self.assertEqual(self.pop_all(), [(refresh.PENDING, 1)])
+
+
+class BudgetTests(SimpleTestCase):
+    """
+    Kubełek żetonów: zapas na `burst_seconds`, potem jedno zapytanie co 60 / per_minute s, odnawianie do pojemności
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('stats.refresh.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_rate(self):
+        budget = refresh.Budget(60, burst_seconds=5)
+        self.assertEqual([budget.reserve() for _ in range(5)], [0.0] * 5)
+        self.assertEqual(budget.reserve(), 1.0)
+        self.assertEqual(budget.reserve(), 2.0)
+        self.now += 2
+        self.assertEqual(budget.reserve(), 1.0)
+
+    def test_refill_is_capped(self):
+        budget = refresh.Budget(120, burst_seconds=5)
+        for _ in range(10):
+            budget.reserve()
+        self.now += 3600
+        self.assertEqual([budget.reserve() for _ in range(11)], [0.0] * 10 + [0.5])
+
+    def test_unlimited(self):
+        budget = refresh.Budget(0)
+        self.assertEqual({budget.reserve() for _ in range(1000)}, {0.0})
+
+
+def http_response(status: int, content: bytes = b'', **headers: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = content
+    response.encoding = 'utf-8'
+    response.headers.update({name.replace('_', '-'): value for name, value in headers.items()})
+    return response
+
+
+class StubSession:
+    """
+    Sesja HTTP zwracająca kolejno podane odpowiedzi i zapamiętująca nagłówki zapytań
+    """
+
+    def __init__(self, *responses: requests.Response):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url: str, headers: dict = None, timeout: float = None) -> requests.Response:
+        self.requests.append(headers or {})
+        return self.responses.pop(0)
+
+
+def online_page(*profiles: Tuple[int, int, str], footer: str = '') -> bytes:
+    sections = [''] * 10
+    sections[1] = ''.join(profile_link(*profile) for profile in profiles)
+    sections[9] = footer
+    return stats_page(*sections).encode()
+
+
+class StatsPollerTests(TestCase):
+    """
+    Pobieranie /stats: 304 i niezmieniony skrót sekcji zwracają graczy z poprzedniej minuty bez parsowania,
+    a do zapisu minuty (ingest_minute z `known`) trafiają tylko gracze, których wtedy nie było
+    """
+
+    def setUp(self):
+        parse_patcher = mock.patch('stats.polling.parse_stats_page', wraps=polling.parse_stats_page)
+        self.parse = parse_patcher.start()
+        self.addCleanup(parse_patcher.stop)
+
+    def test_not_modified_reuses_profiles(self):
+        session = StubSession(
+            http_response(200, online_page((1, 11, 'tarhuna')), ETag='"v1"',
+                          Last_Modified='Sat, 17 Oct 2026 12:00:00 GMT'),
+            http_response(304),
+        )
+        poller = polling.StatsPoller(session, 'http://stats')
+        first = poller.fetch(10)
+        second = poller.fetch(10)
+        self.assertEqual(session.requests[0], {})
+        self.assertEqual(session.requests[1], {
+            'If-None-Match': '"v1"', 'If-Modified-Since': 'Sat, 17 Oct 2026 12:00:00 GMT'
+        })
+        self.assertEqual((first.status, second.status), (polling.MODIFIED, polling.NOT_MODIFIED))
+        self.assertEqual(second.profiles, first.profiles)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second.transferred, 0)
+        self.assertEqual(self.parse.call_count, 1)
+
+    def test_same_digest_skips_parsing(self):
+        session = StubSession(
+            http_response(200, online_page((1, 11, 'tarhuna'), footer='12:00')),
+            http_response(200, online_page((1, 11, 'tarhuna'), footer='12:01')),
+            http_response(200, online_page((1, 11, 'tarhuna'), (2, 22, 'tarhuna'), footer='12:02')),
+        )
+        poller = polling.StatsPoller(session, 'http://stats')
+        results = [poller.fetch(10) for _ in range(3)]
+        self.assertEqual(session.requests, [{}, {}, {}])
+        self.assertEqual([result.status for result in results], [polling.MODIFIED, polling.UNCHANGED, polling.MODIFIED])
+        self.assertEqual(results[1].profiles, results[0].profiles)
+        self.assertEqual(self.parse.call_count, 2)
+        self.assertEqual(len(results[2].profiles), 2)
+
+    def test_changed_players_go_to_ingest(self):
+        session = StubSession(
+            http_response(200, online_page((1, 11, 'tarhuna'), (2, 22, 'tarhuna'))),
+            http_response(200, online_page((1, 11, 'tarhuna'), (3, 33, 'narwhals'))),
+        )
+        poller = polling.StatsPoller(session, 'http://stats')
+        now = datetime(2026, 10, 17, 12, 0)
+        first = ingest_minute(poller.fetch(10).profiles, now)
+        with mock.patch('stats.ingest._ensure_characters', wraps=ingest._ensure_characters) as ensure:
+            second = ingest_minute(poller.fetch(10).profiles, now + timedelta(minutes=1), first.character_ids)
+        self.assertEqual(ensure.call_args.args[0], [(3, 33, 'narwhals')])
+        self.assertEqual((second.players, second.new_players), (2, 1))
+        self.assertEqual(second.character_ids[(1, 11, 'tarhuna')], first.character_ids[(1, 11, 'tarhuna')])
+        self.assertEqual(Activity.objects.get(character_id=first.character_ids[(1, 11, 'tarhuna')]).total_minutes, 2)
+        self.assertEqual(Activity.objects.filter(character__cid=22).get().total_minutes, 1)
+
+
+class WriterConnectionTests(TransactionTestCase):
+    """
+    Połączenie zapisu zaczyna transakcje od BEGIN IMMEDIATE, pragmy są ustawiane na każdym połączeniu,
+    a tryb dziennika - tylko na żądanie punktu wejścia
+    """
+    databases = {'default', 'writer'}
+
+    def test_writer_begins_immediate(self):
+        with CaptureQueriesContext(connections[database.WRITER_ALIAS]) as queries, database.use_writer():
+            with transaction.atomic(using=database.current_alias()):
+                Account.objects.create(aid=1)
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+        with CaptureQueriesContext(connections['default']) as queries, transaction.atomic():
+            Account.objects.create(aid=2)
+        self.assertEqual(queries[0]['sql'], 'BEGIN')
+
+    def test_pragmas_applied(self):
+        expected = {'busy_timeout': database.PRAGMAS['busy_timeout'], 'cache_size': database.PRAGMAS['cache_size'],
+                    'synchronous': 1, 'temp_store': 2}
+        for alias in self.databases:
+            with connections[alias].cursor() as cursor:
+                for name, value in expected.items():
+                    with self.subTest(alias=alias, pragma=name):
+                        cursor.execute(f"PRAGMA {name}")
+                        self.assertEqual(cursor.fetchone()[0], value)
+
+    def test_journal_mode_only_on_request(self):
+        self.assertNotIn('journal_mode', database.PRAGMAS)
+        path = Path(tempfile.mkdtemp()) / 'db.sqlite3'
+        self.addCleanup(shutil.rmtree, path.parent, ignore_errors=True)
+        wrapper = connections['default'].__class__({**connections['default'].settings_dict, 'NAME': str(path)})
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], 'delete')
+        self.assertEqual(database.set_journal_mode(wrapper), 'wal')
+
+
+def query_plan(sql: str) -> List[str]:
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[3] for row in cursor.fetchall()]
+
+
+def full_scans(sql: str, plan: List[str]) -> List[str]:
+    """
+    :return: kroki planu przeglądające całą tabelę; przejście indeksu w kolejności ORDER BY z LIMIT (bez sortowania
+             w pamięci, np. Tick.latest) kończy się po kilku wierszach, więc nie jest liczone
+    """
+    ordered_walk = LIMIT.search(sql) and not any('TEMP B-TREE' in line for line in plan)
+    return [line for line in plan if FULL_SCAN.match(line) and not (ordered_walk and INDEX_SCAN.match(line))]
+
+
+class QueryPlanTests(ArchiveTestCase):
+    """
+    Plany zapytań (EXPLAIN QUERY PLAN) gorących ścieżek: widoków, API oraz scrapera (zapis minuty, planowanie
+    odświeżania profili, dzierżawa, zapis profilu, odświeżenie indeksu podpowiedzi, zamknięcie dnia)
+    Każde zapytanie ścieżki wykonanej z wyłączonym cache nie może przeglądać całej tabeli
+    """
+    cache_settings = DUMMY_CACHE
+
+    def setUp(self):
+        super().setUp()
+        self.day = date.today()
+        self.now = datetime.combine(self.day, day_time(12, 0))
+        for aid in range(1, 21):
+            account = Account.objects.create(aid=aid, last_seen_date=self.day, last_seen_minute=719)
+            for cid, world in ((aid, 'tarhuna'), (aid + 100, 'narwhals')):
+                character = Character.objects.create(
+                    account=account, cid=cid, world=world, nick=f"postac{cid}", lvl=aid, refreshed_at=self.now
+                )
+                for day in (self.day, self.day - timedelta(days=1)):
+                    Activity.objects.create(character=character, date=day, activity=bitmap(*range(aid)))
+        for minute in range(715, 720):
+            Tick.objects.create(date=self.day, minute=minute, players=40)
+        Coverage.objects.create(date=self.day, known_minutes=720)
+        self.character = Character.objects.get(account_id=20, world='tarhuna')
+        user = User.objects.create_user('explain-queries')
+        Following.objects.create(user=user, account_id=self.character.account_id)
+        self.client.force_login(user)
+
+    def scenarios(self) -> List[Tuple[str, Callable[[], object]]]:
+        character, day = self.character, self.day
+        aid, world = character.account_id, character.world
+        profiles = list(Character.objects.values_list('account_id', 'cid', 'world'))
+        # jedna nowa postać na nowym koncie - ścieżka tworzenia wierszy w zapisie minuty
+        profiles.append((2 ** 31 - 1, 2 ** 31 - 1, world))
+        now = self.now + timedelta(minutes=1)
+
+        def get(name: str, *args, **params):
+            return lambda: self.client.get(reverse(f'stats:{name}', args=args), params)
+
+        date_str = f"{day:%Y-%m-%d}"
+        # indeks podpowiedzi jest budowany raz na proces (pełne przejście z definicji) - tu tylko jego odświeżanie
+        get_index()
+        search_index = SearchIndex()
+        search_index.build()
+        return [
+            ('index', get('index')),
+            ('index-search', lambda: self.client.post(reverse('stats:index'), {
+                'account_id': aid, 'activity_date': date_str, 'no_date_option': 'last'
+            })),
+            ('detail', get('detail', aid, day)),
+            ('related', get('related', aid, day)),
+            ('following', get('following')),
+            ('export', get('export', aid)),
+            ('leaderboard', get('leaderboard')),
+            ('leaderboard-world', get('leaderboard', world=world)),
+            ('leaderboard-json', get('leaderboard_json')),
+            ('heatmap-account', get('heatmap', aid=aid, date_from=date_str, date_to=date_str)),
+            ('heatmap-world', get('heatmap', world=world, date_from=date_str, date_to=date_str)),
+            ('api-account', get('api_account', aid)),
+            ('api-account-days', get('api_account_days', aid)),
+            ('api-account-sessions', get('api_account_sessions', aid, day)),
+            ('api-leaderboard', get('api_leaderboard', world=world)),
+            ('api-search', get('api_search', q=character.nick[:2])),
+            ('scraper-ingest', lambda: ingest_minute(profiles, now)),
+            ('scraper-refresh-plan', lambda: refresh.plan(now, 100)),
+            ('scraper-refresh-plan-shard', lambda: refresh.plan(now, 100, Shard(1, 4))),
+            ('scraper-lease', lambda: acquire_lease('enrich:explain', 'explain-queries')),
+            ('scraper-profile', lambda: ScraperEngine._save_profile(character.pk, aid, {'lvl': character.lvl}, now)),
+            ('scraper-search-refresh', search_index.refresh),
+            ('scraper-finalize-day', lambda: finalize_day(day)),
+        ]
+
+    def test_no_full_scans(self):
+        for name, scenario in self.scenarios():
+            with self.subTest(name), CaptureQueriesContext(connection) as context:
+                result = scenario()
+                self.assertLess(getattr(result, 'status_code', 200), 400)
+                captured = [q['sql'] for q in context.captured_queries if q['sql'].lstrip().startswith(EXPLAINED)]
+                for sql in captured:
+                    plan = query_plan(sql)
+                    self.assertEqual(full_scans(sql, plan), [], f"{sql}\n" + '\n'.join(plan))
+
+
+class SupervisorTests(SimpleTestCase):
+    """
+    Wznawianie procesów uzupełniających: interpreter, skrypt, katalog i środowisko nadzorcy, opóźnienie wykładnicze
+    po nieudanych uruchomieniach i rezygnacja po MAX_FAILURES z rzędu
+    """
+
+    def setUp(self):
+        self.logged = []
+        self.supervisor = Supervisor([Shard(0, 2), Shard(1, 2)], lambda shard: ['scrap-stats', '--shard', str(shard)],
+                                     log=self.logged.append)
+        patcher = mock.patch('stats.sharding.subprocess.Popen')
+        self.popen = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_spawn_uses_same_interpreter_script_and_environment(self):
+        self.supervisor.spawn(1)
+        args, kwargs = self.popen.call_args
+        self.assertEqual(args[0][:2], [sys.executable, os.path.abspath(sys.argv[0])])
+        self.assertEqual(args[0][2:], ['scrap-stats', '--shard', '1/2'])
+        self.assertEqual(kwargs['cwd'], os.getcwd())
+        self.assertEqual(kwargs['env'].get('DJANGO_SETTINGS_MODULE'), os.environ.get('DJANGO_SETTINGS_MODULE'))
+
+    def test_backoff_and_give_up(self):
+        delays = []
+        for _ in range(MAX_FAILURES):
+            self.supervisor.spawn(0)
+            self.supervisor.exited(0, 1)
+            if self.supervisor.restart_at[0] is not None:
+                delays.append(self.supervisor.restart_at[0] - self.supervisor.started[0])
+        self.assertEqual(len(delays), MAX_FAILURES - 1)
+        self.assertTrue(all(later > earlier for earlier, later in zip(delays, delays[1:])))
+        self.assertIsNone(self.supervisor.restart_at[0])
+        self.assertIn('kod 1', self.logged[-1])
+        self.assertIn('nie zostanie wznowiony', self.logged[-1])
+
+    def test_long_running_process_resets_failures(self):
+        self.supervisor.spawn(0)
+        self.supervisor.exited(0, 1)
+        self.supervisor.spawn(0)
+        self.supervisor.started[0] -= MIN_UPTIME
+        self.supervisor.exited(0, -15)
+        self.assertEqual(self.supervisor.failures[0], 0)
+        self.assertLessEqual(self.supervisor.restart_at[0], time.monotonic())
@@ -1,6 +1,6 @@
 from django.urls import path, register_converter
 
-from . import views, converters
+from . import api, views, converters
 
 register_converter(converters.DateConverter, 'date')
 
@@ -11,7 +11,20 @@ urlpatterns = [
     path('following', views.FollowingView.as_view(), name='following'),
     path('unfollow/<int:aid>', views.UnfollowView.as_view(), name='unfollow'),
     path('<int:aid>/<date:activity_date>', views.DetailView.as_view(), name='detail'),
+    path('<int:aid>/<date:activity_date>/related', views.RelatedAccountsView.as_view(), name='related'),
     path('export/<int:aid>', views.ExportAsXmlView.as_view(), name='export'),
+    path('leaderboard', views.LeaderboardView.as_view(), name='leaderboard'),
+    path('leaderboard.json', views.LeaderboardJsonView.as_view(), name='leaderboard_json'),
+    path('heatmap', views.HeatmapView.as_view(), name='heatmap'),
+    path('cache.json', views.CacheStatsView.as_view(), name='cache_stats'),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
+    path('live', views.LiveFeedView.as_view(), name='live'),
+    path('api/accounts/<int:aid>', api.AccountSummaryApiView.as_view(), name='api_account'),
+    path('api/accounts/<int:aid>/days', api.AccountDaysApiView.as_view(), name='api_account_days'),
+    path('api/accounts/<int:aid>/sessions/<date:activity_date>', api.AccountSessionsApiView.as_view(),
+         name='api_account_sessions'),
+    path('api/leaderboard', api.LeaderboardApiView.as_view(), name='api_leaderboard'),
+    path('api/search', api.SearchApiView.as_view(), name='api_search'),
     path('accounts/login', views.MyLoginView.as_view(), name='login'),
     path('accounts/logout', views.logout, name='logout'),
     path('accounts/register', views.RegistrationView.as_view(), name='register'),
@@ -1,5 +1,10 @@
-from datetime import date
+import hmac
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
+from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth.models import User
 from django.contrib.auth.tokens import PasswordResetTokenGenerator, default_token_generator
@@ -7,15 +12,27 @@ from django.contrib.auth.views import LoginView
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.exceptions import ValidationError
 from django.core.mail import send_mail
-from django.db.models import Min, Max, QuerySet
-from django.http import HttpResponse, Http404
+from django.db.models import Count, Max, Sum
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.utils.decorators import method_decorator
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.views import View
-
-from .forms import SearchAccountForm, FollowAccountForm, MyAuthenticationForm, RegistrationForm
-from .models import Account, Character, Activity, Following
+from django.views.decorators.http import condition
+
+from . import metrics
+from .archive import account_dates, archive_version, archived_activity, is_hot
+from .bitmaps import co_online, day_account_matrix, likely_alts
+from .caching import (CACHE_TIMEOUT, HOT_TIMEOUT, counters, dates_key, day_timeout, detail_key, get_or_set, hot_timeout,
+                      ranking_key, related_key, stats_cache)
+from .coverage import day_coverage, period_coverage
+from .exports import iter_activity_rows
+from .heatmaps import WEEKDAYS, heatmap
+from .forms import (SearchAccountForm, FollowAccountForm, MyAuthenticationForm, RegistrationForm, LeaderboardForm,
+                    HeatmapForm)
+from .leaderboards import Cursor, latest_leaderboard_date, leaderboard_page, parse_cursor, period_end, period_start
+from .models import Account, Character, Activity, Following, LeaderboardEntry, Tick, bits_str
 
 
 class IndexView(View):
@@ -75,18 +92,33 @@ class IndexView(View):
         })
         return form
 
+    @classmethod
+    def get_top_ranking(cls):
+        """
+        Zwraca ranking top 5 dla najnowszej daty aktywności; aktywności są w cache (unieważnianym przy zapisie każdej
+        minuty), a postacie czytane z bazy przy każdym żądaniu, bo odświeżanie profili zmienia nick, poziom i profesję
+        """
+        top = get_or_set('ranking', ranking_key(), cls.compute_top_ranking, hot_timeout())
+        characters = Character.objects.in_bulk([activity.character_id for activity in top['activity_list']])
+        return {
+            'date': top['date'],
+            'character_activity_list': [
+                (characters[activity.character_id], activity) for activity in top['activity_list']
+                if activity.character_id in characters
+            ]
+        }
+
     @staticmethod
-    def get_top_ranking():
+    def compute_top_ranking():
         """
-        Tworzy ranking pięcu postaci, które wykazały największą aktywność dla najnowszej daty aktywności w bazie
+        Tworzy ranking pięciu aktywności postaci, które wykazały największą aktywność dla najnowszej daty aktywności
+        w bazie
         """
         latest_activity_date = Activity.objects.aggregate(Max('date')).get('date__max')
-        activity_query_set = Activity.objects.filter(date=latest_activity_date)
-        top_activity = sorted(activity_query_set, key=lambda a: a.total_minutes, reverse=True)[:5]
-        top_character_activity = [(activity.character, activity) for activity in top_activity]
+        top_activity = Activity.objects.filter(date=latest_activity_date).order_by('-total_minutes')[:5]
         return {
             'date': latest_activity_date,
-            'character_activity_list': top_character_activity
+            'activity_list': list(top_activity)
         }
 
 
@@ -116,13 +148,13 @@ class FollowingView(View):
             'form': form if form is not None else FollowAccountForm()
         }
         if request.user.is_authenticated:
-            following_list = Following.objects.filter(user=request.user)
-            account_with_last_activity_date_list = []
-            for following in following_list:
-                account_activity = Activity.objects.filter(character__account=following.account)
-                latest_activity_date = account_activity.aggregate(Max('date')).get('date__max')
-                account_with_last_activity_date_list.append((following.account, latest_activity_date))
-            context['account_with_last_activity_date_list'] = account_with_last_activity_date_list
+            # ostatnia aktywność jest przechowywana w Account, więc wystarcza jedno zapytanie z JOIN
+            following_list = Following.objects.filter(user=request.user).select_related('account').order_by('id')
+            latest_tick = Tick.latest()
+            context['account_with_last_activity_date_list'] = [
+                (following.account, following.account.last_seen_date, following.account.is_online(latest_tick))
+                for following in following_list
+            ]
         return context
 
 
@@ -144,6 +176,10 @@ class DetailView(View):
     - niepoprawne id konta - przekierowanie na stronę główną (wyszukiwania)
     - niepoprawną datę - zwrócenie najnowszej (najstarszej, jeśli zaznaczono w formularzu) aktywności
     - dodanie konta do listy obserwowanych, jeśli zaznaczono w formularzu oraz użytkownik jest zalogowany
+    Lista dni aktywności i aktywności postaci w danym dniu są trzymane w cache (stats.caching) pod kluczami
+    (konto) i (konto, dzień); dzisiejsze wpisy unieważnia zapis minuty aktywności konta
+    Postacie są czytane z bazy przy każdym żądaniu - odświeżanie profili zmienia nick, poziom i profesję
+    Pokrycie dnia (stats.coverage) jest czytane przy każdym żądaniu - brakujące minuty są zaznaczone na wykresach
     """
     http_method_names = ['get']
 
@@ -155,8 +191,11 @@ class DetailView(View):
             return redirect('stats:index')
 
         unauthenticated_follow_attempt = self.handle_follow(request, account)
-        real_activity_date, character_activity_list = self.get_activity(request, account, activity_date)
-        all_activity_dates = self.get_all_activity_dates(account)
+        all_activity_dates = get_or_set(
+            'dates', dates_key(aid), lambda: self.get_all_activity_dates(account), hot_timeout()
+        )
+        real_activity_date = self.get_real_activity_date(request, activity_date, all_activity_dates)
+        character_activity_list = self.get_character_activity_list(account, real_activity_date)
 
         context = {
             'account': account,
@@ -164,7 +203,8 @@ class DetailView(View):
             'character_activity_list': character_activity_list,
             'activity_date': activity_date,
             'real_activity_date': real_activity_date,
-            'all_activity_dates': all_activity_dates
+            'all_activity_dates': all_activity_dates,
+            'coverage': day_coverage(real_activity_date),
         }
 
         return render(request, 'stats/detail.html', context)
@@ -180,87 +220,408 @@ class DetailView(View):
                 unauthenticated_follow_attempt = True
         return unauthenticated_follow_attempt
 
-    @classmethod
-    def get_activity(cls, request, account: Account, activity_date: date):
-        characters = Character.objects.filter(account=account)
-        activity_query_set, real_activity_date = cls.get_activity_query_set(request, account, activity_date)
-        character_activity_list = cls.get_character_activity_list(characters, activity_query_set)
-        return real_activity_date, character_activity_list
-
     @staticmethod
-    def get_activity_query_set(request, account: Account, activity_date: date):
-        activity_query_set = Activity.objects.filter(character__account=account, date=activity_date)
-
-        real_activity_date = activity_date
-        if not activity_query_set.exists():
-            activity_query_set = Activity.objects.filter(character__account=account)
+    def get_real_activity_date(request, activity_date: date, all_activity_dates: List[date]) -> Optional[date]:
+        """
+        Zwraca datę, dla której zostanie pokazana aktywność
+        Jeśli w podanym dniu nie ma aktywności, zwraca najnowszą (lub najstarszą, jeśli zaznaczono w formularzu) datę
+        Korzysta z listy wszystkich dat aktywności konta, więc nie wykonuje dodatkowych zapytań
+        """
+        if activity_date in all_activity_dates or not all_activity_dates:
+            return activity_date if all_activity_dates else None
 
-            no_date_option = request.session.get("no_date_option", "last")
-            if no_date_option == 'first':
-                agg_func, agg_field = Min, 'date__min'
-            else:
-                agg_func, agg_field = Max, 'date__max'
-            request.session.pop('no_date_option', None)
+        no_date_option = request.session.get("no_date_option", "last")
+        request.session.pop('no_date_option', None)
+        return all_activity_dates[0] if no_date_option == 'first' else all_activity_dates[-1]
 
-            real_activity_date = activity_query_set.aggregate(agg_func('date')).get(agg_field)
-            activity_query_set = activity_query_set.filter(date=real_activity_date)
-        return activity_query_set, real_activity_date
+    @classmethod
+    def get_character_activity_list(cls, account: Account, activity_date: Optional[date]):
+        """
+        Zwraca listę par (postać, aktywność w danym dniu lub None)
+        Postacie są czytane z bazy, a aktywności dnia z cache pod kluczem (konto, dzień)
+        """
+        characters = list(Character.objects.filter(account=account))
+        if activity_date is None:
+            return [(character, None) for character in characters]
+        day_activity = get_or_set(
+            'detail', detail_key(account.aid, activity_date),
+            lambda: cls.get_day_activity(characters, activity_date), day_timeout(activity_date)
+        )
+        return [(character, day_activity.get(character.pk)) for character in characters]
 
     @staticmethod
-    def get_character_activity_list(characters: QuerySet[Character], activity_query_set: QuerySet[Activity]):
-        character_activity_list = []
-        for character in characters:
-            try:
-                activity = activity_query_set.get(character=character)
-            except Activity.DoesNotExist:
-                activity = None
-            character_activity_list.append((character, activity))
-        return character_activity_list
+    def get_day_activity(characters: List[Character], activity_date: date) -> Dict[int, Activity]:
+        """
+        Zwraca słownik id postaci -> aktywność w danym dniu
+        Aktywność zamkniętych dni jest czytana z archiwum (stats.archive), a pozostałych - jednym zapytaniem z bazy
+        Wiersz z bazy ma pierwszeństwo, gdy dzień dograno po kompaktowaniu (do następnego kompaktowania)
+        Bitmapy z archiwum są kopiowane (180 bajtów), żeby słownik dało się zapisać w cache
+        """
+        day_activity = archived_activity(characters, activity_date)
+        for activity in day_activity.values():
+            activity.activity = bytes(activity.activity)
+        day_activity.update(
+            (activity.character_id, activity)
+            for activity in Activity.objects.filter(character__in=characters, date=activity_date)
+        )
+        return day_activity
 
     @staticmethod
-    def get_all_activity_dates(account: Account):
-        return (
+    def get_all_activity_dates(account: Account) -> List[date]:
+        dates = set(
             Activity.objects.filter(character__account=account)
             .values_list('date', flat=True)
             .distinct()
-            .order_by('date')
+            .order_by()
         )
+        worlds = set(Character.objects.filter(account=account).values_list('world', flat=True))
+        dates.update(account_dates(account.aid, worlds))
+        return sorted(dates)
+
+
+class RelatedAccountsView(View):
+    """
+    Widok reprezentujący stronę kont powiązanych z danym kontem w danym dniu, osobno dla każdego świata:
+    - konta najczęściej zalogowane w tym samym czasie
+    - prawdopodobne multikonta - konta, które nie grają jednocześnie, ale przejmują aktywność z minuty na minutę
+    Bitmapy wszystkich kont świata są wczytywane do jednej macierzy (stats.bitmaps); dla zamkniętego dnia macierz
+    i krawędzie sesji są zapamiętywane w procesie (day_account_matrix), więc kolejne konta tego świata i dnia jej
+    nie przebudowują. Wynik konta jest w cache pod kluczem (konto, dzień) - dla zamkniętych dni na CACHE_TIMEOUT,
+    dla dni aktualizowanych przez scraper na HOT_TIMEOUT (zapis minuty tych wpisów nie unieważnia)
+    """
+    http_method_names = ['get']
+    LIMIT = 10
+    MIN_HANDOFFS = 2
+
+    def get(self, request, aid: int, activity_date: date):
+        account = Account.objects.filter(pk=aid).first()
+        if account is None:
+            return redirect('stats:index')
+
+        related_list = get_or_set(
+            'related', related_key(aid, activity_date), lambda: self.get_related_list(account, activity_date),
+            HOT_TIMEOUT if is_hot(activity_date) else CACHE_TIMEOUT
+        )
+        context = {
+            'account': account,
+            'activity_date': activity_date,
+            'related_list': related_list,
+        }
+        return render(request, 'stats/related.html', context)
+
+    @classmethod
+    def get_related_list(cls, account: Account, activity_date: date) -> list:
+        """
+        Zwraca listę (świat, konta zalogowane razem, prawdopodobne multikonta) dla światów, na których konto grało
+        """
+        worlds = Character.objects.filter(account=account).values_list('world', flat=True).distinct().order_by('world')
+        related_list = []
+        for world in worlds:
+            matrix, edges = day_account_matrix(world, activity_date)
+            if matrix.index(account.aid) is None:
+                continue
+            related_list.append((
+                world,
+                co_online(matrix, account.aid, cls.LIMIT),
+                likely_alts(matrix, account.aid, cls.MIN_HANDOFFS, limit=cls.LIMIT, edges=edges),
+            ))
+        return related_list
+
+
+class LeaderboardView(View):
+    """
+    Widok reprezentujący stronę rankingów aktywności za dzień, tydzień lub miesiąc
+    Ranking można zawęzić do świata i profesji; jest stronicowany kluczem (parametry after/before i start,
+    stats.leaderboards.LeaderboardPage) zamiast numerem strony
+    Dane pochodzą ze zmaterializowanej tabeli rankingów, a strona jest czytana z indeksu rankingu bez OFFSET i COUNT,
+    więc czas odpowiedzi nie zależy od liczby aktywności w okresie ani od numeru strony
+    Strona podaje też, ile minut okresu nie zostało zapisanych (stats.coverage) - w nich aktywność jest nieznana
+    """
+    http_method_names = ['get']
+    PER_PAGE = 50
+    PAGE_PARAMS = ('after', 'before', 'start')
+
+    def get(self, request):
+        form, page, period, start = self.get_page(request)
+        query = request.GET.copy()
+        for name in self.PAGE_PARAMS:
+            query.pop(name, None)
+        context = {
+            'form': form,
+            'page': page,
+            'period': LeaderboardEntry.Period(period),
+            'period_start': start,
+            'coverage': period_coverage(start, period_end(period, start)),
+            'query': query.urlencode(),
+            'json_query': request.GET.urlencode(),
+        }
+        return render(request, 'stats/leaderboard.html', context)
+
+    @classmethod
+    def get_page(cls, request):
+        form = LeaderboardForm(request.GET)
+        data = form.cleaned_data if form.is_valid() else {}
+        period = data.get('period') or LeaderboardEntry.Period.DAY
+        day = data.get('date') or latest_leaderboard_date() or date.today()
+        if form.is_valid():
+            form = LeaderboardForm(initial={**data, 'period': period, 'date': day})
+        page = leaderboard_page(
+            period, day, data.get('world'), data.get('prof'), *cls.get_cursors(request.GET), per_page=cls.PER_PAGE
+        )
+        return form, page, period, period_start(period, day)
+
+    @staticmethod
+    def get_cursors(params) -> Tuple[Optional[Cursor], Optional[Cursor], int]:
+        """
+        :return: kursory after i before oraz pozycję start; niepoprawne wartości oznaczają pierwszą stronę
+        """
+        cursors = []
+        for name in ('after', 'before'):
+            try:
+                cursors.append(parse_cursor(params[name]) if params.get(name) else None)
+            except ValueError:
+                return None, None, 1
+        try:
+            start = int(params.get('start', 1))
+        except ValueError:
+            start = 1
+        return cursors[0], cursors[1], start
+
+
+class LeaderboardJsonView(LeaderboardView):
+    """
+    Widok zwracający ranking aktywności w formacie JSON (te same parametry co LeaderboardView)
+    `next` i `previous` to wartości parametrów after / before (razem ze `start`) sąsiednich stron
+    """
+
+    def get(self, request):
+        form, page, period, start = self.get_page(request)
+        return JsonResponse({
+            'period': period,
+            'period_start': start,
+            'start': page.start,
+            'next': {'after': page.next, 'start': page.next_start} if page.next else None,
+            'previous': {'before': page.previous, 'start': page.start} if page.previous else None,
+            'coverage': period_coverage(start, period_end(period, start)),
+            'results': [
+                {
+                    'position': position,
+                    'aid': entry.character.account_id,
+                    'cid': entry.character.cid,
+                    'world': entry.world,
+                    'nick': entry.character.nick,
+                    'lvl': entry.character.lvl,
+                    'prof': entry.character.prof,
+                    'minutes': entry.minutes,
+                    'finalized': entry.finalized,
+                }
+                for position, entry in page.rows
+            ]
+        })
+
+
+class HeatmapView(View):
+    """
+    Widok reprezentujący stronę "kiedy gracze są online" dla konta, świata lub wszystkich światów:
+    - heatmapę 7 x 24 (dzień tygodnia x godzina) ze średnią liczbą postaci online
+    - histogram minut dnia w przedziałach 15 minut
+    Domyślnie pokazuje ostatni tydzień
+    """
+    http_method_names = ['get']
+    BUCKET_MINUTES = 15
+
+    def get(self, request):
+        form = HeatmapForm(request.GET)
+        context = {'form': form}
+        if form.is_valid():
+            data = form.cleaned_data
+            context['form'] = HeatmapForm(initial=data)
+            result = heatmap(data['date_from'], data['date_to'], data.get('world') or None, data.get('aid'))
+            context.update({
+                'date_from': data['date_from'],
+                'date_to': data['date_to'],
+                'weekday_hour_rows': self.get_weekday_hour_rows(result.average_online()),
+                'minute_bars': self.get_minute_bars(result.minute_buckets(self.BUCKET_MINUTES)),
+            })
+        return render(request, 'stats/heatmap.html', context)
+
+    @staticmethod
+    def get_weekday_hour_rows(average: np.ndarray):
+        """
+        :return: listę (dzień tygodnia, lista (średnia, nasycenie koloru 0-1)) dla komórek heatmapy
+        """
+        peak = average.max() or 1
+        return [
+            (weekday, [(round(value, 1), round(value / peak, 3)) for value in row.tolist()])
+            for weekday, row in zip(WEEKDAYS, average)
+        ]
+
+    @classmethod
+    def get_minute_bars(cls, buckets: np.ndarray):
+        """
+        :return: listę (godzina początku przedziału, średnia, wysokość słupka w %) dla histogramu minut
+        """
+        peak = buckets.max() or 1
+        return [
+            (f"{i * cls.BUCKET_MINUTES // 60:02d}:{i * cls.BUCKET_MINUTES % 60:02d}", round(value, 1),
+             round(100 * value / peak, 1))
+            for i, value in enumerate(buckets.tolist())
+        ]
+
+
+def has_monitoring_access(request) -> bool:
+    """
+    Dostęp do widoków monitorowania (metryki, liczniki cache) wymaga nagłówka `Authorization: Bearer <token>`
+    z tokenem settings.STATS_METRICS_TOKEN - adres klienta nie wystarcza, bo za pośrednikiem na tym samym hoście
+    każde żądanie przychodzi z 127.0.0.1; bez skonfigurowanego tokenu widoki są wyłączone
+    """
+    token = getattr(settings, 'STATS_METRICS_TOKEN', '')
+    if not token:
+        return False
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode())
+
+
+class CacheStatsView(View):
+    """
+    Widok zwracający w formacie JSON liczniki trafień i chybień cache widoków (w bieżącym procesie serwera)
+    Dostępny tylko z tokenem monitorowania (has_monitoring_access) - dla pozostałych udaje, że adres nie istnieje
+    """
+    http_method_names = ['get']
+
+    def get(self, request):
+        if not has_monitoring_access(request):
+            raise Http404
+        return JsonResponse({
+            'backend': type(stats_cache()).__name__,
+            'counters': counters.snapshot(),
+        })
+
+
+class MetricsView(View):
+    """
+    Widok zwracający metryki procesu serwera (stats.metrics) w formacie tekstowym Prometheusa
+    Dostępny tylko z tokenem monitorowania (has_monitoring_access) - dla pozostałych udaje, że adres nie istnieje
+    """
+    http_method_names = ['get']
+
+    def get(self, request):
+        if not has_monitoring_access(request):
+            raise Http404
+        return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+class LiveFeedView(View):
+    """
+    Adres strumienia zmian online (stats.live) - pod ASGI obsługuje go LiveFeedRouter, zanim żądanie trafi do Django
+    Ten widok odpowiada tylko wtedy, gdy serwer działa przez WSGI (np. runserver), który strumienia nie obsługuje
+    """
+    http_method_names = ['get']
+
+    def get(self, request):
+        return JsonResponse({'error': "Strumień na żywo wymaga serwera ASGI (djangoProject.asgi)"}, status=503)
+
+
+def export_version(request, aid: int) -> Optional[tuple]:
+    """
+    :return: (koniec ostatniej minuty aktywności konta, liczba wierszy aktywności konta w bazie, suma ich minut,
+             wersja archiwum) - liczba i suma zmieniają się także przy dograniu minut z przeszłości (backfill-gaps)
+             i kompaktowaniu, które nie przesuwają ostatniej minuty; wyliczane raz na żądanie
+    """
+    if not hasattr(request, '_export_version'):
+        row = Account.objects.filter(pk=aid).annotate(
+            rows=Count('character__activity'), minutes=Sum('character__activity__total_minutes')
+        ).values_list('last_seen_date', 'last_seen_minute', 'rows', 'minutes').first()
+        if row is None or row[0] is None:
+            request._export_version = None
+        else:
+            last_seen_date, last_seen_minute, rows, minutes = row
+            last_seen = datetime.combine(last_seen_date, datetime.min.time()) + timedelta(minutes=last_seen_minute + 1)
+            request._export_version = (last_seen, rows, minutes or 0, archive_version())
+    return request._export_version
+
+
+def export_last_modified(request, aid: int) -> Optional[datetime]:
+    """
+    :return: koniec ostatniej minuty aktywności konta - dane eksportu zmieniają się głównie wtedy, gdy gracz gra;
+             zmiany bez nowej minuty (dogrywanie, kompaktowanie) wykrywa ETag, który ma pierwszeństwo
+    """
+    version = export_version(request, aid)
+    return version[0] if version is not None else None
+
+
+def export_etag(request, aid: int) -> Optional[str]:
+    version = export_version(request, aid)
+    if version is None:
+        return None
+    last_seen, rows, minutes, archived = version
+    return f'W/"{aid}-{last_seen:%Y%m%d%H%M}-{rows}-{minutes}-{archived}"'
 
 
 class ExportAsXmlView(View):
     """
     Widok reprezentujący link do pobrania danych konta w formacie XML
+    Dokument jest generowany strumieniowo z uporządkowanych wierszy bazy i archiwum, więc pamięć nie rośnie
+    z rozmiarem konta
+    Obsługuje kompresję gzip (gdy klient ją akceptuje) oraz ETag/Last-Modified na podstawie ostatniej aktywności konta
+    i wersji jego danych (export_version)
     """
     http_method_names = ['get']
     ACTIVITY_FORMAT = """<activity date="{}">\n\t{}</activity>"""
-    CHARACTER_FORMAT = """<character><cid>{}</cid><world>{}</world>{}</character>"""
-    XML_FORMAT = """<?xml version="1.0" encoding="ISO-8859-1" ?>\n<?xml-stylesheet type="text/xsl" href="meno-stats.xsl"?>\n<stats>\n\t<account>\n\t\t<aid>{}</aid>\n\t</account>\n\t{}\n</stats>"""
+    CHARACTER_START_FORMAT = """<character><cid>{}</cid><world>{}</world>"""
+    CHARACTER_END = """</character>"""
+    XML_START_FORMAT = """<?xml version="1.0" encoding="ISO-8859-1" ?>\n<?xml-stylesheet type="text/xsl" href="meno-stats.xsl"?>\n<stats>\n\t<account>\n\t\t<aid>{}</aid>\n\t</account>\n\t"""
+    XML_END = """\n</stats>"""
 
-    def get(self, request, aid: int):
+    @staticmethod
+    def get_account(aid: int) -> Account:
         try:
-            account = Account.objects.get(pk=aid)
+            return Account.objects.get(pk=aid)
         except Account.DoesNotExist:
-            return Http404(f"Konta z ID {aid} nie ma w bazie")
-
-        activity_query_set = Activity.objects.filter(character__account=account)
-        cid_world_list = activity_query_set.values_list('character__cid', 'character__world').distinct()
-        character_xml_list = []
-        for cid, world in cid_world_list:
-            activity_xml_list = []
-            for activity in activity_query_set.filter(character__cid=cid):
-                activity_xml_list.append(
-                    self.ACTIVITY_FORMAT.format(activity.date.strftime("%d-%m-%Y"), activity.bits_str)
-                )
-
-            character_xml_list.append(
-                self.CHARACTER_FORMAT.format(cid, world, "\n".join(activity_xml_list))
-            )
+            raise Http404(f"Konta z ID {aid} nie ma w bazie")
 
-        xml = self.XML_FORMAT.format(account.aid, "\n\t".join(character_xml_list))
-        return HttpResponse(xml, headers={
+    @method_decorator(condition(etag_func=export_etag, last_modified_func=export_last_modified))
+    def get(self, request, aid: int):
+        account = self.get_account(aid)
+        content = self.generate_xml(account)
+        headers = {
             'Content-Type': 'application/xml',
             'Content-Disposition': f'attachment; filename="account_{aid}.xml"',
-        })
+            'Vary': 'Accept-Encoding',
+        }
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            content = self.gzip(content)
+            headers['Content-Encoding'] = 'gzip'
+        return StreamingHttpResponse(content, headers=headers)
+
+    @classmethod
+    def generate_xml(cls, account: Account) -> Iterator[bytes]:
+        rows = (row[1:4] + row[5:] for row in iter_activity_rows(aid=account.aid))
+        yield cls.XML_START_FORMAT.format(account.aid).encode('iso-8859-1')
+        current = None
+        for cid, world, activity_date, activity in rows:
+            parts = []
+            if (cid, world) != current:
+                if current is not None:
+                    parts.append(cls.CHARACTER_END + "\n\t")
+                parts.append(cls.CHARACTER_START_FORMAT.format(cid, world))
+                current = (cid, world)
+            else:
+                parts.append("\n")
+            parts.append(cls.ACTIVITY_FORMAT.format(activity_date.strftime("%d-%m-%Y"), bits_str(activity)))
+            yield "".join(parts).encode('iso-8859-1', errors='xmlcharrefreplace')
+        if current is not None:
+            yield cls.CHARACTER_END.encode('iso-8859-1')
+        yield cls.XML_END.encode('iso-8859-1')
+
+    @staticmethod
+    def gzip(content: Iterator[bytes]) -> Iterator[bytes]:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        for chunk in content:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
 
 
 class MyLoginView(LoginView):